@@ -0,0 +1,109 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Server selection strategies
+
+$Id$
+"""
+
+from random import random
+from threading import Lock
+
+FAILOVER = 'failover'
+ROUND_ROBIN = 'round-robin'
+RANDOM = 'random'
+LEAST_OUTSTANDING = 'least-outstanding'
+LATENCY = 'latency'
+
+STRATEGIES = (FAILOVER, ROUND_ROBIN, RANDOM, LEAST_OUTSTANDING, LATENCY)
+
+
+class ServerBalancer(object):
+    """ Put server definitions into the order they should be tried in
+
+    - ``failover``: Always use the servers in the same order, the
+      first working server gets all traffic
+
+    - ``round-robin``: Rotate the starting point on every call
+
+    - ``random``: Random order, servers with a higher ``weight`` are
+      more likely to come first
+
+    - ``least-outstanding``: Servers with the fewest connections in use
+      come first
+
+    - ``latency``: Servers with the lowest average operation time come
+      first
+    """
+
+    def __init__(self, strategy=FAILOVER):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown server strategy "%s"' % strategy)
+
+        self.strategy = strategy
+        self.counter = 0
+        self.lock = Lock()
+
+    def order(self, servers, stats):
+        """ Return a new list with the given server definitions in order
+
+        `stats` maps server URLs to their ServerHealth statistics.
+        """
+        servers = list(servers)
+        if len(servers) < 2 or self.strategy == FAILOVER:
+            return servers
+
+        if self.strategy == ROUND_ROBIN:
+            self.lock.acquire()
+            try:
+                start = self.counter % len(servers)
+                self.counter += 1
+            finally:
+                self.lock.release()
+            return servers[start:] + servers[:start]
+
+        if self.strategy == RANDOM:
+            return self._weightedShuffle(servers)
+
+        if self.strategy == LEAST_OUTSTANDING:
+            decorated = [ (stats[x['url']].outstanding, i, x)
+                          for i, x in enumerate(servers) ]
+        else:
+            # Servers without measurements yet are tried first
+            decorated = [ (stats[x['url']].latency or 0.0, i, x)
+                          for i, x in enumerate(servers) ]
+        decorated.sort()
+        return [x[2] for x in decorated]
+
+    def _weightedShuffle(self, servers):
+        """ Random order, weighted by the server definition `weight`
+        """
+        result = []
+        while servers:
+            weights = [max(x.get('weight', 1), 0) for x in servers]
+            total = sum(weights)
+            if total <= 0:
+                # Only servers with weight 0 left, they are kept in order
+                result.extend(servers)
+                break
+
+            point = random() * total
+            for i in range(len(servers)):
+                if weights[i]:
+                    chosen = i
+                    point -= weights[i]
+                    if point < 0:
+                        break
+            result.append(servers.pop(chosen))
+
+        return result
+
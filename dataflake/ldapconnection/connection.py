@@ -19,28 +19,102 @@ $Id$
 """
 
 import codecs
+from copy import deepcopy
+try:
+    from hashlib import sha1 as sha_new
+except ImportError:
+    from sha import new as sha_new
 import ldap
 from ldap.dn import explode_dn
+try:
+    from ldap.controls.libldap import AssertionControl
+except ImportError: # python-ldap < 2.4 has no assertion control
+    AssertionControl = None
 from ldap.dn import dn2str
-from ldap.dn import str2dn
 from ldap.filter import filter_format
+try:
+    from ldap.extop import ExtendedRequest
+except ImportError: # python-ldap < 2.4 cannot send extended operations
+    ExtendedRequest = None
 from ldap.ldapobject import ReconnectLDAPObject
 import ldapurl
 import logging
+import os
+import Queue
 from random import random
+import sys
+from threading import Lock
+from threading import Thread
+import time
 
 from zope.interface import implements
 
 from dataflake.cache.simple import LockingSimpleCache
+from dataflake.ldapconnection.balancer import FAILOVER
+from dataflake.ldapconnection.balancer import ServerBalancer
+from dataflake.ldapconnection.entry import LazyEntry
+from dataflake.ldapconnection.health import ServerHealth
 from dataflake.ldapconnection.interfaces import ILDAPConnection
+from dataflake.ldapconnection.pool import close_connection
+from dataflake.ldapconnection.pool import CONNECTION_ERRORS
+from dataflake.ldapconnection.pool import ConnectionFactory
+from dataflake.ldapconnection.pool import PoolMaintainer
+from dataflake.ldapconnection.pool import PoolRegistry
+from dataflake.ldapconnection.resultcache import ResultCache
+from dataflake.ldapconnection.schema import load_subschema
+from dataflake.ldapconnection.schema import lower
+from dataflake.ldapconnection.schema import PARSE_ERRORS
+from dataflake.ldapconnection.schema import Subschema
+from dataflake.ldapconnection.search import SearchIterator
+from dataflake.ldapconnection.search import window_controls
+from dataflake.ldapconnection.search import window_total
+from dataflake.ldapconnection.utils import ascii_compatible
 from dataflake.ldapconnection.utils import BINARY_ATTRIBUTES
 from dataflake.ldapconnection.utils import escape_dn
+from dataflake.ldapconnection.utils import is_ascii
+from dataflake.ldapconnection.utils import normalize_dn
+from dataflake.ldapconnection.utils import parse_dn
 
 default_logger = logging.getLogger('dataflake.ldapconnection')
 connection_cache = LockingSimpleCache()
+_pool_lock = Lock()
+# Active Directory "fast concurrent bind" extended operation
+FAST_BIND_OID = '1.2.840.113556.1.4.1781'
+# Asynchronous python-ldap methods for write operations with a deadline
+ASYNC_OPERATIONS = { 'add': 'add_ext'
+                   , 'delete': 'delete_ext'
+                   , 'modify': 'modify_ext'
+                   , 'modify_ext': 'modify_ext'
+                   , 'modrdn': 'modrdn'
+                   , 'rename': 'rename'
+                   }
+# Seconds to wait before trying again to read a subschema that failed
+SCHEMA_RETRY_DELAY = 300
 _marker = ()
 
 
+def enable_fast_bind(conn):
+    """ Switch on "fast concurrent bind" mode if the server supports it
+    """
+    if ExtendedRequest is None:
+        return
+
+    try:
+        root_dse = conn.search_s( ''
+                                , ldap.SCOPE_BASE
+                                , '(objectClass=*)'
+                                , ['supportedExtension']
+                                )
+        extensions = []
+        for dn, rec in root_dse:
+            extensions.extend(rec.get('supportedExtension', []))
+        if FAST_BIND_OID in extensions:
+            conn.extop_s(ExtendedRequest(FAST_BIND_OID))
+    except ldap.LDAPError:
+        # Fast binds are an optimization, normal binds work too
+        pass
+
+
 class LDAPConnection(object):
     """ LDAPConnection object
 
@@ -53,18 +127,54 @@ class LDAPConnection(object):
                 , c_factory=ReconnectLDAPObject, rdn_attr='', bind_dn=''
                 , bind_pwd='', read_only=False
                 , conn_timeout=-1, op_timeout=-1, logger=None
+                , pool_size=5, pool_min_size=0, pool_timeout=-1
+                , max_pools=10, verify_pool_size=2
+                , breaker_threshold=1, breaker_backoff=30
+                , server_strategy=FAILOVER, race_delay=-1
+                , keepalive_interval=-1, pool_max_lifetime=-1
+                , pool_max_idle=-1, page_size=-1
+                , cache_timeout=-1, cache_size=1000
+                , negative_cache_timeout=-1, entry_cache_timeout=-1
+                , delta_threshold=-1, ldap_encoding='UTF-8'
+                , api_encoding='iso-8859-15', binary_attributes=()
+                , binary_from_schema=False, use_schema=False
+                , schema_file=''
                 ):
         """ LDAPConnection initialization
         """
         # Empty values here mean "use unicode"
-        self.ldap_encoding = 'UTF-8'
-        self.api_encoding = 'iso-8859-15'
+        self.ldap_encoding = ldap_encoding
+        self.api_encoding = api_encoding
 
         self.bind_dn = bind_dn
         self.bind_pwd = bind_pwd
         self.read_only = read_only
         self.c_factory = c_factory
         self._logger = logger
+        self.pool_size = pool_size
+        self.pool_min_size = pool_min_size
+        self.pool_timeout = pool_timeout
+        self.max_pools = max_pools
+        self.verify_pool_size = verify_pool_size
+        self.breaker_threshold = breaker_threshold
+        self.breaker_backoff = breaker_backoff
+        # Fail early on unknown strategies
+        ServerBalancer(server_strategy)
+        self.server_strategy = server_strategy
+        self.race_delay = race_delay
+        self.keepalive_interval = keepalive_interval
+        self.pool_max_lifetime = pool_max_lifetime
+        self.pool_max_idle = pool_max_idle
+        self.page_size = page_size
+        self.cache_timeout = cache_timeout
+        self.cache_size = cache_size
+        self.negative_cache_timeout = negative_cache_timeout
+        self.entry_cache_timeout = entry_cache_timeout
+        self.delta_threshold = delta_threshold
+        self.binary_attributes = tuple(binary_attributes)
+        self.binary_from_schema = binary_from_schema
+        self.use_schema = use_schema
+        self.schema_file = schema_file
         self.hash = id(self) + random()
 
         self.servers = {}
@@ -79,7 +189,14 @@ class LDAPConnection(object):
 
         return self._logger
 
-    def addServer(self, host, port, protocol, conn_timeout=-1, op_timeout=-1):
+    def addServer( self
+                 , host
+                 , port
+                 , protocol
+                 , conn_timeout=-1
+                 , op_timeout=-1
+                 , weight=1
+                 ):
         """ Add a server definition to the list of servers used
         """
         start_tls = False
@@ -92,6 +209,7 @@ class LDAPConnection(object):
                                    , 'conn_timeout' : conn_timeout
                                    , 'op_timeout' : op_timeout
                                    , 'start_tls': start_tls
+                                   , 'weight': weight
                                    }
 
     def removeServer(self, host, port, protocol):
@@ -107,7 +225,59 @@ class LDAPConnection(object):
 
         This method returns an instance of the underlying `python-ldap` 
         connection class. It does not need to be called explicitly, all
-        other operations call it implicitly.
+        other operations check out a pooled connection implicitly.
+
+        The connection is already back in the pool when it is returned,
+        other threads may check it out and use it at the same time.
+        """
+        pool, conn = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
+        pool.checkin(conn)
+
+        return conn
+
+    def warm_up(self, n=None):
+        """ Open and bind pooled connections ahead of time
+        """
+        if len(self.servers.keys()) == 0:
+            raise RuntimeError('No servers defined')
+
+        if n is None:
+            n = max(self.pool_min_size, 1)
+        bind_dn = escape_dn(self._encode_incoming(self.bind_dn))
+        bind_pwd = self._encode_incoming(self.bind_pwd)
+
+        e = None
+        warmed = 0
+        for server in self._iterServers():
+            pool = self._getPool(server, bind_dn, bind_pwd, self.pool_min_size)
+            try:
+                pool.fill(size=n)
+            except CONNECTION_ERRORS, e:
+                continue
+
+            warmed += 1
+            if self.server_strategy == FAILOVER:
+                break
+
+        if not warmed:
+            msg = 'Failure connecting, last attempt: %s (%s)' % (
+                        server['url'], str(e or 'no exception'))
+            self.logger().critical(msg, exc_info=1)
+            raise e
+
+    def _checkout(self, bind_dn=None, bind_pwd=None):
+        """ Private helper to get a bound connection out of a pool
+
+        Connections bound with the configured credentials are pooled by 
+        server and credentials, so they are re-used without binding 
+        again. Connections for credentials passed in by the caller, e.g.
+        for user logins, come out of a separate pool per server and are
+        re-bound as needed, so they never push the pools for the 
+        configured credentials out. Servers are tried in order until a 
+        connection can be made, see `_iterServers`.
+
+        Returns a (pool, connection) tuple. The caller is responsible for
+        handing the connection back to the pool when it is done with it.
         """
         if len(self.servers.keys()) == 0:
             raise RuntimeError('No servers defined')
@@ -115,83 +285,678 @@ class LDAPConnection(object):
         if bind_dn is None:
             bind_dn = escape_dn(self._encode_incoming(self.bind_dn))
             bind_pwd = self._encode_incoming(self.bind_pwd)
+            per_call = False
+
+            def getPool(server):
+                return self._getPool( server
+                                    , bind_dn
+                                    , bind_pwd
+                                    , self.pool_min_size
+                                    )
         else:
             bind_dn = escape_dn(self._encode_incoming(bind_dn))
             bind_pwd = self._encode_incoming(bind_pwd)
+            per_call = True
+            getPool = self._getUserPool
+
+        servers = list(self._iterServers())
+        raced = {}
+        if self.race_delay >= 0 and len(servers) > 1:
+            # Servers with idle connections need no new connection at all
+            with_idle = [x for x in servers if getPool(x).idle]
+            if with_idle:
+                servers = with_idle + [x for x in servers if x not in with_idle]
+            else:
+                winner, raced_conn = self._raceConnections( servers
+                                                          , bind_dn
+                                                          , bind_pwd
+                                                          )
+                servers = [winner] + [x for x in servers if x is not winner]
+                raced[winner['url']] = raced_conn
+
+        e = None
+        for server in servers:
+            pool = getPool(server)
+            factory = None
+            if per_call:
+                # New connections are bound with the caller's credentials
+                factory = self._getFactory(server, bind_dn, bind_pwd)
+
+            # The raced connection is only used for this checkout
+            conn = raced.pop(server['url'], None)
+            if conn is not None and not pool.adopt(conn):
+                # Other threads filled the pool in the meantime
+                close_connection(conn)
+                conn = None
 
-        conn = self._getConnection()
-        if conn is None:
-            for server in self.servers.values():
-                try:
-                    conn = self._connect( server['url']
-                                        , conn_timeout=server['conn_timeout']
-                                        , op_timeout=server['op_timeout']
-                                        )
-                    if server.get('start_tls', None):
-                        conn.start_tls_s()
+            try:
+                if pool.size < pool.min_size:
+                    pool.fill(factory)
+                if conn is None:
+                    conn = pool.checkout(factory)
+                break
+            except CONNECTION_ERRORS, e:
+                if conn is not None:
+                    # Filling up can wait, the raced connection works
                     break
-                except (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.LOCAL_ERROR), e:
-                    conn = None
-                    continue
+                continue
+        else:
+            msg = 'Failure connecting, last attempt: %s (%s)' % (
+                        server['url'], str(e or 'no exception'))
+            self.logger().critical(msg, exc_info=1)
+            raise e
 
-            if conn is None:
-                exception_string = str(e or 'no exception')
-                msg = 'Failure connecting, last attempt: %s (%s)' % (
-                            server['url'], str(e or 'no exception'))
-                self.logger().critical(msg, exc_info=1)
+        for unused in raced.values():
+            # An idle connection became available in the meantime
+            close_connection(unused)
 
-                if e:
-                    raise e
+        # The connection may have been re-bound by whoever used it after 
+        # getting it from the public `connect` method
+        try:
+            last_bind = getattr(conn, '_last_bind', None)
+            if ( not last_bind or
+                 last_bind[1][0] != bind_dn or
+                 last_bind[1][1] != bind_pwd ):
+                conn.simple_bind_s(bind_dn, bind_pwd)
+        except:
+            pool.discard(conn)
+            raise
 
-            connection_cache.set(self.hash, conn)
+        return pool, conn
 
-        last_bind = getattr(conn, '_last_bind', None)
-        if ( not last_bind or
-             last_bind[1][0] != bind_dn or
-             last_bind[1][1] != bind_pwd ):
-            conn.simple_bind_s(bind_dn, bind_pwd)
+    def _getPool(self, server, bind_dn, bind_pwd, min_size=0):
+        """ Private helper to get the pool for a server and credentials
 
-        return conn
+        The credentials are assumed to have been encoded already.
+        """
+        pwd_hash = self._hashPassword(bind_pwd)
+        factory = self._getFactory(server, bind_dn, bind_pwd)
+        pool = self._getPools().get( (server['url'], bind_dn, pwd_hash)
+                                   , min_size=min_size
+                                   , stats=factory.stats
+                                   , factory=factory
+                                   )
+        # Server definitions may have changed since the pool was made
+        pool.factory = factory
+        return pool
+
+    def _getUserPool(self, server):
+        """ Private helper to get the pool for credentials passed by callers
+
+        There is one such pool per server. Its connections are bound with
+        whatever credentials they were last used with.
+        """
+        factory = self._getFactory(server)
+        pool = self._getUserPools().get( server['url']
+                                       , stats=factory.stats
+                                       , factory=factory
+                                       )
+        pool.factory = factory
+        return pool
+
+    def _getFactory(self, server, bind_dn=None, bind_pwd=None, setup=None):
+        """ Private helper to get a connection factory for a server
+
+        The outcome of connection attempts is recorded in the server's 
+        health statistics.
+        """
+        return ConnectionFactory( self.c_factory
+                                , server
+                                , bind_dn=bind_dn
+                                , bind_pwd=bind_pwd
+                                , stats=self._getHealth(server['url'])
+                                , setup=setup
+                                )
+
+    def _raceConnections(self, servers, bind_dn, bind_pwd):
+        """ Private helper to open connections to several servers at once
+
+        A connection attempt to the first server is started. If it has 
+        not succeeded after `race_delay` seconds, or as soon as it fails,
+        an attempt to the next server is started in parallel, and so on.
+        The first connection that is bound wins, connections that succeed
+        later are closed.
+
+        Returns a (server, connection) tuple.
+        """
+        results = Queue.Queue()
+        lock = Lock()
+        state = {'done': False}
 
-    def _getConnection(self):
-        """ Private helper to get my connection out of the cache
+        def attempt(server, factory):
+            try:
+                conn = factory()
+            except:
+                results.put((server, None, sys.exc_info()))
+                return
+
+            lock.acquire()
+            try:
+                won = not state['done']
+                state['done'] = True
+            finally:
+                lock.release()
+
+            if won:
+                results.put((server, conn, None))
+            else:
+                close_connection(conn)
+
+        # The factories are made here, the threads do not touch `self`
+        pending = [ (x, self._getFactory(x, bind_dn, bind_pwd))
+                    for x in servers ]
+        running = 0
+        exc_info = None
+        while pending or running:
+            if pending:
+                thread = Thread(target=attempt, args=pending.pop(0))
+                thread.setDaemon(True)
+                thread.start()
+                running += 1
+
+            try:
+                if pending:
+                    result = results.get(True, self.race_delay)
+                else:
+                    result = results.get()
+            except Queue.Empty:
+                continue
+
+            running -= 1
+            server, conn, exc_info = result
+            if conn is not None:
+                return server, conn
+
+            if not isinstance(exc_info[1], CONNECTION_ERRORS):
+                # Not a connection problem, e.g. INVALID_CREDENTIALS
+                lock.acquire()
+                state['done'] = True
+                lock.release()
+                break
+
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _iterServers(self):
+        """ Private helper to iterate over the servers to try in order
+
+        The order is determined by the server selection strategy.
+        Servers with an open circuit breaker are skipped. They are only 
+        tried after all other servers have failed.
         """
-        return connection_cache.get(self.hash)
+        stats = {}
+        for server_url in self.servers.keys():
+            stats[server_url] = self._getHealth(server_url)
+        servers = self._getBalancer().order(self.servers.values(), stats)
+
+        skipped = []
+        for server in servers:
+            if stats[server['url']].available():
+                yield server
+            else:
+                skipped.append(server)
 
-    def _connect( self
-                , connection_string
-                , conn_timeout=5
-                , op_timeout=-1
-                ):
-        """ Factored out to allow usage by other pieces 
+        for server in skipped:
+            yield server
+
+    def _hashPassword(self, bind_pwd):
+        """ Private helper to hash an encoded password for use in keys
+        """
+        pwd_hash = bind_pwd or ''
+        if isinstance(pwd_hash, unicode):
+            pwd_hash = pwd_hash.encode('UTF-8')
+
+        return sha_new(pwd_hash).hexdigest()
+
+    def _getHealth(self, server_url):
+        """ Private helper to get the health statistics for a server
+        """
+        key = (self.hash, 'health', server_url)
+        health = connection_cache.get(key)
+        if health is None:
+            _pool_lock.acquire()
+            try:
+                health = connection_cache.get(key)
+                if health is None:
+                    health = ServerHealth( threshold=self.breaker_threshold
+                                         , backoff=self.breaker_backoff
+                                         )
+                    connection_cache.set(key, health)
+            finally:
+                _pool_lock.release()
+
+        return health
+
+    def _getBalancer(self):
+        """ Private helper to get the server balancer for my strategy
+        """
+        key = (self.hash, 'balancer')
+        balancer = connection_cache.get(key)
+        if balancer is None or balancer.strategy != self.server_strategy:
+            _pool_lock.acquire()
+            try:
+                balancer = connection_cache.get(key)
+                if ( balancer is None or 
+                     balancer.strategy != self.server_strategy ):
+                    balancer = ServerBalancer(self.server_strategy)
+                    connection_cache.set(key, balancer)
+            finally:
+                _pool_lock.release()
+
+        return balancer
+
+    def getServerHealth(self):
+        """ Get health statistics for all servers
+        """
+        health = {}
+        for server_url in self.servers.keys():
+            health[server_url] = self._getHealth(server_url).info()
+
+        return health
+
+    def verify_credentials(self, dn, pwd):
+        """ Check a DN and password by binding with them
+
+        The bind happens on a separate pool of connections that are only 
+        used for binding, so connections bound with the configured 
+        credentials are not affected. If the server supports the Active 
+        Directory "fast concurrent bind" mode it is switched on for these 
+        connections.
+        """
+        if len(self.servers.keys()) == 0:
+            raise RuntimeError('No servers defined')
+
+        dn = escape_dn(self._encode_incoming(dn))
+        pwd = self._encode_incoming(pwd)
+        if not dn or not pwd:
+            # Most servers treat a bind with an empty password as an 
+            # anonymous bind, which does not prove anything
+            return False
+
+        pools = self._getVerifyPools()
+        e = None
+        for server in self._iterServers():
+            factory = self._getFactory(server, setup=enable_fast_bind)
+            pool = pools.get( server['url']
+                            , stats=factory.stats
+                            , factory=factory
+                            )
+            pool.factory = factory
+
+            try:
+                conn = pool.checkout()
+            except CONNECTION_ERRORS, e:
+                continue
+
+            # Connections are only opened lazily by python-ldap, so this 
+            # bind may be the first time the server is contacted.
+            try:
+                conn.simple_bind_s(dn, pwd)
+            except ldap.INVALID_CREDENTIALS:
+                pool.checkin(conn)
+                return False
+            except CONNECTION_ERRORS, e:
+                factory.stats.failure()
+                pool.discard(conn)
+                continue
+            except:
+                pool.discard(conn)
+                raise
+
+            pool.checkin(conn)
+            return True
+
+        msg = 'Failure connecting, last attempt: %s (%s)' % (
+                    server['url'], str(e or 'no exception'))
+        self.logger().critical(msg, exc_info=1)
+        raise e
 
-        user_dn is assumed to have been encoded/escaped correctly
+    def _getResultCache(self):
+        """ Private helper to get my search result cache
+
+        Returns None if result caching is disabled.
+        """
+        return self._getCache('results', self.cache_timeout)
+
+    def _getNegativeCache(self):
+        """ Private helper to get my cache for searches that found nothing
+
+        Returns None if negative caching is disabled.
+        """
+        return self._getCache('negative', self.negative_cache_timeout)
+
+    def _getEntryCache(self):
+        """ Private helper to get my cache of single records by DN
+
+        Returns None if entry caching is disabled.
+        """
+        return self._getCache('entries', self.entry_cache_timeout)
+
+    def _getCache(self, name, timeout):
+        """ Private helper to get one of my result caches out of the cache
+        """
+        if timeout <= 0:
+            return None
+
+        key = (self.hash, name)
+        max_size = max(self.cache_size, 1)
+        cache = connection_cache.get(key)
+        if ( cache is None or 
+             cache.timeout != timeout or 
+             cache.max_size != max_size ):
+            _pool_lock.acquire()
+            try:
+                cache = connection_cache.get(key)
+                if ( cache is None or 
+                     cache.timeout != timeout or 
+                     cache.max_size != max_size ):
+                    cache = ResultCache(timeout=timeout, max_size=max_size)
+                    connection_cache.set(key, cache)
+            finally:
+                _pool_lock.release()
+
+        return cache
+
+    def _getBinaryAttributes(self, load=True):
+        """ Private helper to get the lowercased names of binary attributes
+
+        These are the names in BINARY_ATTRIBUTES and the 
+        `binary_attributes` setting, plus all attributes with a binary
+        syntax in the server subschema if `binary_from_schema` or 
+        `use_schema` is set. With `load` false the subschema is only 
+        used if it has been read already, see `_getSubschema`.
+        """
+        key = (self.hash, 'binary')
+        from_schema = self.binary_from_schema or self.use_schema
+        settings = (self.binary_attributes, from_schema)
+        registry = connection_cache.get(key)
+        if registry is not None and registry[0] == settings:
+            return registry[1]
+
+        names = [x.lower() for x in BINARY_ATTRIBUTES+self.binary_attributes]
+        names = frozenset(names)
+        if from_schema:
+            schema = self._getSubschema(load)
+            if schema is None:
+                # Try again once the subschema is available
+                return names
+            names = names.union(schema.binary)
+
+        connection_cache.set(key, (settings, names))
+        return names
+
+    def _getSubschema(self, load=True):
+        """ Private helper to get the server subschema
+
+        The subschema is read once and kept. If `schema_file` is set it 
+        is read from that file if it exists, or saved to the file after 
+        reading it from the server. A file that cannot be parsed is 
+        ignored. Returns None if the subschema cannot be read or parsed,
+        reading it is tried again after SCHEMA_RETRY_DELAY seconds.
+
+        Reading the subschema needs a pooled connection. Callers holding
+        a connection already must pass a false `load`, then None is 
+        returned unless the subschema has been read before.
+        """
+        key = (self.hash, 'schema')
+        cached = connection_cache.get(key)
+        if cached is not None:
+            schema, retry_at = cached
+            if schema is not None or not load or retry_at > time.time():
+                return schema
+        elif not load:
+            return None
+
+        schema = None
+        if self.schema_file and os.path.exists(self.schema_file):
+            try:
+                schema = load_subschema(self.schema_file)
+            except (IOError, OSError) + PARSE_ERRORS, e:
+                msg = 'Cannot load the subschema from %s: %s' % ( 
+                        self.schema_file, str(e))
+                self.logger().warning(msg)
+
+        if schema is None:
+            try:
+                schema = Subschema(self._readSubschema('attributeTypes'))
+            except (ldap.LDAPError,) + PARSE_ERRORS, e:
+                msg = 'Cannot read the subschema: %s' % str(e)
+                self.logger().warning(msg)
+                retry_at = time.time() + SCHEMA_RETRY_DELAY
+                connection_cache.set(key, (None, retry_at))
+                return None
+
+            if self.schema_file:
+                try:
+                    schema.save(self.schema_file)
+                except (IOError, OSError), e:
+                    msg = 'Cannot save the subschema to %s: %s' % (
+                            self.schema_file, str(e))
+                    self.logger().warning(msg)
+
+        connection_cache.set(key, (schema, None))
+        return schema
+
+    def _getSchemaInfo(self):
+        """ Private helper to get the subschema for insert and modify
+
+        Returns None unless `use_schema` is set.
         """
-        connection = self.c_factory(connection_string)
+        if not self.use_schema:
+            return None
+
+        return self._getSubschema()
+
+    def _readSubschema(self, attr):
+        """ Private helper to read values from the server's subschema entry
 
-        # Deny auto-chasing of referrals to be safe, we handle them instead
+        Returns an empty list if the server does not publish a subschema.
+        """
+        pool, connection = self._checkout()
         try:
-            connection.set_option(ldap.OPT_REFERRALS, ldap.DEREF_NEVER)
-        except ldap.LDAPError: # Cannot set referrals, so do nothing
-            pass
+            subentry = connection.search_subschemasubentry_s()
+            if not subentry:
+                return []
+            rec_dict = connection.read_subschemasubentry_s(subentry, [attr])
+        finally:
+            pool.checkin(connection)
+
+        for key, values in (rec_dict or {}).items():
+            if key.lower() == attr.lower():
+                return values
+
+        return []
+
+    def _invalidateResults(self, dn, subtree=False):
+        """ Private helper to drop cached results affected by a change
+
+        `dn` is assumed to have been encoded and escaped already.
+        """
+        dn = dn.lower()
+        for name in ('results', 'negative'):
+            cache = connection_cache.get((self.hash, name))
+            if cache is not None:
+                cache.invalidate(dn, subtree=subtree)
+
+        cache = connection_cache.get((self.hash, 'entries'))
+        if cache is not None:
+            cache.invalidate(dn, subtree=subtree, ancestors=False)
+
+    def _cacheIdentity(self, bind_dn, bind_pwd):
+        """ Private helper to get the bind identity part of cache keys
+        """
+        if bind_dn is None:
+            bind_dn = self.bind_dn
+            bind_pwd = self.bind_pwd
 
-        # Set the connection timeout
-        if conn_timeout > 0:
-            connection.set_option(ldap.OPT_NETWORK_TIMEOUT, conn_timeout)
+        return ( normalize_dn(self._encode_incoming(bind_dn)) or ''
+               , self._hashPassword(self._encode_incoming(bind_pwd))
+               )
 
-        # Set the operations timeout
-        if op_timeout > 0:
-            connection.timeout = op_timeout
+    def _getCachedEntry( self, cache, dn, fltr, attrs, identity, raw
+                       , lazy=False ):
+        """ Private helper to answer a base search out of the entry cache
 
-        return connection
+        `dn` and `fltr` are assumed to have been encoded already, `dn`
+        must be normalized. The cache holds the records as returned by 
+        the server, they are converted like search results according to 
+        `raw` and `lazy`. Returns None if the search cannot be answered.
+        """
+        if fltr.lower() != '(objectclass=*)':
+            # Filters cannot be evaluated without the server
+            return None
+
+        rec_dict = cache.get((dn, identity))
+        if rec_dict is None:
+            return None
+
+        if attrs is not None:
+            keys = {}
+            for key in rec_dict.keys():
+                keys[key.lower()] = key
+            keys['dn'] = 'dn'
+            wanted = {'dn': rec_dict['dn']}
+            for attr in attrs:
+                key = keys.get(attr.lower())
+                if key is None:
+                    # Not part of the record or an operational attribute
+                    return None
+                wanted[key] = rec_dict[key]
+            rec_dict = wanted
+
+        return { 'size': 1
+               , 'results': [self._decodeRawEntry(rec_dict, raw, lazy)]
+               , 'exception': ''
+               }
+
+    def _setCachedEntries(self, cache, result, identity):
+        """ Private helper to put the raw records found by a search into 
+        the entry cache
+        """
+        for rec_dict in result['results']:
+            dn = normalize_dn(rec_dict['dn'])
+            cache.set((dn, identity), dn, deepcopy(rec_dict))
+
+    def _getPools(self):
+        """ Private helper to get my connection pools out of the cache
+        """
+        return self._getRegistry( self.hash
+                                , max_pools=self.max_pools
+                                , max_size=self.pool_size
+                                , timeout=self.pool_timeout
+                                , max_lifetime=self.pool_max_lifetime
+                                , max_idle=self.pool_max_idle
+                                )
+
+    def _getUserPools(self):
+        """ Private helper to get my pools for per-call credentials
+        """
+        return self._getRegistry( (self.hash, 'users')
+                                , max_pools=self.max_pools
+                                , max_size=self.pool_size
+                                , timeout=self.pool_timeout
+                                , max_lifetime=self.pool_max_lifetime
+                                , max_idle=self.pool_max_idle
+                                )
+
+    def _getVerifyPools(self):
+        """ Private helper to get my bind-only connection pools
+        """
+        return self._getRegistry( (self.hash, 'verify')
+                                , max_pools=self.max_pools
+                                , max_size=self.verify_pool_size
+                                , timeout=self.pool_timeout
+                                , max_lifetime=self.pool_max_lifetime
+                                , max_idle=self.pool_max_idle
+                                )
+
+    def _getReferralPools(self):
+        """ Private helper to get my pools of referral target connections
+        """
+        return self._getRegistry( (self.hash, 'referral')
+                                , max_pools=self.max_pools
+                                , max_size=self.pool_size
+                                , timeout=self.pool_timeout
+                                , max_lifetime=self.pool_max_lifetime
+                                , max_idle=self.pool_max_idle
+                                )
+
+    def _registryKeys(self):
+        """ Private helper to list the cache keys of all my pool registries
+        """
+        return ( self.hash
+               , (self.hash, 'users')
+               , (self.hash, 'verify')
+               , (self.hash, 'referral')
+               )
+
+    def _getRegistry(self, key, **settings):
+        """ Private helper to get a pool registry out of the cache
+        """
+        pools = connection_cache.get(key)
+        if pools is None:
+            _pool_lock.acquire()
+            try:
+                pools = connection_cache.get(key)
+                if pools is None:
+                    pools = PoolRegistry(**settings)
+                    connection_cache.set(key, pools)
+                    if self.keepalive_interval > 0:
+                        self._startMaintainer()
+            finally:
+                _pool_lock.release()
+
+        return pools
+
+    def _startMaintainer(self):
+        """ Private helper to start the background pool maintainer thread
+
+        Must be called with `_pool_lock` held.
+        """
+        key = (self.hash, 'maintainer')
+        maintainer = connection_cache.get(key)
+        if maintainer is not None and maintainer.isAlive():
+            return
+
+        maintainer = PoolMaintainer( connection_cache
+                                   , key
+                                   , self._registryKeys()
+                                   , self.keepalive_interval
+                                   )
+        connection_cache.set(key, maintainer)
+        maintainer.start()
+
+    def _getConnection(self):
+        """ Private helper to get my most recently used connection
+        """
+        latest = None
+        for key in (self.hash, (self.hash, 'users')):
+            pools = connection_cache.get(key)
+            if pools is None:
+                continue
+            for pool_key, pool in pools.items():
+                if ( pool.last_used is not None and 
+                     ( latest is None or 
+                       pool.last_checkout > latest.last_checkout ) ):
+                    latest = pool
+
+        if latest is None:
+            return None
+
+        return latest.last_used
 
     def disconnect(self):
-        """ Unbind the connection and invalidate the cache
+        """ Unbind all pooled connections and invalidate the cache
         """
-        conn = self._getConnection()
-        if conn is not None:
-            connection_cache.invalidate(self.hash)
-            conn.unbind_s()
+        maintainer = connection_cache.get((self.hash, 'maintainer'))
+        if maintainer is not None:
+            connection_cache.invalidate((self.hash, 'maintainer'))
+            maintainer.stop()
+
+        for key in self._registryKeys():
+            pools = connection_cache.get(key)
+            if pools is not None:
+                connection_cache.invalidate(key)
+                pools.close()
 
     def search( self
               , base
@@ -202,59 +967,449 @@ class LDAPConnection(object):
               , bind_dn=None
               , bind_pwd=None
               , raw=False
+              , page_size=None
+              , sizelimit=0
+              , timelimit=-1
+              , deadline=None
+              , use_cache=True
+              , lazy=False
               ):
         """ Search for entries in the database
         """
+        cache = negative_cache = entry_cache = None
+        if use_cache:
+            cache = self._getResultCache()
+            negative_cache = self._getNegativeCache()
+            entry_cache = self._getEntryCache()
+        if cache is None and negative_cache is None and entry_cache is None:
+            return self._search( base, scope, fltr, attrs, convert_filter
+                               , bind_dn, bind_pwd, raw, page_size
+                               , sizelimit, timelimit, deadline, lazy
+                               )
+
+        if convert_filter:
+            fltr = self._encode_incoming(fltr)
+        norm_base = normalize_dn(self._encode_incoming(base))
+        attr_names = None
+        if attrs is not None:
+            attr_names = [x.lower() for x in attrs]
+            attr_names.sort()
+            attr_names = tuple(attr_names)
+        identity = self._cacheIdentity(bind_dn, bind_pwd)
+        key = ( norm_base, scope, fltr, attr_names, identity, raw, sizelimit
+              , lazy
+              )
+
+        if entry_cache is not None and scope == ldap.SCOPE_BASE:
+            result = self._getCachedEntry( entry_cache
+                                         , norm_base
+                                         , fltr
+                                         , attrs
+                                         , identity
+                                         , raw
+                                         , lazy
+                                         )
+            if result is not None:
+                return result
+
+        if negative_cache is not None:
+            result = negative_cache.get(key)
+            if isinstance(result, ldap.NO_SUCH_OBJECT):
+                raise result.__class__(*result.args)
+            elif result is not None:
+                return deepcopy(result)
+
+        if cache is not None:
+            result = cache.get(key)
+            if result is not None:
+                return deepcopy(result)
+
+        # Only complete records can answer later base searches. The entry
+        # cache keeps them as the server sent them, the caller gets them
+        # converted.
+        fill_entries = entry_cache is not None and attrs is None
+        try:
+            result = self._search( base, scope, fltr, attrs, False
+                                 , bind_dn, bind_pwd, raw or fill_entries
+                                 , page_size, sizelimit, timelimit, deadline
+                                 , lazy
+                                 )
+        except ldap.NO_SUCH_OBJECT, e:
+            if negative_cache is not None:
+                negative_cache.set(key, norm_base, e)
+            raise
+
+        if fill_entries:
+            self._setCachedEntries(entry_cache, result, identity)
+            if not raw:
+                result = result.copy()
+                result['results'] = [ self._decodeRawEntry(x, raw, lazy)
+                                      for x in result['results'] ]
+
+        if result['exception'] == 'Time limit exceeded':
+            # Another try may find more records
+            pass
+        elif ( negative_cache is not None and 
+               not result['size'] and not result['exception'] ):
+            negative_cache.set(key, norm_base, deepcopy(result))
+        elif cache is not None:
+            cache.set(key, norm_base, deepcopy(result))
+
+        return result
+
+    def _search( self
+               , base
+               , scope
+               , fltr
+               , attrs
+               , convert_filter
+               , bind_dn
+               , bind_pwd
+               , raw
+               , page_size
+               , sizelimit
+               , timelimit
+               , deadline
+               , lazy=False
+               ):
+        """ Private helper to search the server, bypassing the cache
+        """
         result = {'size': 0, 'results': [], 'exception': ''}
+        if page_size is None:
+            page_size = self.page_size
+
+        if ( (page_size > 0 and scope != ldap.SCOPE_BASE) or 
+             sizelimit > 0 or timelimit > 0 or deadline is not None ):
+            # Paged and limited searches use the streaming API
+            results = self.iter_search( base
+                                      , scope
+                                      , fltr
+                                      , attrs
+                                      , convert_filter
+                                      , bind_dn
+                                      , bind_pwd
+                                      , raw
+                                      , page_size
+                                      , sizelimit
+                                      , timelimit
+                                      , deadline
+                                      , lazy
+                                      )
+            try:
+                for rec_dict in results:
+                    result['results'].append(rec_dict)
+                    result['size'] += 1
+            except ldap.SIZELIMIT_EXCEEDED:
+                # The results up to the limit are returned
+                result['exception'] = 'Size limit exceeded'
+            except ldap.TIMELIMIT_EXCEEDED:
+                # The results found in time are returned
+                result['exception'] = 'Time limit exceeded'
+
+            return result
+
         if convert_filter:
             fltr = self._encode_incoming(fltr)
         base = escape_dn(self._encode_incoming(base))
-        connection = self.connect(bind_dn=bind_dn, bind_pwd=bind_pwd)
+        if not raw:
+            # Look up binary attributes before tying up a connection
+            self._getBinaryAttributes()
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
 
         try:
-            res = connection.search_s(base, scope, fltr, attrs)
-        except ldap.PARTIAL_RESULTS:
-            res_type, res = connection.result(all=0)
-        except ldap.REFERRAL, e:
-            connection = self._handle_referral(e)
-
             try:
                 res = connection.search_s(base, scope, fltr, attrs)
             except ldap.PARTIAL_RESULTS:
                 res_type, res = connection.result(all=0)
+            except ldap.REFERRAL, e:
+                ref_pool, referral_connection = self._handle_referral(e)
+
+                try:
+                    try:
+                        res = referral_connection.search_s( base
+                                                          , scope
+                                                          , fltr
+                                                          , attrs
+                                                          )
+                    except ldap.PARTIAL_RESULTS:
+                        res_type, res = referral_connection.result(all=0)
+                finally:
+                    ref_pool.checkin(referral_connection)
+        finally:
+            pool.checkin(connection)
 
         for rec_dn, rec_dict in res:
-            # When used against Active Directory, "rec_dict" may not be
-            # be a dictionary in some cases (instead, it can be a list)
-            # An example of a useless "res" entry that can be ignored
-            # from AD is
-            # (None, ['ldap://ForestDnsZones.PORTAL.LOCAL/DC=ForestDnsZones,DC=PORTAL,DC=LOCAL'])
-            # This appears to be some sort of internal referral, but
-            # we can't handle it, so we need to skip over it.
-            try:
-                items =  rec_dict.items()
-            except AttributeError:
-                # 'items' not found on rec_dict
+            rec_dict = self._decodeEntry(rec_dn, rec_dict, raw, lazy)
+            if rec_dict is None:
                 continue
 
-            if raw:
-                rec_dict['dn'] = rec_dn
-            else:
-                for key, value in items:
-                    if key.lower() not in BINARY_ATTRIBUTES:
-                        if not isinstance(value, basestring):
-                            for i in range(len(value)):
-                                value[i] = self._encode_outgoing(value[i])
-                        else:
-                            rec_dict[key] = self._encode_outgoing(value)
-                rec_dict['dn'] = self._encode_outgoing(rec_dn)
+            result['results'].append(rec_dict)
+            result['size'] += 1
+
+        return result
+
+    def iter_search( self
+                   , base
+                   , scope=ldap.SCOPE_SUBTREE
+                   , fltr='(objectClass=*)'
+                   , attrs=None
+                   , convert_filter=True
+                   , bind_dn=None
+                   , bind_pwd=None
+                   , raw=False
+                   , page_size=None
+                   , sizelimit=0
+                   , timelimit=-1
+                   , deadline=None
+                   , lazy=False
+                   ):
+        """ Search for entries, returning them one by one as they arrive
+        """
+        if page_size is None:
+            page_size = self.page_size
+        if scope == ldap.SCOPE_BASE:
+            page_size = -1
+        deadline = self._deadline(timelimit, deadline)
+        if convert_filter:
+            fltr = self._encode_incoming(fltr)
+        base = escape_dn(self._encode_incoming(base))
+        if not raw:
+            self._getBinaryAttributes()
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
+
+        try:
+            return SearchIterator( self
+                                 , pool
+                                 , connection
+                                 , base
+                                 , scope
+                                 , fltr
+                                 , attrs
+                                 , raw=raw
+                                 , page_size=page_size
+                                 , sizelimit=sizelimit
+                                 , timelimit=timelimit
+                                 , deadline=deadline
+                                 , lazy=lazy
+                                 )
+        except CONNECTION_ERRORS:
+            pool.discard(connection)
+            raise
+        except:
+            pool.checkin(connection)
+            raise
+
+    def count( self
+             , base
+             , scope=ldap.SCOPE_SUBTREE
+             , fltr='(objectClass=*)'
+             , convert_filter=True
+             , bind_dn=None
+             , bind_pwd=None
+             , page_size=None
+             ):
+        """ Count the entries matching a search
+        """
+        # No attributes are requested and no values need decoding
+        results = self.iter_search( base
+                                  , scope
+                                  , fltr
+                                  , ['1.1']
+                                  , convert_filter
+                                  , bind_dn
+                                  , bind_pwd
+                                  , True
+                                  , page_size
+                                  )
+        size = 0
+        for rec_dict in results:
+            size += 1
+
+        return size
+
+    def exists( self
+              , base
+              , scope=ldap.SCOPE_BASE
+              , fltr='(objectClass=*)'
+              , convert_filter=True
+              , bind_dn=None
+              , bind_pwd=None
+              ):
+        """ Check if at least one entry matches a search
+        """
+        try:
+            results = self.iter_search( base
+                                      , scope
+                                      , fltr
+                                      , ['1.1']
+                                      , convert_filter
+                                      , bind_dn
+                                      , bind_pwd
+                                      , True
+                                      , -1
+                                      , 1
+                                      )
+            try:
+                results.next()
+            finally:
+                results.close()
+        except (StopIteration, ldap.NO_SUCH_OBJECT):
+            return False
+        except ldap.SIZELIMIT_EXCEEDED:
+            pass
+
+        return True
+
+    def search_window( self
+                     , base
+                     , fltr
+                     , sort_keys
+                     , offset
+                     , count
+                     , scope=ldap.SCOPE_SUBTREE
+                     , attrs=None
+                     , convert_filter=True
+                     , bind_dn=None
+                     , bind_pwd=None
+                     , raw=False
+                     ):
+        """ Get a slice out of a server-side sorted search result
+        """
+        result = {'size': 0, 'results': [], 'exception': '', 'total': None}
+        if count < 1:
+            return result
+
+        ctrls = window_controls(sort_keys, offset, count)
+        if convert_filter:
+            fltr = self._encode_incoming(fltr)
+        base = escape_dn(self._encode_incoming(base))
+        if not raw:
+            self._getBinaryAttributes()
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
 
+        try:
+            results = SearchIterator( self
+                                    , pool
+                                    , connection
+                                    , base
+                                    , scope
+                                    , fltr
+                                    , attrs
+                                    , raw=raw
+                                    , serverctrls=ctrls
+                                    )
+        except CONNECTION_ERRORS:
+            pool.discard(connection)
+            raise
+        except:
+            pool.checkin(connection)
+            raise
+
+        for rec_dict in results:
             result['results'].append(rec_dict)
             result['size'] += 1
+        result['total'] = window_total(results.response_ctrls)
 
         return result
 
-    def insert(self, base, rdn, attrs=None, bind_dn=None, bind_pwd=None):
+    def _decodeEntry(self, rec_dn, rec_dict, raw=False, lazy=False):
+        """ Private helper to prepare a search result entry for the caller
+
+        Returns None for results that are not entries. If `lazy` is true
+        and `raw` is false a LazyEntry is returned.
+        """
+        # When used against Active Directory, "rec_dict" may not be
+        # be a dictionary in some cases (instead, it can be a list)
+        # An example of a useless "res" entry that can be ignored
+        # from AD is
+        # (None, ['ldap://ForestDnsZones.PORTAL.LOCAL/DC=ForestDnsZones,DC=PORTAL,DC=LOCAL'])
+        # This appears to be some sort of internal referral, but
+        # we can't handle it, so we need to skip over it.
+        try:
+            items =  rec_dict.items()
+        except AttributeError:
+            # 'items' not found on rec_dict
+            return None
+
+        if raw:
+            rec_dict['dn'] = rec_dn
+            return rec_dict
+
+        # Results may be read while a connection is checked out, which
+        # must not lead to reading the subschema with another one
+        if lazy:
+            rec_dict = LazyEntry( rec_dn
+                                , rec_dict
+                                , self._outgoingConverter()
+                                , self._getBinaryAttributes(load=False)
+                                )
+        else:
+            convert = self._outgoingConverter()
+            if convert is not None:
+                binary = self._getBinaryAttributes(load=False)
+                for key, value in items:
+                    if key.split(';')[0].lower() not in binary:
+                        if not isinstance(value, basestring):
+                            rec_dict[key] = [convert(x) for x in value]
+                        else:
+                            rec_dict[key] = convert(value)
+                rec_dn = convert(rec_dn)
+            rec_dict['dn'] = rec_dn
+
+        return rec_dict
+
+    def _decodeRawEntry(self, rec_dict, raw=False, lazy=False):
+        """ Private helper to prepare a copy of a raw record for the caller
+
+        `rec_dict` is a record as returned by a search with `raw` set.
+        """
+        if not raw:
+            self._getBinaryAttributes()
+        rec_dict = deepcopy(rec_dict)
+        rec_dn = rec_dict.pop('dn')
+        return self._decodeEntry(rec_dn, rec_dict, raw, lazy)
+
+    def _outgoingConverter(self):
+        """ Private helper to get a function converting server values
+
+        The function converts a byte string in the ldap_encoding the same 
+        way as `_encode_outgoing`, but the codecs are only looked up once.
+        If both encodings are ASCII-compatible, ASCII values are handed 
+        back unchanged without transcoding them. Returns None if values 
+        are not converted at all.
+        """
+        ldap_encoding = self.ldap_encoding
+        api_encoding = self.api_encoding
+        if api_encoding == ldap_encoding or not ldap_encoding:
+            return None
+
+        decoder = codecs.getdecoder(ldap_encoding)
+        if not api_encoding:
+            def convert(value):
+                return decoder(value)[0]
+            return convert
+
+        encoder = codecs.getencoder(api_encoding)
+        if ascii_compatible(ldap_encoding) and ascii_compatible(api_encoding):
+            def convert(value):
+                if is_ascii(value):
+                    return value
+                return encoder(decoder(value)[0])[0]
+        else:
+            def convert(value):
+                return encoder(decoder(value)[0])[0]
+
+        return convert
+
+    def insert( self
+              , base
+              , rdn
+              , attrs=None
+              , bind_dn=None
+              , bind_pwd=None
+              , timelimit=-1
+              , deadline=None
+              ):
         """ Insert a new record 
 
         attrs is expected to be a mapping where the value may be a string
@@ -271,130 +1426,429 @@ class LDAPConnection(object):
         dn = rdn + ',' + base
         attribute_list = []
         attrs = attrs and attrs or {}
+        binary = self._getBinaryAttributes()
+        schema = self._getSchemaInfo()
 
         for attr_key, values in attrs.items():
-            if attr_key.endswith(';binary'):
+            if attr_key.endswith(';binary') or attr_key.lower() in binary:
                 is_binary = True
-                attr_key = attr_key[:-7]
+                if attr_key.endswith(';binary'):
+                    attr_key = attr_key[:-7]
+                if isinstance(values, basestring):
+                    values = [values]
             else:
                 is_binary = False
 
             if isinstance(values, basestring) and not is_binary:
-                values = [x.strip() for x in values.split(';')]
+                if schema is not None and schema.isSingleValued(attr_key):
+                    values = [values.strip()]
+                else:
+                    values = [x.strip() for x in values.split(';')]
 
             if values != ['']:
                 if not is_binary:
                     values = [self._encode_incoming(x) for x in values]
                 attribute_list.append((attr_key, values))
 
+        deadline = self._deadline(timelimit, deadline)
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
         try:
-            connection = self.connect(bind_dn=bind_dn, bind_pwd=bind_pwd)
-            connection.add_s(dn, attribute_list)
-        except ldap.REFERRAL, e:
-            connection = self._handle_referral(e)
-            connection.add_s(dn, attribute_list)
-
-    def delete(self, dn, bind_dn=None, bind_pwd=None):
+            try:
+                self._perform(connection, 'add', (dn, attribute_list), deadline)
+            except ldap.REFERRAL, e:
+                ref_pool, referral_connection = self._handle_referral(e)
+                try:
+                    self._perform( referral_connection
+                                 , 'add'
+                                 , (dn, attribute_list)
+                                 , deadline
+                                 )
+                finally:
+                    ref_pool.checkin(referral_connection)
+        finally:
+            pool.checkin(connection)
+            self._invalidateResults(dn)
+
+    def delete( self
+              , dn
+              , bind_dn=None
+              , bind_pwd=None
+              , timelimit=-1
+              , deadline=None
+              ):
         """ Delete a record 
         """
         self._complainIfReadOnly()
 
         dn = escape_dn(self._encode_incoming(dn))
 
+        deadline = self._deadline(timelimit, deadline)
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
         try:
-            connection = self.connect(bind_dn=bind_dn, bind_pwd=bind_pwd)
-            connection.delete_s(dn)
-        except ldap.REFERRAL, e:
-            connection = self._handle_referral(e)
-            connection.delete_s(dn)
-
-    def modify(self, dn, mod_type=None, attrs=None, bind_dn=None, bind_pwd=None):
+            try:
+                self._perform(connection, 'delete', (dn,), deadline)
+            except ldap.REFERRAL, e:
+                ref_pool, referral_connection = self._handle_referral(e)
+                try:
+                    self._perform(referral_connection, 'delete', (dn,), deadline)
+                finally:
+                    ref_pool.checkin(referral_connection)
+        finally:
+            pool.checkin(connection)
+            self._invalidateResults(dn, subtree=True)
+
+    def modify( self
+              , dn
+              , mod_type=None
+              , attrs=None
+              , bind_dn=None
+              , bind_pwd=None
+              , timelimit=-1
+              , deadline=None
+              , preread=True
+              , assertion=None
+              ):
         """ Modify a record 
         """
         self._complainIfReadOnly()
 
         unescaped_dn = self._encode_incoming(dn)
         dn = escape_dn(unescaped_dn)
-        res = self.search( base=unescaped_dn
-                         , scope=ldap.SCOPE_BASE
-                         , bind_dn=bind_dn
-                         , bind_pwd=bind_pwd
-                         , raw=True
-                         )
+        deadline = self._deadline(timelimit, deadline)
         attrs = attrs and attrs or {}
-        cur_rec = res['results'][0]
+
+        serverctrls = None
+        if assertion is not None:
+            if AssertionControl is None:
+                raise RuntimeError('Assertions need python-ldap 2.4 or newer')
+            fltr = self._encode_incoming(assertion)
+            serverctrls = [AssertionControl(True, fltr)]
+            # The caller knows what the record looks like
+            preread = False
+
+        # A new value for the naming attribute means renaming the record
+        dn_parts = parse_dn(dn)
+        rdn_attr, rdn_value = dn_parts[0][0][:2]
+        new_rdn_value = None
+        for key, values in attrs.items():
+            if key.lower() == rdn_attr.lower():
+                if isinstance(values, basestring):
+                    values = [values]
+                if values and values[0]:
+                    new_rdn_value = self._encode_incoming(values[0])
+
+        cur_rec = None
+        if preread and mod_type not in (ldap.MOD_ADD, ldap.MOD_REPLACE):
+            # Only the attributes that are changed need to be compared
+            read_attrs = []
+            for key in attrs.keys():
+                if key.endswith(';binary'):
+                    key = key[:-7]
+                read_attrs.append(key)
+            cur_rec = self._getRecord( dn
+                                     , unescaped_dn
+                                     , read_attrs
+                                     , bind_dn
+                                     , bind_pwd
+                                     , deadline
+                                     )
         mod_list = []
+        binary = self._getBinaryAttributes()
+        schema = self._getSchemaInfo()
+        if schema is not None and cur_rec is not None:
+            cur_rec = self._alignNames(cur_rec, attrs.keys(), schema)
+
+        if new_rdn_value is not None:
+            # Values in DNs compare like the attribute values they are
+            normalize = self._rdnNormalizer(rdn_attr, schema)
+            if normalize(new_rdn_value) == normalize(rdn_value):
+                new_rdn_value = None
 
         for key, values in attrs.items():
 
-            if key.endswith(';binary'):
-                key = key[:-7]
+            if key.endswith(';binary') or key.lower() in binary:
+                if key.endswith(';binary'):
+                    key = key[:-7]
+                if isinstance(values, basestring):
+                    values = [values]
             elif isinstance(values, basestring):
-                values = [self._encode_incoming(x) for x in values.split(';')]
+                if schema is not None and schema.isSingleValued(key):
+                    values = [self._encode_incoming(values)]
+                else:
+                    values = [ self._encode_incoming(x) 
+                               for x in values.split(';') ]
             else:
                 values = [self._encode_incoming(x) for x in values]
 
-            if mod_type is None:
+            if mod_type is None and cur_rec is None:
+                # Replacing works whether the attribute exists or not
+                if values in ([''], []):
+                    mod_list.append((ldap.MOD_REPLACE, key, None))
+                else:
+                    mod_list.append((ldap.MOD_REPLACE, key, values))
+            elif mod_type is None:
                 if not cur_rec.has_key(key) and values != ['']:
                     mod_list.append((ldap.MOD_ADD, key, values))
                 elif cur_rec.get(key,['']) != values and values not in ([''],[]):
-                    mod_list.append((ldap.MOD_REPLACE, key, values))
+                    mod_list.extend(self._diffValues(key, cur_rec[key], values))
                 elif cur_rec.has_key(key) and values in ([''], []):
                     mod_list.append((ldap.MOD_DELETE, key, None))
             elif mod_type in (ldap.MOD_ADD, ldap.MOD_DELETE) and values == ['']:
                 continue
-            elif ( mod_type == ldap.MOD_DELETE and
-                   set(values).difference(set(cur_rec.get(key, []))) ):
+            elif ( mod_type == ldap.MOD_DELETE and cur_rec is not None and
+                   self._missingValues(key, values, cur_rec, schema) ):
                 continue
             else:
                 mod_list.append((mod_type, key, values))
 
+        if serverctrls is None:
+            modify_op, modify_args = 'modify', ()
+            rename_op, rename_args = 'modrdn', ()
+        else:
+            modify_op, modify_args = 'modify_ext', (serverctrls,)
+            rename_op, rename_args = 'rename', (None, 1, serverctrls)
+
+        old_dn = dn
+        pool, connection = self._checkout(bind_dn=bind_dn, bind_pwd=bind_pwd)
         try:
-            connection = self.connect(bind_dn=bind_dn, bind_pwd=bind_pwd)
-
-            dn_parts = str2dn(dn)
-            rdn = dn_parts[0]
-            rdn_attr = rdn[0][0]
-            raw_rdn = attrs.get(rdn_attr, '')
-            if isinstance(raw_rdn, basestring):
-                raw_rdn = [raw_rdn]
-            new_rdn = raw_rdn[0]
-
-            if new_rdn:
-                rdn_value = self._encode_incoming(new_rdn)
-                if rdn_value != cur_rec.get(rdn_attr)[0]:
-                    dn_parts[0] = [(rdn_attr, rdn_value, 1)]
-                    raw_utf8_rdn = rdn_attr + '=' + rdn_value
+            try:
+                if new_rdn_value is not None:
+                    dn_parts[0] = [(rdn_attr, new_rdn_value, 1)]
+                    raw_utf8_rdn = rdn_attr + '=' + new_rdn_value
                     new_rdn = escape_dn(raw_utf8_rdn)
-                    connection.modrdn_s(dn, new_rdn)
+                    self._perform( connection
+                                 , rename_op
+                                 , (dn, new_rdn) + rename_args
+                                 , deadline
+                                 )
                     dn = dn2str(dn_parts)
 
-            if mod_list:
-                connection.modify_s(dn, mod_list)
-            else:
-                debug_msg = 'Nothing to modify: %s' % dn
-                self.logger().debug(debug_msg)
+                if mod_list:
+                    self._perform( connection
+                                 , modify_op
+                                 , (dn, mod_list) + modify_args
+                                 , deadline
+                                 )
+                else:
+                    debug_msg = 'Nothing to modify: %s' % dn
+                    self.logger().debug(debug_msg)
+
+            except ldap.REFERRAL, e:
+                ref_pool, referral_connection = self._handle_referral(e)
+                try:
+                    self._perform( referral_connection
+                                 , modify_op
+                                 , (dn, mod_list) + modify_args
+                                 , deadline
+                                 )
+                finally:
+                    ref_pool.checkin(referral_connection)
+        finally:
+            pool.checkin(connection)
+            if dn != old_dn:
+                # Searches below the old DN may have found its children
+                self._invalidateResults(old_dn, subtree=True)
+            self._invalidateResults(dn)
+
+    def _rdnNormalizer(self, rdn_attr, schema):
+        """ Private helper to get a function making RDN values comparable
+
+        The equality matching rule from the subschema is used if it is
+        known. Otherwise values are compared case-insensitively, which is
+        what servers do for the common naming attributes.
+        """
+        if schema is None or schema.getAttributeType(rdn_attr) is None:
+            return lower
+
+        return schema.getNormalizer(rdn_attr) or (lambda value: value)
+
+    def _alignNames(self, record, names, schema):
+        """ Private helper to key record values by the names in `names`
+
+        Attribute names are compared case-insensitively, and aliases of 
+        the same attribute type in the subschema match each other. Only 
+        the values of attributes in `names` are returned.
+        """
+        def identify(name):
+            info = schema.getAttributeType(name)
+            if info is not None:
+                return info.oid
+            return name.split(';')[0].lower()
+
+        values = {}
+        for name, value in record.items():
+            values[identify(name)] = value
+
+        aligned = {}
+        for name in names:
+            name_id = identify(name)
+            if values.has_key(name_id):
+                aligned[name.split(';')[0]] = values[name_id]
+
+        return aligned
 
-        except ldap.REFERRAL, e:
-            connection = self._handle_referral(e)
-            connection.modify_s(dn, mod_list)
+    def _missingValues(self, key, values, record, schema=None):
+        """ Private helper: Are some of `values` not in the record?
+
+        If the subschema is known values are compared according to the
+        equality matching rule of the attribute.
+        """
+        old_values = record.get(key, [])
+        if schema is not None:
+            normalize = schema.getNormalizer(key)
+            if normalize is not None:
+                values = [normalize(x) for x in values]
+                old_values = [normalize(x) for x in old_values]
+
+        return bool(set(values).difference(set(old_values)))
+
+    def _diffValues(self, key, old_values, new_values):
+        """ Private helper to get the modifications changing an attribute
+
+        Attributes with more than `delta_threshold` values are changed 
+        by removing and adding only the values that differ, so large 
+        multi-valued attributes are not sent to the server completely.
+        """
+        if ( self.delta_threshold < 0 or 
+             max(len(old_values), len(new_values)) <= self.delta_threshold ):
+            return [(ldap.MOD_REPLACE, key, new_values)]
+
+        old_set = set(old_values)
+        new_set = set(new_values)
+        removed = [x for x in old_values if x not in new_set]
+        added = []
+        for value in new_values:
+            if value not in old_set:
+                # Duplicates are only added once
+                old_set.add(value)
+                added.append(value)
+
+        mod_list = []
+        if removed:
+            # Removals go first, a value may be re-added in other case
+            mod_list.append((ldap.MOD_DELETE, key, removed))
+        if added:
+            mod_list.append((ldap.MOD_ADD, key, added))
+
+        return mod_list
+
+    def _getRecord( self
+                  , dn
+                  , unescaped_dn
+                  , attrs
+                  , bind_dn=None
+                  , bind_pwd=None
+                  , deadline=None
+                  ):
+        """ Private helper to read the current values of some attributes
+
+        The record is returned in the ldap_encoding. `dn` is assumed to 
+        have been encoded and escaped already.
+        """
+        entry_cache = self._getEntryCache()
+        if entry_cache is not None:
+            identity = self._cacheIdentity(bind_dn, bind_pwd)
+            res = self._getCachedEntry( entry_cache
+                                      , dn.lower()
+                                      , '(objectClass=*)'
+                                      , attrs
+                                      , identity
+                                      , True
+                                      )
+            if res is not None:
+                return res['results'][0]
+
+        res = self.search( base=unescaped_dn
+                         , scope=ldap.SCOPE_BASE
+                         , attrs=attrs or ['1.1']
+                         , bind_dn=bind_dn
+                         , bind_pwd=bind_pwd
+                         , raw=True
+                         , deadline=deadline
+                         , use_cache=False
+                         )
+
+        return res['results'][0]
+
+    def _deadline(self, timelimit=-1, deadline=None):
+        """ Get the time by which an operation must have finished
+
+        Returns the earlier of `deadline` and `timelimit` seconds from
+        now, or None if neither is set.
+        """
+        if timelimit > 0:
+            limit = time.time() + timelimit
+            if deadline is None or limit < deadline:
+                deadline = limit
+
+        return deadline
+
+    def _perform(self, connection, op, args, deadline=None):
+        """ Perform a write operation, waiting until `deadline` at most
+
+        If the server has not answered by then, the operation is 
+        abandoned and ldap.TIMEOUT is raised.
+        """
+        if deadline is None:
+            return getattr(connection, '%s_s' % op)(*args)
+
+        if deadline <= time.time():
+            raise ldap.TIMEOUT
+
+        msgid = getattr(connection, ASYNC_OPERATIONS[op])(*args)
+        try:
+            remaining = max(deadline - time.time(), 0)
+            result = connection.result3(msgid, 1, remaining)
+            if result[0] is None:
+                raise ldap.TIMEOUT
+        except ldap.TIMEOUT:
+            try:
+                connection.abandon(msgid)
+            except ldap.LDAPError:
+                pass
+            raise
+
+        return result
 
     def _handle_referral(self, exception):
         """ Handle a referral specified in the passed-in exception 
+
+        Connections to referral targets are pooled by target URL, bound 
+        with the configured credentials. Returns a (pool, connection) 
+        tuple, the caller must check the connection back in.
         """
         payload = exception.args[0]
         info = payload.get('info')
         ldap_url = info[info.find('ldap'):]
 
-        if ldapurl.isLDAPUrl(ldap_url):
-            conn_str = ldapurl.LDAPUrl(ldap_url).initializeUrl()
-            conn = self._connect(conn_str)
-            conn.simple_bind_s(self._encode_incoming(self.bind_dn),
-                               self._encode_incoming(self.bind_pwd))
-            return conn
-        else:
+        if not ldapurl.isLDAPUrl(ldap_url):
             raise ldap.CONNECT_ERROR, 'Bad referral "%s"' % str(exception)
 
+        conn_str = ldapurl.LDAPUrl(ldap_url).initializeUrl()
+        bind_dn = self._encode_incoming(self.bind_dn)
+        bind_pwd = self._encode_incoming(self.bind_pwd)
+        server = {'url': conn_str, 'conn_timeout': 5, 'op_timeout': -1}
+        factory = self._getFactory(server, bind_dn, bind_pwd)
+        pool = self._getReferralPools().get( conn_str
+                                           , stats=factory.stats
+                                           , factory=factory
+                                           )
+        pool.factory = factory
+
+        conn = pool.checkout()
+        last_bind = getattr(conn, '_last_bind', None)
+        if ( not last_bind or
+             last_bind[1][0] != bind_dn or
+             last_bind[1][1] != bind_pwd ):
+            # The configured credentials have changed
+            try:
+                conn.simple_bind_s(bind_dn, bind_pwd)
+            except:
+                pool.discard(conn)
+                raise
+
+        return pool, conn
+
     def _complainIfReadOnly(self):
         """ Raise RuntimeError if the connection is set to `read-only`
 
@@ -425,6 +1879,9 @@ class LDAPConnection(object):
         else:
             if self.api_encoding != self.ldap_encoding:
                 if self.api_encoding:
+                    if self._asciiUnchanged() and is_ascii(value):
+                        return value
+
                     value = value.decode(self.api_encoding)
 
                     if self.ldap_encoding:
@@ -432,6 +1889,14 @@ class LDAPConnection(object):
         
         return value
 
+    def _asciiUnchanged(self):
+        """ Private helper: Are ASCII byte strings valid in both encodings?
+
+        In that case they need no transcoding between the encodings.
+        """
+        return ( ascii_compatible(self.api_encoding) and 
+                 ascii_compatible(self.ldap_encoding) )
+
     def _encode_outgoing(self, value):
         """ Encode a string value to the API encoding
 
@@ -453,6 +1918,9 @@ class LDAPConnection(object):
         else:
             if self.api_encoding != self.ldap_encoding:
                 if self.ldap_encoding:
+                    if self._asciiUnchanged() and is_ascii(value):
+                        return value
+
                     value = value.decode(self.ldap_encoding)
 
                     if self.api_encoding:
@@ -0,0 +1,97 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Search result records
+
+$Id$
+"""
+
+from copy import deepcopy
+from UserDict import DictMixin
+
+
+class LazyEntry(DictMixin, object):
+    """ Search result record decoding attribute values on first access
+
+    The record keeps the values as sent by the server. Each attribute
+    is decoded with the `decode` function when it is first accessed,
+    values of attributes listed in `binary` are never decoded, with or
+    without attribute options like `;binary`. If `decode` is None all
+    values are handed out as they are. Callers that only look at a few
+    attributes of wide records save decoding all other values.
+
+    Apart from that the record behaves like the mapping returned for
+    normal searches, including the `dn` key.
+    """
+
+    def __init__(self, dn, values, decode, binary=()):
+        self.raw = values
+        self.decode = decode
+        self.binary = binary
+        if decode is not None:
+            dn = decode(dn)
+        self.decoded = {'dn': dn}
+
+    def __getitem__(self, key):
+        try:
+            return self.decoded[key]
+        except KeyError:
+            pass
+
+        value = self.raw[key]
+        if ( self.decode is not None and 
+             key.split(';')[0].lower() not in self.binary ):
+            if isinstance(value, basestring):
+                value = self.decode(value)
+            else:
+                value = [self.decode(x) for x in value]
+        self.decoded[key] = value
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.decoded[key] = value
+
+    def __delitem__(self, key):
+        if not self.has_key(key):
+            raise KeyError(key)
+
+        self.decoded.pop(key, None)
+        self.raw.pop(key, None)
+
+    def has_key(self, key):
+        return key in self.decoded or key in self.raw
+
+    __contains__ = has_key
+
+    def keys(self):
+        keys = self.raw.keys()
+        keys.extend([x for x in self.decoded.keys() if x not in self.raw])
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __deepcopy__(self, memo):
+        # The decode function is shared, it may be a bound method
+        clone = self.__class__.__new__(self.__class__)
+        clone.raw = deepcopy(self.raw, memo)
+        clone.decode = self.decode
+        clone.binary = self.binary
+        clone.decoded = deepcopy(self.decoded, memo)
+        return clone
@@ -0,0 +1,143 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Server health and load statistics
+
+$Id$
+"""
+
+from threading import Lock
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Backoff times are doubled for every failure past the threshold,
+# up to this multiple of the initial backoff time
+MAX_BACKOFF_FACTOR = 10
+
+# Weight of a new measurement in the average operation time
+LATENCY_WEIGHT = 0.2
+
+
+class ServerHealth(object):
+    """ Connection failure statistics and circuit breaker for a server
+
+    The breaker is `closed` while the server works. After `threshold`
+    consecutive failures it opens, and the server should not be used
+    until `backoff` seconds have passed. After that the breaker is
+    `half-open` and a single connection attempt is allowed. If it
+    succeeds the breaker closes again, if it fails the breaker opens
+    with a doubled backoff time.
+
+    The number of connections currently in use and an exponentially
+    weighted moving average of the time connections are in use for are 
+    kept as well, they serve as load indicators.
+    """
+
+    def __init__(self, threshold=1, backoff=30):
+        self.threshold = max(threshold, 1)
+        self.backoff = backoff
+        self.failures = 0
+        self.last_failure = None
+        self.last_trial = None
+        self.state = CLOSED
+        self.outstanding = 0
+        self.latency = None
+        self.lock = Lock()
+
+    def currentBackoff(self):
+        """ Return the number of seconds to wait after the last failure
+        """
+        factor = 2 ** max(self.failures - self.threshold, 0)
+        return self.backoff * min(factor, MAX_BACKOFF_FACTOR)
+
+    def available(self):
+        """ Return True if a connection attempt should be made
+
+        If the backoff time of an open breaker has expired the breaker
+        becomes half-open and the caller gets to make the trial attempt.
+        """
+        self.lock.acquire()
+        try:
+            if self.state == CLOSED:
+                return True
+
+            now = time.time()
+            if self.state == OPEN:
+                if now < self.last_failure + self.currentBackoff():
+                    return False
+            elif now < self.last_trial + self.currentBackoff():
+                # Another caller is making the trial attempt
+                return False
+
+            self.state = HALF_OPEN
+            self.last_trial = now
+            return True
+        finally:
+            self.lock.release()
+
+    def success(self):
+        """ Record a successful connection attempt
+        """
+        self.lock.acquire()
+        try:
+            self.failures = 0
+            self.state = CLOSED
+        finally:
+            self.lock.release()
+
+    def failure(self):
+        """ Record a failed connection attempt
+        """
+        self.lock.acquire()
+        try:
+            self.failures += 1
+            self.last_failure = time.time()
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+        finally:
+            self.lock.release()
+
+    def started(self):
+        """ Record that a connection to the server is being used
+        """
+        self.lock.acquire()
+        try:
+            self.outstanding += 1
+        finally:
+            self.lock.release()
+
+    def finished(self, elapsed):
+        """ Record that a connection is no longer used after `elapsed` secs
+        """
+        self.lock.acquire()
+        try:
+            self.outstanding = max(self.outstanding - 1, 0)
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += LATENCY_WEIGHT * (elapsed - self.latency)
+        finally:
+            self.lock.release()
+
+    def info(self):
+        """ Return a mapping with the current statistics
+        """
+        return { 'state': self.state
+               , 'failures': self.failures
+               , 'last_failure': self.last_failure
+               , 'outstanding': self.outstanding
+               , 'latency': self.latency
+               }
+
@@ -25,7 +25,13 @@ class ILDAPConnection(Interface):
     for automatic failover in case one LDAP server becomes unavailable.
     """
 
-    def addServer(host, port, protocol, conn_timeout=-1, op_timeout=-1):
+    def addServer( host
+                 , port
+                 , protocol
+                 , conn_timeout=-1
+                 , op_timeout=-1
+                 , weight=1
+                 ):
         """ Add a server definition
 
         `protocol` can be any one of ``ldap`` (unencrypted traffic), 
@@ -43,6 +49,11 @@ class ILDAPConnection(Interface):
         the next server is tried if it has been defined. -1 means
         "wait indefinitely".
 
+        The `weight` argument is used by the ``random`` server selection 
+        strategy, servers with a higher weight are chosen more often. 
+        Servers with a weight of 0 are only used if all other servers 
+        fail.
+
         If a server definition with a host, port and protocol that matches
         an existing server definition is added, the new values will replace
         the existing definition.
@@ -56,6 +67,32 @@ class ILDAPConnection(Interface):
         used until it fails or until the Python process is restarted.
         """
 
+    def getServerHealth():
+        """ Get health statistics for all server definitions
+
+        Returns a mapping of server URLs to mappings with these keys:
+
+        - state: The circuit breaker state, one of ``closed`` (the 
+          server works), ``open`` (the server failed and is skipped) or 
+          ``half-open`` (a new connection attempt is under way)
+
+        - failures: The number of consecutive failed connection attempts
+
+        - last_failure: The time of the last failed connection attempt
+          in seconds since the epoch, or None
+
+        - outstanding: The number of pooled connections currently in use
+
+        - latency: The moving average of the time in seconds pooled 
+          connections are in use for, or None
+
+        Once a server has failed `breaker_threshold` times in a row, 
+        it is skipped for `breaker_backoff` seconds (both are 
+        constructor arguments). The backoff time doubles with every 
+        further failure. Skipped servers are only tried if all other 
+        servers fail as well.
+        """
+
     def connect(bind_dn=None, bind_pwd=None):
         """ Return a working LDAP server connection
 
@@ -63,9 +100,42 @@ class ILDAPConnection(Interface):
         the DN and password configured into the LDAP connection instance 
         are used.
 
-        The connection is cached and will be re-used. Since a bind operation
-        is forced every time the method can be used to re-bind the cached
-        connection with new credentials.
+        Connections are kept in bounded pools and will be re-used. 
+        There is one pool per server and set of configured bind 
+        credentials, so a connection that is already bound with these 
+        credentials is re-used without binding again. The least recently 
+        used pool is closed if more than `max_pools` pools exist.
+        Credentials passed in by the caller, e.g. for user logins, use 
+        a separate pool per server whose connections are re-bound as 
+        needed, so they never push out the other pools.
+        The pool size can be set with the `pool_size` constructor 
+        argument. Threads asking for a connection while all pooled 
+        connections are in use wait for `pool_timeout` seconds, -1 
+        meaning "wait indefinitely".
+
+        WARNING: The returned connection is handed back to the pool 
+        before this method returns. Other threads may check it out and 
+        use it at any time, even while the caller is still using it, and 
+        they may re-bind it with other credentials. Do not use it for 
+        anything but a quick check of the credentials, use the search, 
+        insert, modify and delete methods to talk to the server.
+
+        If the `race_delay` constructor argument is 0 or more and a new
+        connection is needed, connection attempts to further servers 
+        are started in parallel whenever the current attempt has not 
+        succeeded within `race_delay` seconds. The first connection that 
+        is bound successfully is used, the others are closed.
+
+        Pooled connections older than `pool_max_lifetime` seconds or 
+        idle for more than `pool_max_idle` seconds are closed and 
+        replaced, values of -1 disable these limits.
+
+        If the `keepalive_interval` constructor argument is greater than 
+        0, a background thread checks all idle pooled connections every 
+        `keepalive_interval` seconds with a cheap root DSE search. Broken 
+        or expired connections are replaced before a request needs them.
+        These checks do not reset the idle time `pool_max_idle` is 
+        compared against.
 
         This method returns an instance of the underlying `python-ldap` 
         connection class. It does not need to be called explicitly, all
@@ -76,8 +146,48 @@ class ILDAPConnection(Interface):
         thrown by the last attempted connection is re-raised.
         """
 
+    def warm_up(n=None):
+        """ Open and bind `n` pooled connections ahead of time
+
+        The connections are bound with the credentials passed to the
+        constructor. Calling this method at startup means the first 
+        requests do not have to wait for new connections to be opened
+        and bound. `n` defaults to the `pool_min_size` constructor 
+        argument, or 1. Pools never grow beyond `pool_size` connections.
+
+        With the default `failover` server strategy the connections are
+        opened to the first working server, with all other strategies 
+        to every server.
+
+        Raises RuntimeError if no server definitions are available.
+        If all defined server connections fail the LDAP exception 
+        thrown by the last attempted connection is re-raised.
+        """
+
     def disconnect():
         """ Close the current LDAP server connection
+
+        Closes all pooled connections and stops the keepalive thread.
+        """
+
+    def verify_credentials(dn, pwd):
+        """ Check if the given DN and password are valid
+
+        Returns True if a bind with the DN and password succeeds and 
+        False if the credentials are invalid. Empty DNs or passwords are 
+        always considered invalid, because most LDAP servers treat them
+        as anonymous bind.
+
+        The bind happens on a small pool of connections that are only 
+        used for checking credentials, its size is set by the 
+        `verify_pool_size` constructor argument. Connections used for 
+        other operations are never re-bound by this method. If the LDAP
+        server advertises the Active Directory "fast concurrent bind" 
+        extended operation, it is used for these connections.
+
+        Raises RuntimeError if no server definitions are available.
+        If all defined server connections fail the LDAP exception 
+        thrown by the last attempted connection is re-raised.
         """
 
     def search( base
@@ -88,6 +198,12 @@ class ILDAPConnection(Interface):
               , bind_dn=None
               , bind_pwd=None
               , raw=False
+              , page_size=None
+              , sizelimit=0
+              , timelimit=-1
+              , deadline=None
+              , use_cache=True
+              , lazy=False
               ):
         """ Perform a LDAP search
 
@@ -100,6 +216,53 @@ class ILDAPConnection(Interface):
         attributes should be returned, they can be specified in the `attrs` 
         sequence. If `raw` is true, results are returned in the ldap_encoding.
 
+        If `lazy` is true, the record mappings in the results decode the
+        values of an attribute when it is first accessed, instead of 
+        decoding all values of all attributes right away. This saves a 
+        lot of work if only a few attributes of each record are used.
+
+        If `page_size` is greater than 0, results are requested from the
+        server in pages of that size using the Simple Paged Results 
+        control (RFC 2696). This avoids running into server-side size 
+        limits for large result sets. `page_size` defaults to the 
+        `page_size` constructor argument. Searches with scope 
+        `ldap.SCOPE_BASE` are never paged.
+
+        `sizelimit` is the maximum number of records the server should
+        return and `timelimit` the maximum number of seconds it should
+        spend on the search, values of 0 or less mean "no limit". If the
+        server hits either limit, the records returned so far are 
+        returned and the `exception` key of the result is set. Results 
+        cut short by the time limit are not cached. `deadline` is a 
+        point in time as returned by `time.time()`. If the search has 
+        not finished by then, or after `timelimit` seconds, it is 
+        abandoned and `ldap.TIMEOUT` is raised.
+
+        If the `cache_timeout` constructor argument is greater than 0, 
+        search results are cached for that many seconds. At most 
+        `cache_size` results are kept, the least recently used results 
+        are dropped first. Results are cached separately for each set of
+        bind credentials. `insert`, `modify` and `delete` drop cached 
+        results of searches below the changed record or its parents. 
+        Changes made through other connection objects or by other 
+        processes only become visible once the cached result times out.
+        Pass a false `use_cache` value to bypass the cache.
+
+        If the `negative_cache_timeout` constructor argument is greater
+        than 0, searches that found no records or raised 
+        `ldap.NO_SUCH_OBJECT` are cached for that many seconds, even if
+        the result cache is disabled. This should be a short time, it 
+        saves server round trips for repeated lookups of records that
+        do not exist, e.g. mistyped login names. Writes drop cached 
+        negative results like they do for the result cache.
+
+        If the `entry_cache_timeout` constructor argument is greater 
+        than 0, records found by searches without an `attrs` list are 
+        cached by DN for that many seconds. Searches with scope 
+        `ldap.SCOPE_BASE` and the default filter are answered from this
+        cache if the cached record holds all requested attributes, 
+        whatever the `raw` and `lazy` flags of either search.
+
         If the search raised no errors, a mapping with the following keys
         is returned:
 
@@ -116,32 +279,159 @@ class ILDAPConnection(Interface):
         passed in.
         """
 
-    def insert(base, rdn, attrs=None, bind_dn=None, bind_pwd=None):
+    def iter_search( base
+                   , scope=2
+                   , fltr='(objectClass=*)'
+                   , attrs=None
+                   , convert_filter=True
+                   , bind_dn=None
+                   , bind_pwd=None
+                   , raw=False
+                   , page_size=None
+                   , sizelimit=0
+                   , timelimit=-1
+                   , deadline=None
+                   , lazy=False
+                   ):
+        """ Perform a LDAP search, returning the results one by one
+
+        The arguments are the same as for `search`. Instead of a mapping
+        with all results an iterator is returned, which yields the 
+        record mappings as they arrive from the server. Only a few 
+        records are held in memory at any time, which makes this method
+        suitable for very large result sets. With paging, at most one 
+        page of results is held at any time.
+
+        The pooled connection used for the search is held until all 
+        results have been read. If the caller stops iterating early it
+        should call the iterator's `close` method, which abandons the 
+        search on the server and frees the connection. This also happens
+        when the iterator is garbage collected.
+
+        Errors returned by the server are raised while iterating, 
+        including `ldap.SIZELIMIT_EXCEEDED` after the records up to 
+        `sizelimit` have been returned. `timelimit` and `deadline` work 
+        like they do for `search`, the search is abandoned and 
+        `ldap.TIMEOUT` is raised while iterating when time is up.
+        """
+
+    def count( base
+             , scope=2
+             , fltr='(objectClass=*)'
+             , convert_filter=True
+             , bind_dn=None
+             , bind_pwd=None
+             , page_size=None
+             ):
+        """ Return the number of records matching a search
+
+        The arguments are the same as for `search`. No attributes are
+        requested from the server, so this is much cheaper than counting
+        the results returned by `search`.
+        """
+
+    def exists( base
+              , scope=0
+              , fltr='(objectClass=*)'
+              , convert_filter=True
+              , bind_dn=None
+              , bind_pwd=None
+              ):
+        """ Check if at least one record matches a search
+
+        By default `scope` is `ldap.SCOPE_BASE`, so this checks if the 
+        record with the DN `base` exists. No attributes are requested 
+        and the search is stopped after the first match. Returns True or
+        False, a `base` that does not exist is not an error.
+        """
+
+    def search_window( base
+                     , fltr
+                     , sort_keys
+                     , offset
+                     , count
+                     , scope=2
+                     , attrs=None
+                     , convert_filter=True
+                     , bind_dn=None
+                     , bind_pwd=None
+                     , raw=False
+                     ):
+        """ Get a slice of a search result sorted by the server
+
+        The search is sorted by the server using the Server Side Sort
+        control (RFC 2891) and the Virtual List View control, so only 
+        the requested records are transferred. This is meant for user 
+        interfaces that show a large result set one screen at a time.
+
+        `sort_keys` is a sequence of attribute names to sort by. Prefix
+        an attribute name with `-` to sort in reverse order. `offset` is 
+        the 0-based position of the first record to return, `count` the
+        maximum number of records to return. The other arguments are the
+        same as for `search`.
+
+        A mapping like the one returned by `search` is returned, with an
+        additional `total` key holding the server's estimate of the 
+        total number of matching records.
+
+        Raises RuntimeError if the installed `python-ldap` version does 
+        not support the sort controls, which were added in python-ldap 
+        3.0. Servers that do not support them raise 
+        `ldap.UNAVAILABLE_CRITICAL_EXTENSION`.
+        """
+
+    def insert( base
+              , rdn
+              , attrs=None
+              , bind_dn=None
+              , bind_pwd=None
+              , timelimit=-1
+              , deadline=None
+              ):
         """ Insert a new record 
 
         The record will be inserted at `base` with the new RDN `rdn`.
         `attrs` is expected to be a key:value mapping where the value may 
         be a string or a sequence of strings. 
         Multiple values may be expressed as a single string if the values 
-        are semicolon-delimited.
+        are semicolon-delimited, unless the `use_schema` constructor 
+        argument is set and the attribute is single-valued.
         Values can be marked as binary values, meaning they are not encoded
         in the encoding specified as the server encoding before being sent 
-        to the LDAP server, by appending ';binary' to the key.
+        to the LDAP server, by appending ';binary' to the key. Values of 
+        attributes known to be binary, see the `binary_attributes` and
+        `binary_from_schema` constructor arguments, are never encoded.
+
+        If the server has not answered after `timelimit` seconds or by 
+        the time `deadline`, as returned by `time.time()`, the operation
+        is abandoned and `ldap.TIMEOUT` is raised. The operation may have
+        been carried out by the server anyway.
 
         In order to perform the operation using credentials other than the
         credentials configured on the instance a DN and password may be
         passed in.
         """
 
-    def delete(dn, bind_dn=None, bind_pwd=None):
+    def delete(dn, bind_dn=None, bind_pwd=None, timelimit=-1, deadline=None):
         """ Delete the record specified by the given DN
 
+        `timelimit` and `deadline` work like they do for `insert`.
+
         In order to perform the operation using credentials other than the
         credentials configured on the instance a DN and password may be
         passed in.
         """
 
-    def modify(dn, mod_type=None, attrs=None, bind_dn=None, bind_pwd=None):
+    def modify( dn
+              , mod_type=None
+              , attrs=None
+              , bind_dn=None
+              , bind_pwd=None
+              , timelimit=-1
+              , deadline=None
+              , preread=True
+              , assertion=None
+              ):
         """ Modify the record specified by the given DN
 
         `mod_type` is one of the LDAP modification types as declared by
@@ -158,6 +448,35 @@ class ILDAPConnection(Interface):
         as UTF-8 before sending the to the LDAP server, by appending 
         ';binary' to the key.
 
+        Unless `mod_type` is `ldap.MOD_ADD` or `ldap.MOD_REPLACE`, the 
+        current values of the attributes in `attrs` are read first. If 
+        `preread` is false or an `assertion` is passed, the current 
+        record is not read. Without a `mod_type` all attributes in 
+        `attrs` are then replaced, empty values remove the attribute.
+        With `ldap.MOD_DELETE` values that do not exist are not skipped
+        and the server raises an error for them.
+
+        If the `delta_threshold` constructor argument is 0 or more, 
+        attributes with more than `delta_threshold` values that are 
+        changed without a `mod_type` are not replaced completely. Only 
+        the values that were removed or added are sent to the server, 
+        which saves a lot of work for large groups.
+
+        `assertion` is a LDAP filter sent with the modification using 
+        the Assertion control (RFC 4528). The server only carries out 
+        the modification if the record matches the filter, otherwise 
+        `ldap.ASSERTION_FAILED` is raised. If the RDN changes, the 
+        rename is sent with the same assertion. Raises RuntimeError if 
+        the installed `python-ldap` version does not support the 
+        control.
+
+        `timelimit` and `deadline` work like they do for `insert`, they 
+        include the time needed to read the current record.
+
+        If the entry cache is enabled with the `entry_cache_timeout` 
+        constructor argument, the current record is read from the cache
+        if possible. The cached record is dropped after the change.
+
         In order to perform the operation using credentials other than the
         credentials configured on the instance a DN and password may be
         passed in.
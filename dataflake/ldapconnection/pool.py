@@ -0,0 +1,648 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Bounded pools of python-ldap connection objects
+
+$Id$
+"""
+
+import itertools
+import logging
+from threading import Condition
+from threading import Event
+from threading import Lock
+from threading import Thread
+import sys
+import time
+
+import ldap
+
+# Errors meaning that a server could not be reached at all, as opposed
+# to errors returned by a working server
+CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.LOCAL_ERROR)
+
+logger = logging.getLogger('dataflake.ldapconnection')
+
+# Orders checkouts across all pools, see ConnectionPool.last_checkout
+_checkouts = itertools.count(1)
+
+
+def initialize(c_factory, url, conn_timeout=-1, op_timeout=-1):
+    """ Create a connection object for `url` with the options we need
+    """
+    connection = c_factory(url)
+
+    # Deny auto-chasing of referrals to be safe, we handle them instead
+    try:
+        connection.set_option(ldap.OPT_REFERRALS, ldap.DEREF_NEVER)
+    except ldap.LDAPError: # Cannot set referrals, so do nothing
+        pass
+
+    # Set the connection timeout
+    if conn_timeout > 0:
+        connection.set_option(ldap.OPT_NETWORK_TIMEOUT, conn_timeout)
+
+    # Set the operations timeout
+    if op_timeout > 0:
+        connection.timeout = op_timeout
+
+    return connection
+
+
+def probe_connection(conn):
+    """ Check that a connection still works
+
+    A base search for the root DSE is cheap and supported by all servers.
+    """
+    conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+
+
+def close_connection(conn):
+    """ Unbind a connection, ignoring any errors
+    """
+    try:
+        conn.unbind_s()
+    except Exception:
+        pass
+
+
+class ConnectionFactory(object):
+    """ Create connections to a single server, bound with fixed credentials
+
+    `server` is a server definition mapping as stored by the 
+    LDAPConnection. Only plain configuration values are kept, so factories
+    can be stored with the pools and used by background threads without 
+    touching the object that configured them, which may be a persistent 
+    object.
+
+    If a `stats` object is passed in, the outcome of every connection 
+    attempt is recorded in it, see health.ServerHealth. `setup` is an 
+    optional callable applied to every new connection.
+    """
+
+    def __init__( self, c_factory, server, bind_dn=None, bind_pwd=None
+                , stats=None, setup=None ):
+        self.c_factory = c_factory
+        self.url = server['url']
+        self.conn_timeout = server.get('conn_timeout', -1)
+        self.op_timeout = server.get('op_timeout', -1)
+        self.start_tls = server.get('start_tls', False)
+        self.bind_dn = bind_dn
+        self.bind_pwd = bind_pwd
+        self.stats = stats
+        self.setup = setup
+
+    def __call__(self):
+        conn = None
+        try:
+            conn = initialize( self.c_factory
+                             , self.url
+                             , conn_timeout=self.conn_timeout
+                             , op_timeout=self.op_timeout
+                             )
+            if self.start_tls:
+                conn.start_tls_s()
+            if self.bind_dn is not None:
+                conn.simple_bind_s(self.bind_dn, self.bind_pwd)
+        except:
+            exc_info = sys.exc_info()
+            if self.stats is not None:
+                if isinstance(exc_info[1], CONNECTION_ERRORS):
+                    self.stats.failure()
+                elif conn is not None:
+                    # The server answered, e.g. with INVALID_CREDENTIALS
+                    self.stats.success()
+
+            if conn is not None:
+                close_connection(conn)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        if self.stats is not None:
+            self.stats.success()
+
+        if self.setup is not None:
+            self.setup(conn)
+
+        return conn
+
+
+class ConnectionPool(object):
+    """ A thread-safe pool of LDAP server connections
+
+    Connections are created on demand until `max_size` connections
+    exist. Threads asking for a connection while all connections are in
+    use are queued until a connection is handed back, for at most
+    `timeout` seconds. A `timeout` of -1 means "wait indefinitely".
+
+    New connections are created by calling `factory`, usually a
+    ConnectionFactory. A different factory can be passed in when 
+    checking out a connection.
+
+    If a `stats` object is passed in, it is notified when connections 
+    are checked out and checked in, see health.ServerHealth.
+
+    Connections older than `max_lifetime` seconds, or idle for more than
+    `max_idle` seconds, are closed instead of being handed out. Values 
+    of 0 or less disable these limits.
+    """
+
+    def __init__( self, min_size=0, max_size=5, timeout=-1, stats=None
+                , factory=None, max_lifetime=-1, max_idle=-1 ):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.stats = stats
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.size = 0
+        self.idle = []
+        self.in_use = {}
+        self.created = {}
+        self.idle_since = {}
+        self.last_used = None
+        self.last_checkout = 0
+        self.closed = False
+        self.cond = Condition(Lock())
+
+    def checkout(self, factory=None):
+        """ Get a connection out of the pool
+
+        An idle connection is re-used if there is one, otherwise a new
+        connection is created by calling `factory`, or the pool factory, 
+        if the pool is not at its maximum size yet. If the pool is 
+        exhausted the calling thread waits for another thread to check 
+        in a connection. Expired idle connections are closed first.
+
+        Raises RuntimeError if no connection became available within
+        the configured timeout.
+        """
+        expired = []
+        self.cond.acquire()
+        try:
+            expired = self._reap()
+            if self.timeout >= 0:
+                deadline = time.time() + self.timeout
+            else:
+                deadline = None
+
+            while not self.idle and self.size >= self.max_size:
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(
+                            'Timed out waiting for a pooled connection')
+                    self.cond.wait(remaining)
+
+            if self.idle:
+                conn = self.idle.pop()
+                self._started(conn)
+                return conn
+
+            # Reserve a slot, the connection itself is created outside
+            # the lock because that may take as long as the connection
+            # timeout.
+            self.size += 1
+        finally:
+            self.cond.release()
+            for conn in expired:
+                self._close(conn)
+
+        try:
+            conn = (factory or self.factory)()
+        except:
+            self._releaseSlot()
+            raise
+
+        self.cond.acquire()
+        try:
+            self.created[id(conn)] = time.time()
+            self._started(conn)
+        finally:
+            self.cond.release()
+        return conn
+
+    def adopt(self, conn):
+        """ Take a connection created elsewhere into the pool
+
+        The connection counts as checked out by the caller, who hands it
+        back with `checkin` as usual. Returns False, leaving the 
+        connection alone, if the pool is closed or already full.
+        """
+        self.cond.acquire()
+        try:
+            if self.closed or self.size >= self.max_size:
+                return False
+            self.size += 1
+            self.created[id(conn)] = time.time()
+            self._started(conn)
+        finally:
+            self.cond.release()
+        return True
+
+    def checkin(self, conn):
+        """ Hand a connection back to the pool
+        """
+        close = False
+        self.cond.acquire()
+        try:
+            self._finished(conn)
+            now = time.time()
+            if self.closed or self._tooOld(conn, now):
+                self.size -= 1
+                self._forget(conn)
+                close = True
+            else:
+                self.idle.append(conn)
+                self.idle_since[id(conn)] = now
+                self.last_used = conn
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+        if close:
+            self._close(conn)
+
+    def discard(self, conn):
+        """ Remove a checked-out connection from the pool for good
+
+        This is used for connections that are known to be broken.
+        """
+        self.cond.acquire()
+        try:
+            self._finished(conn)
+            self._forget(conn)
+        finally:
+            self.cond.release()
+        self._releaseSlot()
+        self._close(conn)
+
+    def fill(self, factory=None, size=None):
+        """ Create connections until the pool holds at least `min_size`
+
+        A different target `size` can be passed in, the pool never grows
+        beyond `max_size`.
+        """
+        factory = factory or self.factory
+        if size is None:
+            size = self.min_size
+        while not self.closed:
+            self.cond.acquire()
+            try:
+                if self.size >= min(size, self.max_size):
+                    return
+                self.size += 1
+            finally:
+                self.cond.release()
+
+            try:
+                conn = factory()
+            except:
+                self._releaseSlot()
+                raise
+
+            self._add(conn)
+
+    def probe(self, check=probe_connection):
+        """ Check all idle connections and replace broken ones
+
+        Expired idle connections are closed and replaced first. Then
+        idle connections are taken out of the pool one at a time and 
+        passed to `check`. Connections for which it raises one of the 
+        CONNECTION_ERRORS are closed and replaced using the pool factory.
+        Any other LDAP error means the server answered, and the connection
+        is kept. Connections are also closed if `check` fails in any other
+        way. Afterwards the pool is filled up to `min_size`.
+
+        Probing does not count as using a connection, so connections that
+        are only kept alive still expire after `max_idle` seconds.
+
+        This is meant to be called by a background thread, so it never
+        raises connection errors.
+        """
+        self.cond.acquire()
+        try:
+            expired = self._reap()
+            count = len(self.idle)
+        finally:
+            self.cond.release()
+
+        for conn in expired:
+            self._close(conn)
+
+        broken = len(expired)
+        for i in range(count):
+            self.cond.acquire()
+            try:
+                if self.closed or not self.idle:
+                    break
+                # The least recently used connection is checked first
+                conn = self.idle.pop(0)
+            finally:
+                self.cond.release()
+
+            try:
+                check(conn)
+                alive = True
+            except ldap.LDAPError, e:
+                alive = not isinstance(e, CONNECTION_ERRORS)
+            except Exception:
+                alive = False
+
+            if alive:
+                self._requeue(conn)
+            else:
+                self.cond.acquire()
+                try:
+                    self._forget(conn)
+                finally:
+                    self.cond.release()
+                self._releaseSlot()
+                self._close(conn)
+                broken += 1
+
+        if self.factory is None:
+            return
+
+        try:
+            for i in range(broken):
+                self._grow(self.factory)
+            self.fill()
+        except (RuntimeError,) + CONNECTION_ERRORS:
+            # The server is still down, the next checkout will fail over
+            pass
+
+    def _grow(self, factory):
+        """ Create one more idle connection if the pool is not full
+        """
+        self.cond.acquire()
+        try:
+            if self.closed or self.size >= self.max_size:
+                return
+            self.size += 1
+        finally:
+            self.cond.release()
+
+        try:
+            conn = factory()
+        except:
+            self._releaseSlot()
+            raise
+
+        self._add(conn)
+
+    def _requeue(self, conn):
+        """ Put a probed connection back, keeping its idle time
+        """
+        close = False
+        self.cond.acquire()
+        try:
+            if self.closed or self._tooOld(conn, time.time()):
+                self.size -= 1
+                self._forget(conn)
+                close = True
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+        if close:
+            self._close(conn)
+
+    def _add(self, conn):
+        """ Put a new connection into the pool, its slot is reserved
+        """
+        self.cond.acquire()
+        try:
+            self.created[id(conn)] = time.time()
+        finally:
+            self.cond.release()
+        self.checkin(conn)
+
+    def close(self):
+        """ Close all idle connections and refuse taking back others
+        """
+        self.cond.acquire()
+        try:
+            self.closed = True
+            idle = self.idle
+            self.idle = []
+            self.size -= len(idle)
+            for conn in idle:
+                self._forget(conn)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+        for conn in idle:
+            self._close(conn)
+
+    def _started(self, conn):
+        """ Bookkeeping for a connection being checked out
+
+        Must be called with the lock held.
+        """
+        self.last_used = conn
+        self.last_checkout = _checkouts.next()
+        self.in_use[id(conn)] = time.time()
+        if self.stats is not None:
+            self.stats.started()
+
+    def _finished(self, conn):
+        """ Bookkeeping for a connection being checked in or discarded
+
+        Must be called with the lock held.
+        """
+        started = self.in_use.pop(id(conn), None)
+        if started is not None and self.stats is not None:
+            self.stats.finished(time.time() - started)
+
+    def _tooOld(self, conn, now):
+        """ Check if a connection has exceeded the maximum lifetime
+        """
+        if self.max_lifetime <= 0:
+            return False
+
+        return now - self.created.get(id(conn), now) > self.max_lifetime
+
+    def _reap(self):
+        """ Take expired connections out of the idle list and return them
+
+        Must be called with the lock held. The caller closes the returned
+        connections after releasing the lock.
+        """
+        if self.max_lifetime <= 0 and self.max_idle <= 0:
+            return []
+
+        now = time.time()
+        expired = []
+        for conn in self.idle:
+            if self._tooOld(conn, now):
+                expired.append(conn)
+            elif ( self.max_idle > 0 and
+                   now - self.idle_since.get(id(conn), now) > self.max_idle ):
+                expired.append(conn)
+
+        for conn in expired:
+            self.idle.remove(conn)
+            self.size -= 1
+            self._forget(conn)
+
+        return expired
+
+    def _forget(self, conn):
+        """ Drop the timestamps kept for a connection
+
+        Must be called with the lock held.
+        """
+        self.created.pop(id(conn), None)
+        self.idle_since.pop(id(conn), None)
+
+    def _releaseSlot(self):
+        """ Give up a slot reserved for a connection
+        """
+        self.cond.acquire()
+        try:
+            self.size -= 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def _close(self, conn):
+        """ Unbind a connection, ignoring any errors
+        """
+        close_connection(conn)
+
+
+class PoolRegistry(object):
+    """ A bounded mapping of keys to connection pools
+
+    Pools are created on first use with the pool settings passed to the
+    constructor. If more than `max_pools` pools exist the least recently
+    used pool is closed and dropped.
+    """
+
+    def __init__(self, max_pools=10, **pool_settings):
+        self.max_pools = max(max_pools, 1)
+        self.pool_settings = pool_settings
+        self.pools = {}
+        self.lru = []
+        self.lock = Lock()
+
+    def get(self, key, **pool_settings):
+        """ Get the pool for the given key, creating it if necessary
+
+        Keyword arguments override the registry-wide pool settings for
+        a newly created pool.
+        """
+        evicted = []
+        self.lock.acquire()
+        try:
+            pool = self.pools.get(key)
+            if pool is None:
+                settings = self.pool_settings.copy()
+                settings.update(pool_settings)
+                pool = self.pools[key] = ConnectionPool(**settings)
+            else:
+                self.lru.remove(key)
+            self.lru.append(key)
+
+            while len(self.lru) > self.max_pools:
+                evicted.append(self.pools.pop(self.lru.pop(0)))
+        finally:
+            self.lock.release()
+
+        for old_pool in evicted:
+            old_pool.close()
+
+        return pool
+
+    def items(self):
+        """ Return all (key, pool) tuples, most recently used last
+        """
+        self.lock.acquire()
+        try:
+            return [(key, self.pools[key]) for key in self.lru]
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ Close and drop all pools
+        """
+        self.lock.acquire()
+        try:
+            pools = self.pools.values()
+            self.pools = {}
+            self.lru = []
+        finally:
+            self.lock.release()
+
+        for pool in pools:
+            pool.close()
+
+
+class PoolMaintainer(Thread):
+    """ A background thread keeping idle pooled connections alive
+
+    Every `interval` seconds the idle connections of all pool registries
+    stored in `cache` under the keys in `registry_keys` are probed, see
+    ConnectionPool.probe. This keeps connections from being dropped by 
+    firewalls or the server for inactivity, and broken connections are 
+    replaced before a request needs them.
+
+    Errors raised while probing a pool are logged and the next pool is 
+    probed. The thread stops when `stop` is called, or when it is no 
+    longer stored in `cache` under `key`.
+    """
+
+    def __init__( self, cache, key, registry_keys, interval
+                , check=probe_connection ):
+        Thread.__init__(self, name='LDAP connection pool maintainer')
+        self.setDaemon(True)
+        self.cache = cache
+        self.key = key
+        self.registry_keys = registry_keys
+        self.interval = interval
+        self.check = check
+        self.stopping = Event()
+
+    def run(self):
+        while True:
+            self.stopping.wait(self.interval)
+            if self.stopping.isSet() or self.cache.get(self.key) is not self:
+                return
+            self.maintain()
+
+    def maintain(self):
+        """ Probe the idle connections in all pools once
+        """
+        for registry_key in self.registry_keys:
+            registry = self.cache.get(registry_key)
+            if registry is None:
+                continue
+            for key, pool in registry.items():
+                # Failing to replace connections, e.g. because the bind
+                # credentials were rejected, must not end the thread
+                try:
+                    pool.probe(self.check)
+                except Exception, e:
+                    msg = 'Cannot maintain connection pool %s: %s' % (
+                            str(key), str(e))
+                    logger.warning(msg)
+
+    def stop(self):
+        """ Ask the thread to stop
+        """
+        self.stopping.set()
@@ -0,0 +1,90 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Search result cache
+
+$Id$
+"""
+
+import time
+
+from dataflake.ldapconnection.utils import LRUCache
+
+
+def is_ancestor(base, dn):
+    """ Return True if `base` is `dn` itself or one of its parents
+
+    Both DNs are expected to be normalized the same way.
+    """
+    return not base or dn == base or dn.endswith(',' + base)
+
+
+class ResultCache(LRUCache):
+    """ Search result cache with a timeout and a maximum size
+
+    Results are dropped `timeout` seconds after they have been stored.
+    If more than `max_size` results are stored, the least recently used
+    result is dropped.
+
+    Each result is stored along with the search base, so results that
+    may be affected by a change to a record can be dropped using
+    `invalidate`.
+    """
+
+    def __init__(self, timeout=600, max_size=1000):
+        self.timeout = timeout
+        LRUCache.__init__(self, max_size)
+
+    def get(self, key, default=None):
+        """ Get the result stored under `key`
+
+        Returns `default` if there is no result or it is too old.
+        """
+        entry = LRUCache.get(self, key)
+        if entry is None:
+            return default
+
+        return entry[2]
+
+    def set(self, key, base, value):
+        """ Store the result `value` of a search below `base`
+        """
+        LRUCache.set(self, key, (time.time() + self.timeout, base, value))
+
+    def invalidate(self, dn=None, subtree=False, ancestors=True):
+        """ Drop all results that may be affected by a change to `dn`
+
+        These are the results of searches below `dn` itself or, if 
+        `ancestors` is true, one of its parents. If `subtree` is true,
+        e.g. when a record has been renamed or deleted, the results of 
+        searches below its children are dropped as well. All results 
+        are dropped if no DN is passed.
+        """
+        if dn is None:
+            self.clear()
+            return
+
+        self.lock.acquire()
+        try:
+            for link in self.entries.values():
+                base = link[self.VALUE][1]
+                if ( base == dn or
+                     (ancestors and is_ancestor(base, dn)) or
+                     (subtree and is_ancestor(dn, base)) ):
+                    self._remove(link)
+        finally:
+            self.lock.release()
+
+    def _expired(self, entry):
+        """ Results are dropped once their timeout has passed
+        """
+        return entry[0] <= time.time()
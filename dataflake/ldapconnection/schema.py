@@ -0,0 +1,150 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" LDAP server schema information
+
+$Id$
+"""
+
+from ldap.schema import AttributeType
+from ldap.schema import SubSchema
+
+# Syntaxes whose values are not strings, see RFC 4517 and RFC 4523
+BINARY_SYNTAXES = frozenset(( '1.3.6.1.4.1.1466.115.121.1.4'  # Audio
+                            , '1.3.6.1.4.1.1466.115.121.1.5'  # Binary
+                            , '1.3.6.1.4.1.1466.115.121.1.8'  # Certificate
+                            , '1.3.6.1.4.1.1466.115.121.1.9'  # Cert. List
+                            , '1.3.6.1.4.1.1466.115.121.1.10' # Cert. Pair
+                            , '1.3.6.1.4.1.1466.115.121.1.28' # JPEG
+                            , '1.3.6.1.4.1.1466.115.121.1.40' # Octet String
+                            , '1.3.6.1.4.1.1466.115.121.1.49' # Algorithm
+                            ))
+
+# Matching rules comparing values case-insensitively, by name and OID
+CASE_IGNORE_RULES = frozenset(( 'caseignorematch'
+                              , 'caseignoreia5match'
+                              , 'caseignorelistmatch'
+                              , 'distinguishednamematch'
+                              , '2.5.13.2'
+                              , '1.3.6.1.4.1.1466.109.114.2'
+                              , '2.5.13.11'
+                              , '2.5.13.1'
+                              ))
+
+# Errors raised by python-ldap while parsing malformed definitions. 
+# Duplicate names or OIDs raise a ValueError subclass.
+PARSE_ERRORS = (ValueError, AssertionError, LookupError)
+
+
+def lower(value):
+    """ Normalize a value for case-insensitive matching rules
+    """
+    return value.lower()
+
+
+def load_subschema(path):
+    """ Load a subschema saved with `Subschema.save`
+    """
+    schema_file = open(path, 'r')
+    try:
+        definitions = [x.strip() for x in schema_file.readlines()]
+    finally:
+        schema_file.close()
+
+    return Subschema([x for x in definitions if x])
+
+
+class Subschema(object):
+    """ Attribute type information out of a server subschema
+
+    `definitions` are the attribute type descriptions, the values of 
+    the `attributeTypes` attribute of the subschema entry. They are 
+    parsed by python-ldap's `ldap.schema.SubSchema`. Syntax and 
+    equality matching rule are inherited from parent types. All lookups
+    are case-insensitive, attribute options like `;binary` are ignored.
+    """
+
+    def __init__(self, definitions=()):
+        self.definitions = list(definitions)
+        self.subschema = SubSchema({'attributeTypes': self.definitions})
+
+        binary = set()
+        for oid in self.subschema.listall(AttributeType):
+            if self.getSyntax(oid) in BINARY_SYNTAXES:
+                info = self.subschema.get_obj(AttributeType, oid)
+                binary.update([x.lower() for x in info.names])
+        self.binary = frozenset(binary)
+
+    def getAttributeType(self, name):
+        """ Get the `ldap.schema.AttributeType` for attribute type `name`
+
+        Returns None if the attribute type is unknown.
+        """
+        return self.subschema.get_obj(AttributeType, name.split(';')[0])
+
+    def _getInherited(self, name, key):
+        """ Get a property of an attribute type or its parent types
+        """
+        if self.getAttributeType(name) is None:
+            return None
+
+        try:
+            return self.subschema.get_inheritedattr( AttributeType
+                                                   , name.split(';')[0]
+                                                   , key
+                                                   )
+        except KeyError:
+            # A parent type is missing from the subschema
+            return None
+
+    def getSyntax(self, name):
+        """ Get the syntax OID of an attribute type, or None
+        """
+        return self._getInherited(name, 'syntax') or None
+
+    def getEquality(self, name):
+        """ Get the lowercased equality matching rule, or None
+        """
+        equality = self._getInherited(name, 'equality')
+        return equality and equality.lower() or None
+
+    def isSingleValued(self, name):
+        """ Return True if attribute type `name` is single-valued
+        """
+        info = self.getAttributeType(name)
+        return bool(info and info.single_value)
+
+    def isBinary(self, name):
+        """ Return True if attribute type `name` has a binary syntax
+        """
+        return name.split(';')[0].lower() in self.binary
+
+    def getNormalizer(self, name):
+        """ Get a function that makes values compare like the server does
+
+        Values of attribute types matched case-insensitively are 
+        lowercased. Returns None if values compare as they are.
+        """
+        if self.getEquality(name) in CASE_IGNORE_RULES:
+            return lower
+
+        return None
+
+    def save(self, path):
+        """ Save the definitions, see `load_subschema`
+        """
+        schema_file = open(path, 'w')
+        try:
+            for definition in self.definitions:
+                schema_file.write(definition.replace('\n', ' ') + '\n')
+        finally:
+            schema_file.close()
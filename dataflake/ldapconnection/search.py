@@ -0,0 +1,292 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Streaming search results
+
+$Id$
+"""
+
+import time
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+try:
+    from ldap.controls.sss import SSSRequestControl
+    from ldap.controls.vlv import VLVRequestControl
+except ImportError: # python-ldap < 3.0 has no sort and VLV controls
+    SSSRequestControl = VLVRequestControl = None
+
+from dataflake.ldapconnection.pool import CONNECTION_ERRORS
+
+# Simple Paged Results control, see RFC 2696
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+# Virtual List View response control
+VLV_RESPONSE_OID = '2.16.840.1.113730.3.4.10'
+
+
+def paged_results_control(size, cookie=''):
+    """ Create a paged results request control
+    """
+    try:
+        # python-ldap 2.4 and newer
+        return SimplePagedResultsControl(True, size=size, cookie=cookie)
+    except TypeError:
+        return SimplePagedResultsControl( PAGED_RESULTS_OID
+                                        , True
+                                        , (size, cookie)
+                                        )
+
+
+def paged_results_cookie(ctrls):
+    """ Get the cookie for the next page out of the response controls
+
+    An empty cookie means there are no more pages.
+    """
+    for ctrl in ctrls or ():
+        if getattr(ctrl, 'controlType', None) == PAGED_RESULTS_OID:
+            cookie = getattr(ctrl, 'cookie', None)
+            if cookie is None:
+                # python-ldap 2.3 and older
+                cookie = ctrl.controlValue[1]
+            return cookie or ''
+
+    return ''
+
+
+def window_controls(sort_keys, offset, count):
+    """ Create the Server Side Sort (RFC 2891) and VLV request controls
+
+    `offset` is the 0-based position of the first entry to return.
+    """
+    if SSSRequestControl is None or VLVRequestControl is None:
+        raise RuntimeError(
+            'Server side sorting needs python-ldap 3.0 or newer')
+
+    if isinstance(sort_keys, basestring):
+        sort_keys = [sort_keys]
+
+    return [ SSSRequestControl(True, list(sort_keys))
+           , VLVRequestControl( True
+                              , before_count=0
+                              , after_count=count - 1
+                              , offset=offset + 1
+                              , content_count=0
+                              )
+           ]
+
+
+def window_total(ctrls):
+    """ Get the server's estimate of the result set size
+
+    Returns None if the server did not send a VLV response control.
+    """
+    for ctrl in ctrls or ():
+        if getattr(ctrl, 'controlType', None) == VLV_RESPONSE_OID:
+            if getattr(ctrl, 'result', 0):
+                raise ldap.VLV_ERROR(
+                    {'desc': 'VLV error, result code %s' % ctrl.result})
+            return ctrl.content_count
+
+    return None
+
+
+class SearchIterator(object):
+    """ Iterator over the results of an asynchronous search
+
+    The search is started on the given pooled `connection` right away.
+    Results are read from the server one message at a time while the
+    caller iterates, so only a few entries are held in memory.
+
+    If `page_size` is greater than 0 the results are requested in pages
+    of that size using the Simple Paged Results control, the next page
+    is only requested after the previous page has been read.
+
+    If `lazy` is true and `raw` is false, records are returned as 
+    LazyEntry instances which decode values on first access.
+
+    `sizelimit` and `timelimit` are sent to the server, values of 0 or 
+    less mean "no limit". If all results have not been read by the time
+    `deadline`, a time.time() value, has passed, the search is abandoned
+    and ldap.TIMEOUT is raised.
+
+    Additional request controls can be passed in as `serverctrls`, the
+    controls sent back by the server are available as `response_ctrls`
+    once all results have been read.
+
+    The connection is handed back to `pool` when all results have been
+    read. If the caller stops early it should call `close`, which
+    abandons the search on the server. This also happens when the
+    iterator is garbage collected.
+    """
+
+    def __init__( self, ldap_conn, pool, connection, base, scope, fltr
+                , attrs, raw=False, page_size=-1, serverctrls=None
+                , sizelimit=0, timelimit=-1, deadline=None, lazy=False ):
+        self.ldap_conn = ldap_conn
+        self.pool = pool
+        self.connection = connection
+        self.search_args = (base, scope, fltr, attrs)
+        self.raw = raw
+        self.lazy = lazy
+        self.page_size = page_size
+        self.serverctrls = list(serverctrls or ())
+        self.sizelimit = max(sizelimit, 0)
+        self.timelimit = timelimit
+        self.deadline = deadline
+        self.response_ctrls = []
+        self.buffer = []
+        self.count = 0
+        self.done = False
+        self.msgid = None
+        self._start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self.buffer:
+            if self.done:
+                raise StopIteration
+            self._fetch()
+
+        self.count += 1
+        return self.buffer.pop(0)
+
+    def close(self):
+        """ Stop the search and release the connection
+
+        Nothing happens if the search could not be started, the caller
+        creating the iterator releases the connection then.
+        """
+        if self.done or self.msgid is None:
+            return
+
+        try:
+            self.connection.abandon(self.msgid)
+        except CONNECTION_ERRORS:
+            self._release(discard=True)
+            return
+        except ldap.LDAPError:
+            pass
+        self._release()
+
+    def __del__(self):
+        self.close()
+
+    def _fetch(self):
+        """ Read the next message from the server
+        """
+        try:
+            if self.deadline is None:
+                result = self.connection.result3(self.msgid, 0)
+            else:
+                remaining = self.deadline - time.time()
+                if remaining <= 0:
+                    raise ldap.TIMEOUT
+                result = self.connection.result3(self.msgid, 0, remaining)
+            rtype, rdata, msgid, ctrls = result
+            if rtype is None:
+                raise ldap.TIMEOUT
+        except ldap.TIMEOUT:
+            # Stop the search so it does not tie up the connection
+            self.close()
+            raise
+        except ldap.REFERRAL, e:
+            if self.count or self.buffer:
+                # Some results were already returned, cannot start over
+                self._release()
+                raise
+            self._followReferral(e)
+            return
+        except ldap.PARTIAL_RESULTS:
+            # Active Directory signals referrals this way after the
+            # results it holds itself
+            self._release()
+            return
+        except CONNECTION_ERRORS:
+            self._release(discard=True)
+            raise
+        except:
+            self._release()
+            raise
+
+        if rtype == ldap.RES_SEARCH_RESULT:
+            self.response_ctrls = ctrls or []
+            cookie = ''
+            if self.page_size > 0:
+                cookie = paged_results_cookie(ctrls)
+
+            if cookie:
+                try:
+                    self._start(cookie)
+                except:
+                    self._release()
+                    raise
+            else:
+                self._release()
+
+        for rec_dn, rec_dict in rdata or ():
+            rec_dict = self.ldap_conn._decodeEntry( rec_dn
+                                                  , rec_dict
+                                                  , self.raw
+                                                  , self.lazy
+                                                  )
+            if rec_dict is not None:
+                self.buffer.append(rec_dict)
+
+    def _followReferral(self, exception):
+        """ Start the search over on a referral target connection
+        """
+        self._release()
+        pool, connection = self.ldap_conn._handle_referral(exception)
+        self.pool = pool
+        self.connection = connection
+        self.done = False
+        try:
+            self._start()
+        except:
+            self._release()
+            raise
+
+    def _start(self, cookie=''):
+        """ Send the search request, or the request for the next page
+        """
+        ctrls = list(self.serverctrls)
+        if self.page_size > 0:
+            ctrls.append(paged_results_control(self.page_size, cookie))
+
+        if self.timelimit > 0:
+            timelimit = self.timelimit
+        else:
+            timelimit = -1
+
+        base, scope, fltr, attrs = self.search_args
+        self.msgid = self.connection.search_ext( base
+                                               , scope
+                                               , fltr
+                                               , attrs
+                                               , serverctrls=ctrls or None
+                                               , timeout=timelimit
+                                               , sizelimit=self.sizelimit
+                                               )
+
+    def _release(self, discard=False):
+        """ Hand the connection back to the pool
+        """
+        if self.done:
+            return
+
+        self.done = True
+        if discard:
+            self.pool.discard(self.connection)
+        else:
+            self.pool.checkin(self.connection)
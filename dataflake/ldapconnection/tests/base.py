@@ -68,6 +68,32 @@ class LDAPConnectionTests(unittest.TestCase):
 
         return conn
 
+    def _makeCounting(self, **kw):
+        searches = []
+        def factory(conn_string):
+            ldap_connection = fakeldap.CountingFakeLDAPConnection(conn_string)
+            ldap_connection.searches = searches
+            return ldap_connection
+        conn = self._makeOne('host', 636, 'ldap', factory, **kw)
+
+        return conn, searches
+
+    def _makeModifyRecording(self, **kw):
+        mod_lists = []
+        klass = fakeldap.ModifyRecordingFakeLDAPConnection
+        def factory(conn_string):
+            ldap_connection = klass(conn_string)
+            ldap_connection.mod_lists = mod_lists
+            return ldap_connection
+        conn = self._makeOne('host', 636, 'ldap', factory, **kw)
+
+        return conn, mod_lists
+
+    def _makeSlow(self):
+        return self._makeOne( 'host', 636, 'ldap'
+                            , fakeldap.SlowFakeLDAPConnection
+                            )
+
     def _factory(self, connection_string):
         of = fakeldap.FakeLDAPConnection(connection_string)
         return of
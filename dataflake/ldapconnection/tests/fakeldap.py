@@ -389,9 +389,67 @@ def hash_pwd(string):
     return '{SHA}%s' % base64.encodestring(sha_digest).strip()
 
 
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+def paged_control_value(ctrl):
+    """ Get size and cookie out of a python-ldap 2.3 or 2.4 paged control
+    """
+    if hasattr(ctrl, 'size'):
+        return ctrl.size, ctrl.cookie
+    return ctrl.controlValue
+
+SORT_OID = '1.2.840.113556.1.4.473'
+VLV_REQUEST_OID = '2.16.840.1.113730.3.4.9'
+ASSERTION_OID = '1.3.6.1.1.12'
+
+def sort_results(results, ordering_rules):
+    """ Sort search results by the first value of the sort attributes
+    """
+    results = list(results)
+    rules = list(ordering_rules)
+    rules.reverse()
+    for rule in rules:
+        reverse = rule.startswith('-')
+        attr = rule.lstrip('-').split(':')[0].lower()
+        def sort_key(result):
+            for key, values in result[1].items():
+                if key.lower() == attr:
+                    return values[0].lower()
+            return ''
+        decorated = [(sort_key(x), i, x) for i, x in enumerate(results)]
+        decorated.sort()
+        if reverse:
+            decorated.reverse()
+        results = [x[2] for x in decorated]
+    return results
+
+class FakeVLVResponseControl:
+    """ Virtual List View response control as returned by the server
+    """
+    controlType = '2.16.840.1.113730.3.4.10'
+
+    def __init__(self, target_position, content_count, result=0):
+        self.target_position = target_position
+        self.content_count = content_count
+        self.result = result
+
+class FakePagedResultsControl:
+    """ Paged results response control as returned by the server
+    """
+    controlType = PAGED_RESULTS_OID
+
+    def __init__(self, cookie):
+        self.cookie = cookie
+
 class FakeLDAPConnection:
 
     hash_password = True
+    # Emulate a server-side size limit for non-paged searches
+    size_limit = None
+    page_requests = ()
+    assertions = ()
+    # Seconds the emulated server takes to answer asynchronous requests
+    response_delay = None
     maintain_memberof = False
     member_attr = 'member'
     memberof_attr = 'memberOf'
@@ -402,6 +460,9 @@ class FakeLDAPConnection:
         self.options = {}
         self._last_bind = None
         self.start_tls_called = False
+        self._pending = {}
+        self._last_msgid = 0
+        self.abandoned = ()
 
     def set_option(self, option, value):
         self.options[option] = value
@@ -597,7 +658,10 @@ class FakeLDAPConnection:
         rec = deepcopy(tree_pos.get(rdn))
 
         for mod in mod_list:
-            if mod[0] == ldap.MOD_REPLACE:
+            if mod[0] == ldap.MOD_REPLACE and not mod[2]:
+                # Replacing with no values removes the attribute
+                rec.pop(mod[1], None)
+            elif mod[0] == ldap.MOD_REPLACE:
                 rec[mod[1]] = mod[2]
             elif mod[0] == ldap.MOD_ADD:
                 cur_val = rec.get(mod[1], [])
@@ -652,12 +716,165 @@ class FakeLDAPConnection:
         del tree_pos[rdn]
         tree_pos[new_rdn] = rec
 
+    def search_subschemasubentry_s(self, dn=''):
+        try:
+            res = self.search_s( dn
+                               , ldap.SCOPE_BASE
+                               , '(objectClass=*)'
+                               , ['subschemaSubentry']
+                               )
+        except ldap.NO_SUCH_OBJECT:
+            return None
+
+        for rec_dn, rec in res:
+            values = rec.get('subschemaSubentry')
+            if values:
+                return values[0]
+
+        return None
+
+    def read_subschemasubentry_s(self, subschemasubentry_dn, attrs=None):
+        try:
+            res = self.search_s( subschemasubentry_dn
+                               , ldap.SCOPE_BASE
+                               , '(objectClass=*)'
+                               , attrs
+                               )
+        except ldap.NO_SUCH_OBJECT:
+            return None
+
+        if res:
+            return res[0][1]
+
+        return None
+
     def start_tls_s(self):
         self.start_tls_called = True
 
     def result(self, msgid=ldap.RES_ANY, all=1, timeout=-1):
         return ('partial', [('partial result', {'dn': 'partial result'})])
 
+    def search_ext( self, base, scope=ldap.SCOPE_SUBTREE
+                  , filterstr='(objectClass=*)', attrlist=None, attrsonly=0
+                  , serverctrls=None, clientctrls=None, timeout=-1
+                  , sizelimit=0 ):
+        # Errors are only reported when the results are read
+        resp_ctrls = []
+        error = None
+        try:
+            results = list(self.search_s(base, scope, filterstr, attrlist))
+            ctrls = {}
+            for ctrl in serverctrls or ():
+                ctrls[ctrl.controlType] = ctrl
+            paged = [ x for x in serverctrls or ()
+                      if x.controlType == PAGED_RESULTS_OID ]
+            if ctrls.has_key(SORT_OID):
+                results = sort_results(results, ctrls[SORT_OID].ordering_rules)
+            if ctrls.has_key(VLV_REQUEST_OID):
+                if not ctrls.has_key(SORT_OID):
+                    raise ldap.SORT_CONTROL_MISSING
+                vlv = ctrls[VLV_REQUEST_OID]
+                total = len(results)
+                start = max(vlv.offset - 1 - vlv.before_count, 0)
+                results = results[start:vlv.offset + vlv.after_count]
+                resp_ctrls.append(FakeVLVResponseControl(vlv.offset, total))
+            elif paged:
+                size, cookie = paged_control_value(paged[0])
+                self.page_requests = self.page_requests + (cookie,)
+                start = int(cookie or 0)
+                if len(results) > start + size:
+                    cookie = str(start + size)
+                else:
+                    cookie = ''
+                results = results[start:start + size]
+                resp_ctrls.append(FakePagedResultsControl(cookie))
+            elif self.size_limit and len(results) > self.size_limit:
+                raise ldap.SIZELIMIT_EXCEEDED
+            if sizelimit > 0 and len(results) > sizelimit:
+                # The entries up to the limit are sent before the error
+                results = results[:sizelimit]
+                error = ldap.SIZELIMIT_EXCEEDED()
+        except ldap.LDAPError, e:
+            results = e
+        return self._queue(results, resp_ctrls, error)
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._queueCall(self.add_s, dn, modlist)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        return self._queueCall(self.delete_s, dn)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._queueCall(self.modify_ext_s, dn, modlist, serverctrls)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self._checkAssertion(dn, serverctrls)
+        return self.modify_s(dn, modlist)
+
+    def modrdn(self, dn, new_rdn, delold=1):
+        return self._queueCall(self.modrdn_s, dn, new_rdn, delold)
+
+    def rename( self, dn, newrdn, newsuperior=None, delold=1
+              , serverctrls=None, clientctrls=None ):
+        return self._queueCall( self.rename_s
+                              , dn
+                              , newrdn
+                              , newsuperior
+                              , delold
+                              , serverctrls
+                              )
+
+    def rename_s( self, dn, newrdn, newsuperior=None, delold=1
+                , serverctrls=None, clientctrls=None ):
+        self._checkAssertion(dn, serverctrls)
+        return self.modrdn_s(dn, newrdn, delold)
+
+    def _checkAssertion(self, dn, serverctrls):
+        # Only simple equality filters like "(cn=foo)" are supported
+        for ctrl in serverctrls or ():
+            if ctrl.controlType == ASSERTION_OID:
+                self.assertions = self.assertions + (ctrl.filterstr,)
+                attr, value = ctrl.filterstr[1:-1].split('=', 1)
+                rec = FakeLDAPConnection.search_s(self, dn, ldap.SCOPE_BASE)
+                rec = rec[0][1]
+                if value not in rec.get(attr, []):
+                    raise ldap.ASSERTION_FAILED(ctrl.filterstr)
+
+    def _queueCall(self, func, *args):
+        try:
+            func(*args)
+            results = []
+        except ldap.LDAPError, e:
+            results = e
+        return self._queue(results)
+
+    def _queue(self, results, resp_ctrls=(), error=None):
+        self._last_msgid += 1
+        self._pending[self._last_msgid] = (results, list(resp_ctrls), error)
+        return self._last_msgid
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        if ( self.response_delay is not None and timeout is not None and
+             timeout >= 0 and self.response_delay > timeout ):
+            raise ldap.TIMEOUT
+
+        results, resp_ctrls, error = self._pending[msgid]
+        if isinstance(results, ldap.LDAPError):
+            del self._pending[msgid]
+            raise results
+
+        if all or not results:
+            del self._pending[msgid]
+            if error is not None:
+                raise error
+            return (ldap.RES_SEARCH_RESULT, results, msgid, resp_ctrls)
+
+        return (ldap.RES_SEARCH_ENTRY, [results.pop(0)], msgid, [])
+
+    def abandon(self, msgid):
+        self._pending.pop(msgid, None)
+        self.abandoned = self.abandoned + (msgid,)
+
     def unbind(self):
         self.unbind_s()
 
@@ -681,6 +898,28 @@ class RaisingFakeLDAPConnection(FakeLDAPConnection):
         setattr(self, raise_on, func)
 
 
+class SlowFakeLDAPConnection(FakeLDAPConnection):
+    response_delay = 60
+
+
+class CountingFakeLDAPConnection(FakeLDAPConnection):
+    searches = None
+
+    def search_s(self, base, *args, **kw):
+        if self.searches is not None:
+            self.searches.append(base)
+        return FakeLDAPConnection.search_s(self, base, *args, **kw)
+
+
+class ModifyRecordingFakeLDAPConnection(FakeLDAPConnection):
+    mod_lists = None
+
+    def modify_s(self, dn, mod_list):
+        if self.mod_lists is not None:
+            self.mod_lists.append(mod_list)
+        return FakeLDAPConnection.modify_s(self, dn, mod_list)
+
+
 class FixedResultFakeLDAPConnection(FakeLDAPConnection):
     search_results = []
 
@@ -0,0 +1,108 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_balancer: Tests for the ServerBalancer class
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.health import ServerHealth
+
+SERVERS = [ {'url': 'ldap://host1:389', 'weight': 1}
+          , {'url': 'ldap://host2:389', 'weight': 1}
+          , {'url': 'ldap://host3:389', 'weight': 1}
+          ]
+
+class ServerBalancerTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.balancer import ServerBalancer
+        return ServerBalancer
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def _makeStats(self):
+        stats = {}
+        for server in SERVERS:
+            stats[server['url']] = ServerHealth()
+        return stats
+
+    def _urls(self, servers):
+        return [x['url'] for x in servers]
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, self._makeOne, 'UNKNOWN')
+
+    def test_failover(self):
+        balancer = self._makeOne('failover')
+        stats = self._makeStats()
+        self.assertEquals(balancer.order(SERVERS, stats), SERVERS)
+        self.assertEquals(balancer.order(SERVERS, stats), SERVERS)
+
+    def test_round_robin(self):
+        balancer = self._makeOne('round-robin')
+        stats = self._makeStats()
+        firsts = [balancer.order(SERVERS, stats)[0] for i in range(6)]
+        self.assertEquals(self._urls(firsts), self._urls(SERVERS) * 2)
+        self.assertEquals( self._urls(balancer.order(SERVERS, stats))
+                         , ['ldap://host1:389', 'ldap://host2:389', 'ldap://host3:389']
+                         )
+        self.assertEquals( self._urls(balancer.order(SERVERS, stats))
+                         , ['ldap://host2:389', 'ldap://host3:389', 'ldap://host1:389']
+                         )
+
+    def test_random_weighted(self):
+        balancer = self._makeOne('random')
+        stats = self._makeStats()
+        servers = [ {'url': 'ldap://host1:389', 'weight': 0}
+                  , {'url': 'ldap://host2:389', 'weight': 1}
+                  , {'url': 'ldap://host3:389', 'weight': 3}
+                  ]
+        firsts = []
+        for i in range(200):
+            ordered = balancer.order(servers, stats)
+            self.assertEquals(len(ordered), 3)
+            # Servers with weight 0 are only used as last resort
+            self.assertEquals(ordered[-1]['url'], 'ldap://host1:389')
+            firsts.append(ordered[0]['url'])
+        self.failUnless( firsts.count('ldap://host3:389') >
+                         firsts.count('ldap://host2:389') )
+
+    def test_least_outstanding(self):
+        balancer = self._makeOne('least-outstanding')
+        stats = self._makeStats()
+        stats['ldap://host1:389'].started()
+        stats['ldap://host1:389'].started()
+        stats['ldap://host2:389'].started()
+        self.assertEquals( self._urls(balancer.order(SERVERS, stats))
+                         , ['ldap://host3:389', 'ldap://host2:389', 'ldap://host1:389']
+                         )
+
+    def test_latency(self):
+        balancer = self._makeOne('latency')
+        stats = self._makeStats()
+        stats['ldap://host1:389'].started()
+        stats['ldap://host1:389'].finished(0.5)
+        stats['ldap://host2:389'].started()
+        stats['ldap://host2:389'].finished(0.1)
+        # host3 has not been measured yet, so it is tried first
+        self.assertEquals( self._urls(balancer.order(SERVERS, stats))
+                         , ['ldap://host3:389', 'ldap://host2:389', 'ldap://host1:389']
+                         )
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
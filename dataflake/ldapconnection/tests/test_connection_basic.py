@@ -43,6 +43,26 @@ class ConnectionBasicTests(LDAPConnectionTests):
         self.failIf(conn.read_only)
         self.assertEqual(conn._getConnection(), None)
         self.assertEqual(conn.c_factory, FakeLDAPConnection)
+        self.assertEqual(conn.pool_size, 5)
+        self.assertEqual(conn.pool_min_size, 0)
+        self.assertEqual(conn.pool_timeout, -1)
+        self.assertEqual(conn.pool_max_lifetime, -1)
+        self.assertEqual(conn.pool_max_idle, -1)
+        self.assertEqual(conn.page_size, -1)
+        self.assertEqual(conn.cache_timeout, -1)
+        self.assertEqual(conn.cache_size, 1000)
+        self.assertEqual(conn.negative_cache_timeout, -1)
+        self.assertEqual(conn.entry_cache_timeout, -1)
+        self.assertEqual(conn.delta_threshold, -1)
+
+    def test_constructor_encodings(self):
+        conn = self._getTargetClass()('localhost')
+        self.assertEqual(conn.ldap_encoding, 'UTF-8')
+        self.assertEqual(conn.api_encoding, 'iso-8859-15')
+
+        conn = self._getTargetClass()('localhost', api_encoding=None)
+        self.assertEqual(conn.ldap_encoding, 'UTF-8')
+        self.assertEqual(conn.api_encoding, None)
 
     def test_constructor(self):
         bind_dn_encoded = 'cn=%s,dc=localhost' % ISO_8859_1_ENCODED
@@ -135,6 +155,44 @@ class ConnectionBasicTests(LDAPConnectionTests):
                          , ISO_8859_7_ENCODED
                          )
 
+    def test_encode_ascii_unchanged(self):
+        conn = self._makeSimple()
+        value = 'cn=foo,dc=localhost'
+        self.failUnless(conn._encode_incoming(value) is value)
+        self.failUnless(conn._encode_outgoing(value) is value)
+
+        conn.api_encoding = 'UTF-16'
+        self.assertEquals( conn._encode_incoming(value.encode('UTF-16'))
+                         , value
+                         )
+
+    def test_outgoing_converter(self):
+        conn = self._makeSimple()
+
+        conn.api_encoding = conn.ldap_encoding = 'UTF-8'
+        self.assertEquals(conn._outgoingConverter(), None)
+
+        conn.api_encoding = 'iso-8859-7'
+        conn.ldap_encoding = None
+        self.assertEquals(conn._outgoingConverter(), None)
+
+        conn.api_encoding = None
+        conn.ldap_encoding = 'iso-8859-7'
+        convert = conn._outgoingConverter()
+        self.assertEquals(convert(ISO_8859_7_ENCODED), ISO_8859_7_UNICODE)
+        self.failUnless(isinstance(convert('foo'), unicode))
+
+        conn.api_encoding = 'iso-8859-7'
+        conn.ldap_encoding = 'UTF-8'
+        convert = conn._outgoingConverter()
+        self.assertEquals(convert(ISO_8859_7_UTF8), ISO_8859_7_ENCODED)
+        value = 'foo'
+        self.failUnless(convert(value) is value)
+
+        conn.api_encoding = 'UTF-16'
+        convert = conn._outgoingConverter()
+        self.assertEquals(convert('foo'), u'foo'.encode('UTF-16'))
+
 def test_suite():
     import sys
     return unittest.findTestCases(sys.modules[__name__])
@@ -94,6 +94,248 @@ class ConnectionConnectTests(LDAPConnectionTests):
         connection = conn.connect()
         self.failIf(connection.options.has_key(ldap.OPT_REFERRALS))
 
+    def test_connect_pool_settings(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , pool_size=3, pool_min_size=2, pool_timeout=10
+                            , max_pools=4
+                            )
+        conn.connect()
+        pools = conn._getPools()
+        self.assertEquals(pools.max_pools, 4)
+        self.assertEquals(len(pools.items()), 1)
+        key, pool = pools.items()[0]
+        self.assertEquals(key[:2], ('ldap://host:636', ''))
+        self.assertEquals(pool.max_size, 3)
+        self.assertEquals(pool.min_size, 2)
+        self.assertEquals(pool.timeout, 10)
+        self.assertEquals(pool.size, 2)
+        self.assertEquals(len(pool.idle), 2)
+
+        # The minimum size only applies to the configured credentials
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        conn.connect('cn=foo,dc=localhost', 'pass')
+        self.assertEquals(len(pools.items()), 1)
+        key, pool = conn._getUserPools().items()[0]
+        self.assertEquals(key, 'ldap://host:636')
+        self.assertEquals(pool.max_size, 3)
+        self.assertEquals(pool.min_size, 0)
+        self.assertEquals(pool.size, 1)
+
+    def test_connect_pool_expiry_settings(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , pool_max_lifetime=3600, pool_max_idle=300
+                            )
+        connection = conn.connect()
+        key, pool = conn._getPools().items()[0]
+        self.assertEquals(pool.max_lifetime, 3600)
+        self.assertEquals(pool.max_idle, 300)
+
+        # Expired connections are replaced with a new bound connection
+        pool.idle_since[id(connection)] -= 301
+        new_connection = conn.connect()
+        self.failIf(new_connection is connection)
+        self.assertEquals(connection._last_bind, None)
+        self.assertEquals(new_connection._last_bind[1], ('', ''))
+        self.assertEquals(pool.size, 1)
+
+    def test_checkout_concurrent(self):
+        conn = self._makeSimple()
+        pool, connection1 = conn._checkout()
+        pool, connection2 = conn._checkout()
+        self.failIf(connection1 is connection2)
+        self.assertEquals(connection1._last_bind[1], ('', ''))
+        self.assertEquals(connection2._last_bind[1], ('', ''))
+        pool.checkin(connection1)
+        pool.checkin(connection2)
+
+        # Connections are re-used after having been checked in
+        connection = conn.connect()
+        self.failUnless(connection in (connection1, connection2))
+        self.assertEquals(pool.size, 2)
+
+    def test_checkout_exhausted_pool(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , pool_size=1, pool_timeout=0
+                            )
+        pool, connection = conn._checkout()
+        self.assertRaises(RuntimeError, conn.search, 'dc=localhost')
+        pool.checkin(connection)
+        self.assertEquals(conn.search('dc=localhost')['size'], 0)
+
+    def test_checkout_bind_failure_discards(self):
+        import ldap
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.assertRaises( ldap.INVALID_CREDENTIALS
+                         , conn.connect
+                         , 'cn=foo,dc=localhost'
+                         , 'wrong'
+                         )
+        key, pool = conn._getUserPools().items()[0]
+        self.assertEquals(pool.size, 0)
+        self.assertEquals(pool.idle, [])
+
+    def test_checkout_pools_by_credentials(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        service_connection = conn.connect()
+        user_connection = conn.connect('cn=foo,dc=localhost', 'pass')
+        self.failIf(service_connection is user_connection)
+
+        # Alternating between credentials re-uses the bound connections
+        self.failUnless(conn.connect() is service_connection)
+        self.failUnless(conn.connect('cn=foo,dc=localhost', 'pass') is
+                        user_connection)
+        self.assertEquals(len(conn._getPools().items()), 1)
+        self.assertEquals(len(conn._getUserPools().items()), 1)
+
+        # Passwords are not part of the pool key in clear text
+        for key, pool in conn._getPools().items():
+            self.failIf('pass' in key)
+
+    def test_checkout_user_connections_rebound(self):
+        conn = self._makeSimple()
+        service_connection = conn.connect()
+        for i in range(10):
+            dn = 'cn=user%i,dc=localhost' % i
+            self._addRecord(dn, userPassword='pass')
+            user_connection = conn.connect(dn, 'pass')
+            self.assertEquals(user_connection._last_bind[1], (dn, 'pass'))
+
+        # All logins share one connection, which is bound again each time
+        key, pool = conn._getUserPools().items()[0]
+        self.assertEquals(pool.size, 1)
+        self.failIf(user_connection is service_connection)
+        self.failUnless(conn.connect() is service_connection)
+        self.assertEquals(service_connection._last_bind[1], ('', ''))
+
+    def test_checkout_pool_eviction(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , max_pools=1
+                            )
+        conn.addServer('otherhost', 636, 'ldap')
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        service_connection = conn.connect()
+        conn.connect('cn=foo,dc=localhost', 'pass')
+
+        # Logins do not push the service pool out
+        self.assertEquals(len(conn._getPools().items()), 1)
+        self.assertEquals(service_connection._last_bind[1], ('', ''))
+
+        # Pools for other credentials are still bounded
+        conn.bind_dn = 'cn=foo,dc=localhost'
+        conn.bind_pwd = 'pass'
+        conn.connect()
+        self.assertEquals(len(conn._getPools().items()), 1)
+        self.assertEquals(service_connection._last_bind, None)
+
+    def test_checkout_failover(self):
+        import ldap
+        from dataflake.ldapconnection.tests import fakeldap
+        def factory(conn_string):
+            if conn_string == 'ldap://down:389':
+                conn = fakeldap.RaisingFakeLDAPConnection(conn_string)
+                conn.setExceptionAndMethod('simple_bind_s', ldap.SERVER_DOWN)
+                return conn
+            return fakeldap.FakeLDAPConnection(conn_string)
+        conn = self._makeOne('down', 389, 'ldap', factory)
+        conn.addServer('up', 389, 'ldap')
+        connection = conn.connect()
+        self.assertEquals(connection.args, ('ldap://up:389',))
+
+    def test_warm_up(self):
+        conn = self._makeSimple()
+        conn.warm_up(3)
+        key, pool = conn._getPools().items()[0]
+        self.assertEquals(key[:2], ('ldap://host:636', ''))
+        self.assertEquals(pool.size, 3)
+        self.assertEquals(len(pool.idle), 3)
+        for connection in pool.idle:
+            self.assertEquals(connection._last_bind[1], ('', ''))
+
+        # Warm connections are used without opening new ones
+        connection = conn.connect()
+        self.failUnless(connection in pool.idle)
+        self.assertEquals(pool.size, 3)
+
+    def test_warm_up_defaults(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , pool_size=3, pool_min_size=2
+                            )
+        conn.warm_up()
+        key, pool = conn._getPools().items()[0]
+        self.assertEquals(pool.size, 2)
+
+        # Pools do not grow beyond their maximum size
+        conn.warm_up(5)
+        self.assertEquals(pool.size, 3)
+
+    def test_warm_up_failover(self):
+        import ldap
+        from dataflake.ldapconnection.tests import fakeldap
+        def factory(conn_string):
+            if conn_string == 'ldap://down:389':
+                conn = fakeldap.RaisingFakeLDAPConnection(conn_string)
+                conn.setExceptionAndMethod('simple_bind_s', ldap.SERVER_DOWN)
+                return conn
+            return fakeldap.FakeLDAPConnection(conn_string)
+        conn = self._makeOne('down', 389, 'ldap', factory)
+        conn.addServer('up', 389, 'ldap')
+        conn.addServer('spare', 389, 'ldap')
+        conn.warm_up(2)
+        sizes = dict([(key[0], pool.size) 
+                      for key, pool in conn._getPools().items()])
+        self.assertEquals(sizes.get('ldap://down:389', 0), 0)
+        self.assertEquals(sum(sizes.values()), 2)
+
+    def test_warm_up_all_servers(self):
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , server_strategy='round-robin'
+                            )
+        conn.addServer('otherhost', 636, 'ldap')
+        conn.warm_up(2)
+        pools = conn._getPools().items()
+        self.assertEquals(len(pools), 2)
+        for key, pool in pools:
+            self.assertEquals(pool.size, 2)
+
+    def test_warm_up_noserver_raises(self):
+        conn = self._makeSimple()
+        conn.removeServer('host', '636', 'ldap')
+        self.assertRaises(RuntimeError, conn.warm_up)
+
+    def test_keepalive_disabled_by_default(self):
+        from dataflake.ldapconnection.connection import connection_cache
+        conn = self._makeSimple()
+        conn.connect()
+        self.assertEquals(connection_cache.get((conn.hash, 'maintainer')), None)
+
+    def test_keepalive_replaces_dead_connections(self):
+        import ldap
+        from dataflake.ldapconnection.connection import connection_cache
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , keepalive_interval=60
+                            )
+        connection = conn.connect()
+        maintainer = connection_cache.get((conn.hash, 'maintainer'))
+        self.failUnless(maintainer.isAlive())
+        self.assertEquals(maintainer.interval, 60)
+
+        def check(conn):
+            raise ldap.SERVER_DOWN
+        maintainer.check = check
+        maintainer.maintain()
+        self.assertEquals(connection._last_bind, None)
+        key, pool = conn._getPools().items()[0]
+        self.assertEquals(pool.size, 1)
+        self.failIf(pool.idle[0] is connection)
+        self.assertEquals(pool.idle[0]._last_bind[1], ('', ''))
+
+        conn.disconnect()
+        maintainer.join(5)
+        self.failIf(maintainer.isAlive())
+        self.assertEquals(connection_cache.get((conn.hash, 'maintainer')), None)
+
     def test_disconnect_clears_connection_cache(self):
         from dataflake.ldapconnection.tests import fakeldap
         conn = self._makeSimple()
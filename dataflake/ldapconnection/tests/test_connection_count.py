@@ -0,0 +1,91 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_connection_count: Tests for the count and exists methods
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.tests.base import LDAPConnectionTests
+from dataflake.ldapconnection.tests import fakeldap
+
+class RecordingFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+
+    def search_ext(self, base, scope, filterstr, attrlist, *args, **kw):
+        self.attrlist = attrlist
+        return fakeldap.FakeLDAPConnection.search_ext( self
+                                                     , base
+                                                     , scope
+                                                     , filterstr
+                                                     , attrlist
+                                                     , *args
+                                                     , **kw
+                                                     )
+
+class ConnectionCountTests(LDAPConnectionTests):
+
+    def setUp(self):
+        super(ConnectionCountTests, self).setUp()
+        for name, value in (('foo', 'a'), ('bar', 'b'), ('baz', 'b')):
+            self._addRecord('cn=%s,dc=localhost' % name, a=value)
+
+    def _makeRecording(self):
+        return self._makeOne('host', 636, 'ldap', RecordingFakeLDAPConnection)
+
+    def test_count(self):
+        conn = self._makeRecording()
+        self.assertEqual(conn.count('dc=localhost'), 3)
+        self.assertEqual(conn.count('dc=localhost', fltr='(a=b)'), 2)
+        self.assertEqual(conn.count('dc=localhost', fltr='(a=c)'), 0)
+        # No attribute values are sent by the server
+        self.assertEqual(conn._getConnection().attrlist, ['1.1'])
+
+    def test_count_paged(self):
+        conn = self._makeRecording()
+        self.assertEqual(conn.count('dc=localhost', page_size=2), 3)
+        self.assertEqual(conn._getConnection().page_requests, ('', '2'))
+
+    def test_count_nonexisting_base(self):
+        import ldap
+        conn = self._makeSimple()
+        self.assertRaises(ldap.NO_SUCH_OBJECT, conn.count, 'ou=nowhere')
+
+    def test_exists(self):
+        conn = self._makeRecording()
+        self.failUnless(conn.exists('cn=foo,dc=localhost'))
+        self.assertEqual(conn._getConnection().attrlist, ['1.1'])
+        self.failIf(conn.exists('cn=UNKNOWN,dc=localhost'))
+        self.failIf(conn.exists('cn=foo,ou=nowhere,dc=localhost'))
+
+    def test_exists_filter(self):
+        import ldap
+        conn = self._makeSimple()
+        self.failUnless(conn.exists( 'dc=localhost'
+                                   , scope=ldap.SCOPE_ONELEVEL
+                                   , fltr='(a=b)'
+                                   ))
+        self.failIf(conn.exists( 'dc=localhost'
+                               , scope=ldap.SCOPE_ONELEVEL
+                               , fltr='(a=c)'
+                               ))
+
+        # The search was stopped after the first match
+        pool = conn._getPools().items()[0][1]
+        self.assertEqual(len(pool.idle), 1)
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
@@ -74,6 +74,26 @@ class ConnectionDeleteTests(LDAPConnectionTests):
         self.assertEqual(ldap_connection.conn_string, 'ldap://otherhost:1389')
         self.assertEquals(ldap_connection.args, ('cn=foo,dc=localhost',))
 
+    def test_delete_timelimit(self):
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSimple()
+        conn.delete('cn=foo,dc=localhost', timelimit=10)
+        results = conn.search('dc=localhost', '(cn=foo)')
+        self.failIf(results['results'])
+
+    def test_delete_deadline_abandons(self):
+        import ldap
+        import time
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSlow()
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.delete
+                         , 'cn=foo,dc=localhost'
+                         , deadline=time.time() + 5
+                         )
+        connection = conn._getConnection()
+        self.assertEqual(len(connection.abandoned), 1)
+
 
 def test_suite():
     import sys
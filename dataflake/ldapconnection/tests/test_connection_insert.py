@@ -91,7 +91,26 @@ class ConnectionInsertTests(LDAPConnectionTests):
         self.assertEquals(results['size'], 1)
 
         record = results['results'][0]
-        self.assertEquals(record['objectguid'], u'a')
+        self.assertEquals(record['objectguid'], [u'a'])
+
+    def test_insert_timelimit(self):
+        conn = self._makeSimple()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'}, timelimit=10)
+        results = conn.search('dc=localhost', '(cn=foo)')
+        self.assertEquals(results['results'][0]['a'], ['a'])
+
+    def test_insert_deadline_abandons(self):
+        import ldap
+        import time
+        conn = self._makeSlow()
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.insert
+                         , 'dc=localhost'
+                         , 'cn=foo'
+                         , timelimit=5
+                         )
+        connection = conn._getConnection()
+        self.assertEqual(len(connection.abandoned), 1)
 
 
 def test_suite():
@@ -0,0 +1,211 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_connection_itersearch: Tests for the LDAPConnection iter_search method
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.tests.base import LDAPConnectionTests
+from dataflake.ldapconnection.tests.dummy import ISO_8859_1_ENCODED
+from dataflake.ldapconnection.tests.dummy import ISO_8859_1_UTF8
+
+class ConnectionIterSearchTests(LDAPConnectionTests):
+
+    def _getPool(self, conn):
+        return conn._getPools().items()[0][1]
+
+    def test_iter_search_simple(self):
+        conn = self._makeSimple()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a':'a','b':['x','y','z']})
+        results = list(conn.iter_search('dc=localhost', fltr='(cn=foo)'))
+        self.assertEqual( results
+                        , [ { 'a': ['a']
+                            , 'dn': 'cn=foo,dc=localhost'
+                            , 'cn': ['foo']
+                            , 'b': ['x', 'y', 'z']
+                            } ]
+                        )
+
+        # The connection was handed back to the pool
+        pool = self._getPool(conn)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(len(pool.idle), 1)
+
+    def test_iter_search_nonascii(self):
+        conn = self._makeSimple()
+        attrs = {'a': [ISO_8859_1_ENCODED], 'b': ISO_8859_1_ENCODED }
+        conn.insert('dc=localhost', 'cn=foo', attrs=attrs)
+        results = list(conn.iter_search('dc=localhost', fltr='(cn=foo)'))
+        self.assertEqual( results
+                        , [ { 'dn': 'cn=foo,dc=localhost'
+                            , 'a': [ISO_8859_1_ENCODED]
+                            , 'b': [ISO_8859_1_ENCODED]
+                            , 'cn': ['foo']
+                            } ]
+                        )
+
+        results = list(conn.iter_search( 'dc=localhost'
+                                       , fltr='(cn=foo)'
+                                       , raw=True
+                                       ))
+        self.assertEqual(results[0]['a'], [ISO_8859_1_UTF8])
+
+    def test_iter_search_lazy(self):
+        from dataflake.ldapconnection.entry import LazyEntry
+        conn = self._makeSimple()
+        attrs = {'a': [ISO_8859_1_ENCODED]}
+        conn.insert('dc=localhost', 'cn=foo', attrs=attrs)
+        results = list(conn.iter_search( 'dc=localhost'
+                                       , fltr='(cn=foo)'
+                                       , lazy=True
+                                       ))
+        self.failUnless(isinstance(results[0], LazyEntry))
+        self.assertEqual(results[0]['a'], [ISO_8859_1_ENCODED])
+
+    def test_iter_search_stop_early_abandons(self):
+        conn = self._makeSimple()
+        for name in ('foo', 'bar', 'baz'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        results = conn.iter_search('dc=localhost', fltr='(objectClass=*)')
+        results.next()
+        pool = self._getPool(conn)
+        self.assertEqual(pool.idle, [])
+
+        results.close()
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(pool.idle[0].abandoned, (results.msgid,))
+        self.assertRaises(StopIteration, results.next)
+
+    def test_iter_search_garbage_collected_abandons(self):
+        conn = self._makeSimple()
+        for name in ('foo', 'bar'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        results = conn.iter_search('dc=localhost', fltr='(objectClass=*)')
+        results.next()
+        del results
+        pool = self._getPool(conn)
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(len(pool.idle[0].abandoned), 1)
+
+    def test_iter_search_exhausted_does_not_abandon(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost')
+        results = conn.iter_search('dc=localhost', fltr='(cn=foo)')
+        list(results)
+        results.close()
+        self.assertEqual(self._getPool(conn).idle[0].abandoned, ())
+
+    def test_iter_search_error_releases_connection(self):
+        import ldap
+        conn = self._makeSimple()
+        results = conn.iter_search('ou=nowhere,dc=localhost')
+        self.assertRaises(ldap.NO_SUCH_OBJECT, list, results)
+        pool = self._getPool(conn)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(len(pool.idle), 1)
+
+    def test_iter_search_paged(self):
+        conn = self._makeSimple()
+        for name in ('foo', 'bar', 'baz', 'qux', 'quux'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        results = conn.iter_search('dc=localhost', page_size=2)
+        connection = self._getPool(conn).last_used
+        dns = [results.next()['dn'] for i in range(3)]
+        # The third page is only requested when the second has been read
+        self.assertEqual(connection.page_requests, ('', '2'))
+        dns.extend([x['dn'] for x in results])
+        self.assertEqual(connection.page_requests, ('', '2', '4'))
+        self.assertEqual( set(dns)
+                        , set(['cn=foo', 'cn=bar', 'cn=baz', 'cn=qux', 'cn=quux'])
+                        )
+        self.assertEqual(len(self._getPool(conn).idle), 1)
+
+    def test_iter_search_referral(self):
+        import ldap
+        self._addRecord('cn=foo,dc=localhost')
+        exc_arg = {'info':'please go to ldap://otherhost:1389'}
+        conn, ldap_connection = self._makeRaising( 'result3'
+                                                 , ldap.REFERRAL
+                                                 , exc_arg
+                                                 )
+        results = list(conn.iter_search('dc=localhost', '(cn=foo)'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(ldap_connection.conn_string, 'ldap://otherhost:1389')
+
+    def test_iter_search_bad_referral(self):
+        import ldap
+        exc_arg = {'info':'please go to BAD_URL'}
+        conn, ldap_connection = self._makeRaising( 'result3'
+                                                 , ldap.REFERRAL
+                                                 , exc_arg
+                                                 )
+        results = conn.iter_search('dc=localhost', '(cn=foo)')
+        self.assertRaises(ldap.CONNECT_ERROR, list, results)
+
+    def test_iter_search_sizelimit(self):
+        import ldap
+        conn = self._makeSimple()
+        for name in ('foo', 'bar', 'baz'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        results = conn.iter_search('dc=localhost', sizelimit=2)
+        results.next()
+        results.next()
+        self.assertRaises(ldap.SIZELIMIT_EXCEEDED, results.next)
+        self.assertEqual(len(self._getPool(conn).idle), 1)
+
+    def test_iter_search_deadline_abandons(self):
+        import ldap
+        import time
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSlow()
+        results = conn.iter_search('dc=localhost', deadline=time.time() + 5)
+        self.assertRaises(ldap.TIMEOUT, results.next)
+        pool = self._getPool(conn)
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(pool.idle[0].abandoned, (results.msgid,))
+        self.assertRaises(StopIteration, results.next)
+
+    def test_iter_search_start_fails(self):
+        import gc
+        import ldap
+        self._addRecord('cn=foo,dc=localhost')
+        conn, ldap_connection = self._makeRaising( 'search_ext'
+                                                 , ldap.SERVER_DOWN
+                                                 )
+        self.assertRaises(ldap.SERVER_DOWN, conn.iter_search, 'dc=localhost')
+        gc.collect()
+
+        # The broken connection is discarded, nothing was abandoned
+        pool = self._getPool(conn)
+        self.assertEqual(pool.size, 0)
+        self.assertEqual(len(pool.idle), 0)
+        self.assertEqual(ldap_connection.abandoned, ())
+
+    def test_iter_search_timelimit_abandons(self):
+        import ldap
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSlow()
+        results = conn.iter_search('dc=localhost', timelimit=5)
+        self.failIf(results.deadline is None)
+        self.assertRaises(ldap.TIMEOUT, results.next)
+        pool = self._getPool(conn)
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(pool.idle[0].abandoned, (results.msgid,))
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
@@ -173,7 +173,21 @@ class ConnectionModifyTests(LDAPConnectionTests):
         conn.insert('dc=localhost', 'cn=foo', attrs={'objectguid':'a'})
         conn.modify('cn=foo,dc=localhost', attrs={'objectguid;binary': u'y'})
         rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
-        self.assertEquals(rec['objectguid'], u'y')
+        self.assertEquals(rec['objectguid'], [u'y'])
+
+    def test_modify_binary_attributes_setting(self):
+        conn = self._makeOne( 'host'
+                            , 636
+                            , 'ldap'
+                            , self._factory
+                            , binary_attributes=('jpegPhoto', 'userCertificate')
+                            )
+        conn.insert('dc=localhost', 'cn=foo', attrs={'userCertificate':'a'})
+        conn.modify( 'cn=foo,dc=localhost'
+                   , attrs={'userCertificate': '\xff;\xfe'}
+                   )
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['userCertificate'], ['\xff;\xfe'])
 
     def test_modify_modrdn(self):
         conn = self._makeSimple()
@@ -182,6 +196,31 @@ class ConnectionModifyTests(LDAPConnectionTests):
         rec = conn.search('dc=localhost', fltr='(cn=bar)')['results'][0]
         self.assertEquals(rec['cn'], ['bar'])
 
+    def test_modify_modrdn_same_value(self):
+        from dataflake.ldapconnection.tests import fakeldap
+        renames = []
+        class RenamingFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def modrdn_s(self, dn, new_rdn, *ign):
+                renames.append((dn, new_rdn))
+                return fakeldap.FakeLDAPConnection.modrdn_s( self
+                                                           , dn
+                                                           , new_rdn
+                                                           )
+        conn = self._makeOne('host', 636, 'ldap', RenamingFakeLDAPConnection)
+        conn.insert('dc=localhost', 'cn=Foo')
+
+        # Values in DNs are compared case-insensitively
+        conn.modify('cn=Foo,dc=localhost', attrs={'cn': 'foo'})
+        rec = conn.search('cn=Foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['cn'], ['foo'])
+        conn.modify('cn=Foo,dc=localhost', attrs={'CN': 'FOO'})
+        self.assertEquals(renames, [])
+
+        conn.modify('cn=Foo,dc=localhost', attrs={'cn': 'bar'})
+        self.assertEquals(renames, [('cn=Foo,dc=localhost', 'cn=bar')])
+        rec = conn.search('cn=bar,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['cn'], ['bar'])
+
     def test_modify_referral(self):
         import ldap
         exc_arg = {'info':'please go to ldap://otherhost:1389'}
@@ -206,6 +245,196 @@ class ConnectionModifyTests(LDAPConnectionTests):
                          , attrs={'a':'y'}
                          )
 
+    def test_modify_timelimit(self):
+        conn = self._makeSimple()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        conn.modify( 'cn=foo,dc=localhost'
+                   , attrs={'cn': 'bar', 'a': 'b'}
+                   , timelimit=10
+                   )
+        rec = conn.search('dc=localhost', fltr='(cn=bar)')['results'][0]
+        self.assertEquals(rec['a'], ['b'])
+
+    def test_modify_deadline_passed(self):
+        import ldap
+        import time
+        conn = self._makeSimple()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.modify
+                         , 'cn=foo,dc=localhost'
+                         , attrs={'a': 'b'}
+                         , deadline=time.time() - 1
+                         )
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['a'], ['a'])
+
+    def test_modify_preread_entry_cached(self):
+        conn, calls = self._makeCounting(entry_cache_timeout=60)
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        conn.search('cn=foo,dc=localhost', scope=0)
+        self.assertEqual(len(calls), 1)
+
+        conn.modify('cn=foo,dc=localhost', attrs={'a': 'b'})
+        self.assertEqual(len(calls), 1)
+
+        # The changed record is read again for the next modification
+        conn.modify('cn=foo,dc=localhost', attrs={'a': 'c'})
+        self.assertEqual(len(calls), 2)
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['c'])
+
+    def _makeRecording(self):
+        from dataflake.ldapconnection.tests import fakeldap
+        reads = []
+        class RecordingFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def search_s(self, base, scope=0, query='(objectClass=*)'
+                        , attrs=()):
+                if base == 'cn=foo,dc=localhost':
+                    reads.append(attrs)
+                return fakeldap.FakeLDAPConnection.search_s( self
+                                                           , base
+                                                           , scope
+                                                           , query
+                                                           , attrs
+                                                           )
+        conn = self._makeOne( 'host', 636, 'ldap'
+                            , RecordingFakeLDAPConnection
+                            )
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a', 'b': 'b'})
+        return conn, reads
+
+    def test_modify_preread_changed_attributes_only(self):
+        conn, reads = self._makeRecording()
+        conn.modify('cn=foo,dc=localhost', attrs={'a': 'x', 'c;binary': 'y'})
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(set(reads[0]), set(['a', 'c']))
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['x'])
+        self.assertEquals(rec['b'], ['b'])
+        self.assertEquals(rec['c'], ['y'])
+
+    def test_modify_explicit_add_replace_no_preread(self):
+        import ldap
+        conn, reads = self._makeRecording()
+        conn.modify('cn=foo,dc=localhost', ldap.MOD_ADD, {'a': 'x'})
+        conn.modify('cn=foo,dc=localhost', ldap.MOD_REPLACE, {'b': 'y'})
+        self.assertEqual(reads, [])
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['a', 'x'])
+        self.assertEquals(rec['b'], ['y'])
+
+    def test_modify_no_preread(self):
+        conn, reads = self._makeRecording()
+        conn.modify( 'cn=foo,dc=localhost'
+                   , attrs={'a': 'x', 'b': '', 'c': 'z'}
+                   , preread=False
+                   )
+        self.assertEqual(reads, [])
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['x'])
+        self.assertEquals(rec['c'], ['z'])
+        self.failIf(rec.has_key('b'))
+
+    def test_modify_no_preread_modrdn(self):
+        conn, reads = self._makeRecording()
+        conn.modify('cn=foo,dc=localhost', attrs={'cn': 'bar'}, preread=False)
+        self.assertEqual(reads, [])
+        rec = conn.search('dc=localhost', fltr='(cn=bar)')['results'][0]
+        self.assertEquals(rec['cn'], ['bar'])
+
+    def test_modify_assertion(self):
+        conn, reads = self._makeRecording()
+        conn.modify( 'cn=foo,dc=localhost'
+                   , attrs={'a': 'x'}
+                   , assertion='(b=b)'
+                   )
+        self.assertEqual(reads, [])
+        self.assertEqual(conn._getConnection().assertions, ('(b=b)',))
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['x'])
+
+    def test_modify_assertion_failed(self):
+        import ldap
+        conn, reads = self._makeRecording()
+        self.assertRaises( ldap.ASSERTION_FAILED
+                         , conn.modify
+                         , 'cn=foo,dc=localhost'
+                         , attrs={'a': 'x'}
+                         , assertion='(b=wrong)'
+                         )
+        rec = conn.search('cn=foo,dc=localhost', scope=0)['results'][0]
+        self.assertEquals(rec['a'], ['a'])
+
+    def test_modify_assertion_without_control(self):
+        from dataflake.ldapconnection import connection
+        conn, reads = self._makeRecording()
+        old_control = connection.AssertionControl
+        connection.AssertionControl = None
+        try:
+            self.assertRaises( RuntimeError
+                             , conn.modify
+                             , 'cn=foo,dc=localhost'
+                             , attrs={'a': 'x'}
+                             , assertion='(b=b)'
+                             )
+        finally:
+            connection.AssertionControl = old_control
+
+    def _makeDelta(self, threshold):
+        conn, mod_lists = self._makeModifyRecording(delta_threshold=threshold)
+        members = ['cn=user%i' % i for i in range(5)]
+        conn.insert('dc=localhost', 'cn=group', attrs={'member': members})
+        return conn, mod_lists, members
+
+    def test_modify_delta(self):
+        import ldap
+        conn, mod_lists, members = self._makeDelta(3)
+        new_members = members[1:] + ['cn=new', 'cn=new']
+        conn.modify('cn=group,dc=localhost', attrs={'member': new_members})
+        self.assertEqual( mod_lists
+                        , [ [ (ldap.MOD_DELETE, 'member', ['cn=user0'])
+                            , (ldap.MOD_ADD, 'member', ['cn=new'])
+                            ] ]
+                        )
+        rec = conn.search('cn=group,dc=localhost', scope=0)['results'][0]
+        self.assertEqual(set(rec['member']), set(members[1:] + ['cn=new']))
+
+    def test_modify_delta_add_only(self):
+        import ldap
+        conn, mod_lists, members = self._makeDelta(3)
+        conn.modify( 'cn=group,dc=localhost'
+                   , attrs={'member': members + ['cn=new']}
+                   )
+        self.assertEqual(mod_lists, [[(ldap.MOD_ADD, 'member', ['cn=new'])]])
+
+    def test_modify_delta_binary(self):
+        import ldap
+        conn, mod_lists, members = self._makeDelta(2)
+        conn.insert('dc=localhost', 'cn=photo', attrs={'jpegPhoto': 'abcdefgh'})
+        conn.modify('cn=photo,dc=localhost', attrs={'jpegPhoto;binary': 'xyz'})
+        self.assertEqual( mod_lists
+                        , [[(ldap.MOD_REPLACE, 'jpegPhoto', ['xyz'])]]
+                        )
+        rec = conn.search('cn=photo,dc=localhost', scope=0)['results'][0]
+        self.assertEqual(rec['jpegPhoto'], ['xyz'])
+
+    def test_modify_delta_below_threshold(self):
+        import ldap
+        conn, mod_lists, members = self._makeDelta(10)
+        conn.modify('cn=group,dc=localhost', attrs={'member': members[1:]})
+        self.assertEqual( mod_lists
+                        , [[(ldap.MOD_REPLACE, 'member', members[1:])]]
+                        )
+
+    def test_modify_delta_disabled(self):
+        import ldap
+        conn, mod_lists, members = self._makeDelta(-1)
+        conn.modify('cn=group,dc=localhost', attrs={'member': members[1:]})
+        self.assertEqual( mod_lists
+                        , [[(ldap.MOD_REPLACE, 'member', members[1:])]]
+                        )
+
 
 def test_suite():
     import sys
@@ -0,0 +1,245 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_connection_schema: Tests for the subschema support
+
+$Id$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ldap
+
+from dataflake.ldapconnection.connection import connection_cache
+from dataflake.ldapconnection.tests import fakeldap
+from dataflake.ldapconnection.tests.base import LDAPConnectionTests
+
+ATTRIBUTE_TYPES = [ "( 0.9.2342.19200300.100.1.3 "
+                    "NAME ( 'mail' 'rfc822Mailbox' ) "
+                    "EQUALITY caseIgnoreIA5Match "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.26{256} )"
+                  , "( 2.16.840.1.113730.3.1.241 NAME 'displayName' "
+                    "EQUALITY caseIgnoreMatch "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 SINGLE-VALUE )"
+                  , "( 2.5.4.36 NAME 'userCertificate' "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.8 )"
+                  ]
+
+
+class ConnectionSchemaTests(LDAPConnectionTests):
+
+    def setUp(self):
+        super(ConnectionSchemaTests, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(ConnectionSchemaTests, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def _addSubschema(self):
+        fakeldap.TREE['subschemaSubentry'] = ['cn=Subschema']
+        subschema = fakeldap.addTreeItems('cn=Subschema')
+        subschema['attributeTypes'] = list(ATTRIBUTE_TYPES)
+
+    def _schemaReads(self, searches):
+        return [x for x in searches if x in ('', 'cn=Subschema')]
+
+    def test_no_schema_by_default(self):
+        conn = self._makeSimple()
+        self.assertEquals(conn._getSchemaInfo(), None)
+        self.failIf(conn.use_schema)
+        self.assertEquals(conn.schema_file, '')
+
+    def test_subschema_read_once(self):
+        self._addSubschema()
+        conn, searches = self._makeCounting(use_schema=True)
+
+        schema = conn._getSchemaInfo()
+        self.assertEquals(self._schemaReads(searches), ['', 'cn=Subschema'])
+        self.failUnless(schema.isSingleValued('displayName'))
+        self.failIf(schema.isSingleValued('mail'))
+        self.assertEquals(schema.getEquality('rfc822Mailbox'),
+                          'caseignoreia5match')
+        self.failUnless('usercertificate' in conn._getBinaryAttributes())
+
+        self.failUnless(conn._getSchemaInfo() is schema)
+        conn.insert('dc=localhost', 'cn=foo', attrs={'mail': 'a'})
+        conn.search('dc=localhost', fltr='(cn=foo)')
+        self.assertEquals(len(self._schemaReads(searches)), 2)
+
+    def test_subschema_missing(self):
+        conn, searches = self._makeCounting(use_schema=True)
+        schema = conn._getSchemaInfo()
+        self.assertEquals(schema.getAttributeType('mail'), None)
+        self.assertEquals(self._schemaReads(searches), [''])
+
+    def test_subschema_failure_cached(self):
+        conn, ldap_connection = self._makeRaising( 'search_subschemasubentry_s'
+                                                 , ldap.SERVER_DOWN
+                                                 )
+        conn.use_schema = True
+        self.assertEquals(conn._getSchemaInfo(), None)
+
+        # The failure is remembered, the server is not asked again
+        self._addSubschema()
+        self.assertEquals(conn._getSchemaInfo(), None)
+        conn.insert('dc=localhost', 'cn=foo', attrs={'displayName': 'a;b'})
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['displayName'], ['a', 'b'])
+        conn.modify('cn=foo,dc=localhost', attrs={'displayName': 'c;d'})
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['displayName'], ['c', 'd'])
+
+        # Until the retry delay has passed
+        schema, retry_at = connection_cache.get((conn.hash, 'schema'))
+        connection_cache.set((conn.hash, 'schema'), (None, retry_at - 301))
+        self.failUnless(conn._getSchemaInfo().isSingleValued('displayName'))
+
+    def test_subschema_not_read_while_searching(self):
+        # Decoding results must not need a second pooled connection
+        self._addRecord('cn=foo,dc=localhost')
+        conn, ldap_connection = self._makeRaising( 'search_subschemasubentry_s'
+                                                 , ldap.SERVER_DOWN
+                                                 )
+        conn.binary_from_schema = True
+        conn.pool_size = 1
+        conn.pool_timeout = 0
+        results = list(conn.iter_search('dc=localhost'))
+        self.assertEquals(len(results), 1)
+
+        self._addSubschema()
+        connection_cache.set((conn.hash, 'schema'), (None, 0))
+        self.assertEquals(conn._getSubschema(load=False), None)
+        self.failIf('usercertificate' in conn._getBinaryAttributes(load=False))
+        self.failUnless('usercertificate' in conn._getBinaryAttributes())
+
+    def test_subschema_file(self):
+        self._addSubschema()
+        path = os.path.join(self.tempdir, 'schema.txt')
+        conn, searches = self._makeCounting(use_schema=True, schema_file=path)
+        conn._getSchemaInfo()
+        self.assertEquals(len(self._schemaReads(searches)), 2)
+        self.failUnless(os.path.exists(path))
+
+        # Another connection loads the saved copy
+        conn, searches = self._makeCounting(use_schema=True, schema_file=path)
+        schema = conn._getSchemaInfo()
+        self.assertEquals(self._schemaReads(searches), [])
+        self.failUnless(schema.isSingleValued('displayName'))
+        self.failUnless(schema.isBinary('userCertificate;binary'))
+
+    def test_subschema_file_unwritable(self):
+        self._addSubschema()
+        path = os.path.join(self.tempdir, 'missing', 'schema.txt')
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , use_schema=True, schema_file=path
+                            )
+        self.failUnless(conn._getSchemaInfo().isSingleValued('displayName'))
+        self.failIf(os.path.exists(path))
+
+    def test_subschema_unparsable(self):
+        # Duplicate names make python-ldap raise NameNotUnique
+        self._addSubschema()
+        fakeldap.TREE['cn=Subschema']['attributeTypes'].append(
+                "( 1.2.3.4 NAME 'displayName' )")
+        conn, searches = self._makeCounting(use_schema=True)
+        self.assertEquals(conn._getSchemaInfo(), None)
+        self.assertEquals(len(self._schemaReads(searches)), 2)
+
+        # The failure is remembered like a failed read
+        self.assertEquals(conn._getSchemaInfo(), None)
+        self.assertEquals(len(self._schemaReads(searches)), 2)
+        schema, retry_at = connection_cache.get((conn.hash, 'schema'))
+        self.failUnless(retry_at > 0)
+
+        conn.insert('dc=localhost', 'cn=foo', attrs={'displayName': 'a;b'})
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['displayName'], ['a', 'b'])
+
+    def test_subschema_file_unparsable(self):
+        self._addSubschema()
+        path = os.path.join(self.tempdir, 'schema.txt')
+        schema_file = open(path, 'w')
+        schema_file.write("( 1.2.3.4 NAME 'broken'\n")
+        schema_file.close()
+
+        # The corrupt file is ignored and replaced by the server copy
+        conn, searches = self._makeCounting(use_schema=True, schema_file=path)
+        self.failUnless(conn._getSchemaInfo().isSingleValued('displayName'))
+        self.assertEquals(len(self._schemaReads(searches)), 2)
+
+        conn, searches = self._makeCounting(use_schema=True, schema_file=path)
+        self.failUnless(conn._getSchemaInfo().isSingleValued('displayName'))
+        self.assertEquals(self._schemaReads(searches), [])
+
+    def test_insert_single_valued(self):
+        self._addSubschema()
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , use_schema=True
+                            )
+        attrs = {'displayName': 'Foo; Bar', 'mail': 'a;b'}
+        conn.insert('dc=localhost', 'cn=foo', attrs=attrs)
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['displayName'], ['Foo; Bar'])
+        self.assertEquals(rec['mail'], ['a', 'b'])
+
+    def test_modify_single_valued(self):
+        self._addSubschema()
+        conn = self._makeOne( 'host', 636, 'ldap', self._factory
+                            , use_schema=True
+                            )
+        conn.insert('dc=localhost', 'cn=foo', attrs={'displayName': 'Foo'})
+        conn.modify('cn=foo,dc=localhost', attrs={'displayName': 'Foo;Bar'})
+        rec = conn.search('dc=localhost', fltr='(cn=foo)')['results'][0]
+        self.assertEquals(rec['displayName'], ['Foo;Bar'])
+
+    def test_modify_delete_matching_rule(self):
+        self._addSubschema()
+        conn, mod_lists = self._makeModifyRecording()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'mail': 'a@b.c'})
+
+        # Without the subschema values are compared as they are
+        conn.modify('cn=foo,dc=localhost', ldap.MOD_DELETE, {'mail': 'A@B.C'})
+        self.assertEquals(mod_lists, [])
+
+        conn.use_schema = True
+        conn.modify('cn=foo,dc=localhost', ldap.MOD_DELETE, {'mail': 'A@B.C'})
+        self.assertEquals( mod_lists
+                         , [[(ldap.MOD_DELETE, 'mail', ['A@B.C'])]]
+                         )
+
+    def test_align_names(self):
+        from dataflake.ldapconnection.schema import Subschema
+        conn = self._makeSimple()
+        schema = Subschema(ATTRIBUTE_TYPES)
+        record = { 'rfc822Mailbox': ['a']
+                 , 'DisplayName': ['b']
+                 , 'cn': ['c']
+                 , 'sn': ['d']
+                 }
+        self.assertEquals( conn._alignNames( record
+                                           , ['mail', 'displayname', 'CN']
+                                           , schema
+                                           )
+                         , { 'mail': ['a']
+                           , 'displayname': ['b']
+                           , 'CN': ['c']
+                           }
+                         )
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
@@ -77,6 +77,48 @@ class ConnectionSearchTests(LDAPConnectionTests):
                           }
                         )
 
+    def test_search_lazy(self):
+        from dataflake.ldapconnection.entry import LazyEntry
+        conn = self._makeSimple()
+        attrs = { 'a': [ISO_8859_1_ENCODED]
+                , 'b': ISO_8859_1_ENCODED
+                , 'objectGUID;binary': ['guid']
+                }
+        conn.insert('dc=localhost', 'cn=foo', attrs=attrs)
+        response = conn.search('dc=localhost', fltr='(cn=foo)', lazy=True)
+        self.assertEqual(response['size'], 1)
+        rec = response['results'][0]
+        self.failUnless(isinstance(rec, LazyEntry))
+        self.assertEqual(rec.decoded.keys(), ['dn'])
+        self.assertEqual(rec['a'], [ISO_8859_1_ENCODED])
+        self.assertEqual(set(rec.decoded.keys()), set(['dn', 'a']))
+        self.assertEqual( rec
+                        , { 'dn': 'cn=foo,dc=localhost'
+                          , 'a': [ISO_8859_1_ENCODED]
+                          , 'b': [ISO_8859_1_ENCODED]
+                          , 'cn': ['foo']
+                          , 'objectGUID': ['guid']
+                          }
+                        )
+
+        # Raw results are never wrapped
+        response = conn.search( 'dc=localhost'
+                              , fltr='(cn=foo)'
+                              , raw=True
+                              , lazy=True
+                              )
+        self.failIf(isinstance(response['results'][0], LazyEntry))
+
+    def test_search_lazy_same_encoding(self):
+        conn = self._makeSimple()
+        conn.api_encoding = 'UTF-8'
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': ISO_8859_1_UTF8})
+        response = conn.search('dc=localhost', fltr='(cn=foo)', lazy=True)
+        rec = response['results'][0]
+        # Nothing needs converting
+        self.assertEqual(rec.decode, None)
+        self.assertEqual(rec['a'], [ISO_8859_1_UTF8])
+
     def test_search_bad_results(self):
         # Make sure the resultset omits "useless" entries that may be
         # emitted by some servers, notable Microsoft ActiveDirectory.
@@ -103,6 +145,353 @@ class ConnectionSearchTests(LDAPConnectionTests):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0], {'dn': 'partial result'})
 
+    def test_search_paged(self):
+        from dataflake.ldapconnection.tests import fakeldap
+        class LimitedFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            size_limit = 2
+        for name in ('foo', 'bar', 'baz', 'qux', 'quux'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        conn = self._makeOne( 'host', 636, 'ldap', LimitedFakeLDAPConnection
+                            , page_size=2
+                            )
+        response = conn.search('dc=localhost', fltr='(objectClass=*)')
+        self.assertEqual(response['size'], 5)
+        self.assertEqual( set([x['dn'] for x in response['results']])
+                        , set(['cn=foo', 'cn=bar', 'cn=baz', 'cn=qux', 'cn=quux'])
+                        )
+        connection = conn._getConnection()
+        self.assertEqual(connection.page_requests, ('', '2', '4'))
+
+    def test_search_paged_per_call(self):
+        for name in ('foo', 'bar', 'baz'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        conn = self._makeSimple()
+        response = conn.search('dc=localhost', page_size=2)
+        self.assertEqual(response['size'], 3)
+        self.assertEqual(conn._getConnection().page_requests, ('', '2'))
+
+        # Base searches are never paged
+        response = conn.search( 'cn=foo,dc=localhost'
+                              , scope=0
+                              , page_size=2
+                              )
+        self.assertEqual(response['size'], 1)
+        self.assertEqual(conn._getConnection().page_requests, ('', '2'))
+
+    def test_search_sizelimit(self):
+        for name in ('foo', 'bar', 'baz'):
+            self._addRecord('cn=%s,dc=localhost' % name)
+        conn = self._makeSimple()
+        response = conn.search('dc=localhost', sizelimit=2)
+        self.assertEqual(response['size'], 2)
+        self.assertEqual(len(response['results']), 2)
+        self.assertEqual(response['exception'], 'Size limit exceeded')
+
+        response = conn.search('dc=localhost', sizelimit=5)
+        self.assertEqual(response['size'], 3)
+        self.assertEqual(response['exception'], '')
+
+    def test_search_timelimit_sent_to_server(self):
+        from dataflake.ldapconnection.tests import fakeldap
+        calls = []
+        class RecordingFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def search_ext(self, *args, **kw):
+                calls.append(kw)
+                return fakeldap.FakeLDAPConnection.search_ext( self
+                                                             , *args
+                                                             , **kw
+                                                             )
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeOne( 'host', 636, 'ldap'
+                            , RecordingFakeLDAPConnection
+                            )
+        response = conn.search('dc=localhost', timelimit=10)
+        self.assertEqual(response['size'], 1)
+        self.assertEqual(calls[0]['timeout'], 10)
+
+    def test_search_deadline_abandons(self):
+        import ldap
+        import time
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSlow()
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.search
+                         , 'dc=localhost'
+                         , deadline=time.time() + 5
+                         )
+        pool = conn._getPools().items()[0][1]
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(len(pool.idle[0].abandoned), 1)
+
+        # A deadline that has passed already fails right away
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.search
+                         , 'dc=localhost'
+                         , deadline=time.time() - 1
+                         )
+        self.assertEqual(len(pool.idle[0].abandoned), 2)
+
+    def test_search_timelimit_abandons(self):
+        import ldap
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeSlow()
+        self.assertRaises( ldap.TIMEOUT
+                         , conn.search
+                         , 'dc=localhost'
+                         , timelimit=5
+                         )
+        pool = conn._getPools().items()[0][1]
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(len(pool.idle[0].abandoned), 1)
+
+    def test_search_timelimit_exceeded(self):
+        import ldap
+        self._addRecord('cn=foo,dc=localhost')
+        conn, ldap_connection = self._makeRaising( 'result3'
+                                                 , ldap.TIMELIMIT_EXCEEDED
+                                                 )
+        conn.cache_timeout = 60
+        response = conn.search('dc=localhost', timelimit=10)
+        self.assertEqual(response['size'], 0)
+        self.assertEqual(response['exception'], 'Time limit exceeded')
+
+        # The partial result is not cached
+        response = conn.search('dc=localhost', timelimit=10)
+        self.assertEqual(response['size'], 1)
+        self.assertEqual(response['exception'], '')
+
+    def _makeCaching(self, **kw):
+        return self._makeCounting(cache_timeout=60, **kw)
+
+    def test_search_cached(self):
+        self._addRecord('cn=foo,dc=localhost', a='a')
+        conn, calls = self._makeCaching()
+        response = conn.search('dc=localhost', fltr='(a=a)')
+        self.assertEqual(response['size'], 1)
+        self.assertEqual(len(calls), 1)
+
+        # Mutating a result does not change the cached result
+        response['results'][0]['a'].append('b')
+        response = conn.search('DC=localhost', fltr='(a=a)')
+        self.assertEqual(response['results'][0]['a'], ['a'])
+        self.assertEqual(len(calls), 1)
+
+        # Different attributes, different results
+        conn.search('dc=localhost', fltr='(a=a)', attrs=['a'])
+        self.assertEqual(len(calls), 2)
+        conn.search('dc=localhost', fltr='(a=a)', attrs=['A'])
+        self.assertEqual(len(calls), 2)
+        conn.search('dc=localhost', fltr='(a=a)', raw=True)
+        self.assertEqual(len(calls), 3)
+
+        # The cache can be bypassed
+        conn.search('dc=localhost', fltr='(a=a)', use_cache=False)
+        self.assertEqual(len(calls), 4)
+
+    def test_search_cache_disabled(self):
+        self._addRecord('cn=foo,dc=localhost', a='a')
+        conn, calls = self._makeCaching()
+        conn.cache_timeout = -1
+        conn.search('dc=localhost', fltr='(a=a)')
+        conn.search('dc=localhost', fltr='(a=a)')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(conn._getResultCache(), None)
+
+    def test_search_cache_per_identity(self):
+        self._addRecord('cn=foo,dc=localhost', a='a')
+        self._addRecord('cn=manager,dc=localhost', userPassword='secret')
+        conn, calls = self._makeCaching()
+        conn.search('dc=localhost', fltr='(a=a)')
+        conn.search( 'dc=localhost'
+                   , fltr='(a=a)'
+                   , bind_dn='cn=manager,dc=localhost'
+                   , bind_pwd='secret'
+                   )
+        conn.search( 'dc=localhost'
+                   , fltr='(a=a)'
+                   , bind_dn='cn=manager,dc=localhost'
+                   , bind_pwd='secret'
+                   )
+        # Binding searches for the bind DN
+        self.assertEqual(len([x for x in calls if x == 'dc=localhost']), 2)
+
+        # A wrong password is not answered from the cache
+        import ldap
+        self.assertRaises( ldap.INVALID_CREDENTIALS
+                         , conn.search
+                         , 'dc=localhost'
+                         , fltr='(a=a)'
+                         , bind_dn='cn=manager,dc=localhost'
+                         , bind_pwd='wrong'
+                         )
+
+    def test_search_cache_size(self):
+        self._addRecord('cn=foo,dc=localhost', a='a')
+        conn, calls = self._makeCaching(cache_size=1)
+        conn.search('dc=localhost', fltr='(a=a)')
+        conn.search('dc=localhost', fltr='(a=b)')
+        conn.search('dc=localhost', fltr='(a=a)')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(conn._getResultCache()), 1)
+
+    def test_search_cache_invalidated_by_writes(self):
+        conn, calls = self._makeCaching()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 1)
+
+        conn.insert('dc=localhost', 'cn=bar', attrs={'a': 'a'})
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 2)
+
+        conn.modify('cn=bar,dc=localhost', attrs={'a': 'b'})
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 1)
+
+        conn.delete('cn=foo,dc=localhost')
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 0)
+
+    def test_search_cache_unaffected_by_unrelated_writes(self):
+        self._addRecord('ou=users,dc=localhost')
+        self._addRecord('ou=groups,dc=localhost')
+        self._addRecord('cn=foo,ou=users,dc=localhost', a='a')
+        conn, calls = self._makeCaching()
+        conn.search('ou=users,dc=localhost', fltr='(a=a)')
+        conn.insert('ou=groups,dc=localhost', 'cn=bar', attrs={'a': 'a'})
+        conn.search('ou=users,dc=localhost', fltr='(a=a)')
+        searches = [x for x in calls if x == 'ou=users,dc=localhost']
+        self.assertEqual(len(searches), 1)
+
+    def test_search_cache_modrdn(self):
+        conn, calls = self._makeCaching()
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        response = conn.search('cn=foo,dc=localhost', scope=0)
+        self.assertEqual(response['size'], 1)
+        conn.modify('cn=foo,dc=localhost', attrs={'cn': 'bar'})
+        import ldap
+        self.assertRaises( ldap.NO_SUCH_OBJECT
+                         , conn.search
+                         , 'cn=foo,dc=localhost'
+                         , scope=0
+                         )
+
+    def test_search_negative_cached(self):
+        conn, calls = self._makeCaching()
+        conn.cache_timeout = -1
+        conn.negative_cache_timeout = 10
+        response = conn.search('dc=localhost', fltr='(cn=missing)')
+        self.assertEqual(response['size'], 0)
+        response = conn.search('dc=localhost', fltr='(cn=missing)')
+        self.assertEqual(response['size'], 0)
+        self.assertEqual(len(calls), 1)
+
+        # Searches that find something are not cached
+        self._addRecord('cn=foo,dc=localhost', a='a')
+        conn.search('dc=localhost', fltr='(a=a)')
+        conn.search('dc=localhost', fltr='(a=a)')
+        self.assertEqual(len(calls), 3)
+
+    def test_search_negative_cached_no_such_object(self):
+        import ldap
+        conn, calls = self._makeCaching()
+        conn.negative_cache_timeout = 10
+        for i in range(2):
+            self.assertRaises( ldap.NO_SUCH_OBJECT
+                             , conn.search
+                             , 'ou=missing,dc=localhost'
+                             )
+        self.assertEqual(len(calls), 1)
+
+        # Creating the base invalidates the cached error
+        conn.insert('dc=localhost', 'ou=missing')
+        response = conn.search('ou=missing,dc=localhost', scope=0)
+        self.assertEqual(response['size'], 1)
+
+    def test_search_negative_cache_invalidated_by_insert(self):
+        conn, calls = self._makeCaching()
+        conn.negative_cache_timeout = 10
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 0)
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        self.assertEqual(conn.search('dc=localhost', fltr='(a=a)')['size'], 1)
+        self.assertEqual(len(conn._getNegativeCache()), 0)
+
+    def test_search_entry_cached(self):
+        conn, calls = self._makeCaching()
+        conn.cache_timeout = -1
+        conn.entry_cache_timeout = 60
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a', 'b': 'b'})
+        response = conn.search('cn=foo,dc=localhost', scope=0)
+        self.assertEqual(response['results'][0]['a'], ['a'])
+        self.assertEqual(len(calls), 1)
+
+        # Base searches for all or some of the attributes hit the cache
+        response = conn.search('CN=foo,dc=localhost', scope=0)
+        self.assertEqual(response['size'], 1)
+        response = conn.search('cn=foo,dc=localhost', scope=0, attrs=['A'])
+        self.assertEqual( response['results']
+                        , [{'dn': 'cn=foo,dc=localhost', 'a': ['a']}]
+                        )
+        self.assertEqual(len(calls), 1)
+
+        # Attributes the record does not have may be operational
+        conn.search('cn=foo,dc=localhost', scope=0, attrs=['a', 'c'])
+        self.assertEqual(len(calls), 2)
+
+        # Filters need the server
+        identity = conn._cacheIdentity(None, None)
+        self.assertEqual( conn._getCachedEntry( conn._getEntryCache()
+                                              , 'cn=foo,dc=localhost'
+                                              , '(a=a)'
+                                              , None
+                                              , identity
+                                              , False
+                                              )
+                        , None
+                        )
+
+        # So do other scopes
+        conn.search('dc=localhost', fltr='(objectClass=*)')
+        self.assertEqual(len(calls), 3)
+
+        # Raw and lazy searches are answered from the same records
+        response = conn.search('cn=foo,dc=localhost', scope=0, raw=True)
+        self.assertEqual(response['results'][0]['a'], ['a'])
+        response = conn.search('cn=foo,dc=localhost', scope=0, lazy=True)
+        self.assertEqual(response['results'][0]['a'], ['a'])
+        self.assertEqual(len(calls), 3)
+
+    def test_search_entry_cache_lazy(self):
+        from dataflake.ldapconnection.entry import LazyEntry
+        conn, calls = self._makeCaching()
+        conn.cache_timeout = -1
+        conn.entry_cache_timeout = 60
+        self._addRecord('cn=foo,dc=localhost', sn='B\xc3\xb8')
+        response = conn.search('cn=foo,dc=localhost', scope=0, lazy=True)
+        self.failUnless(isinstance(response['results'][0], LazyEntry))
+
+        # Later searches get what they asked for
+        response = conn.search('cn=foo,dc=localhost', scope=0)
+        rec = response['results'][0]
+        self.failIf(isinstance(rec, LazyEntry))
+        self.assertEqual(rec['sn'], ['B\xf8'])
+        response = conn.search('cn=foo,dc=localhost', scope=0, raw=True)
+        self.assertEqual(response['results'][0]['sn'], ['B\xc3\xb8'])
+        self.assertEqual(len(calls), 1)
+
+    def test_search_entry_cache_refreshed_after_write(self):
+        conn, calls = self._makeCaching()
+        conn.entry_cache_timeout = 60
+        conn.insert('dc=localhost', 'cn=foo', attrs={'a': 'a'})
+        conn.search('cn=foo,dc=localhost', scope=0)
+        conn.modify('cn=foo,dc=localhost', attrs={'a': 'b'})
+        response = conn.search('cn=foo,dc=localhost', scope=0)
+        self.assertEqual(response['results'][0]['a'], ['b'])
+
+        conn.delete('cn=foo,dc=localhost')
+        import ldap
+        self.assertRaises( ldap.NO_SUCH_OBJECT
+                         , conn.search
+                         , 'cn=foo,dc=localhost'
+                         , scope=0
+                         )
+
     def test_search_referral(self):
         import ldap
         exc_arg = {'info':'please go to ldap://otherhost:1389'}
@@ -113,6 +502,36 @@ class ConnectionSearchTests(LDAPConnectionTests):
         response = conn.search('dc=localhost', '(cn=foo)')
         self.assertEqual(ldap_connection.conn_string, 'ldap://otherhost:1389')
 
+    def test_search_referral_reuses_connection(self):
+        import ldap
+        from dataflake.ldapconnection.tests import fakeldap
+        class ReferringFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def search_s(self, *args, **kw):
+                raise ldap.REFERRAL(
+                    {'info': 'please go to ldap://otherhost:1389'})
+        created = []
+        def factory(conn_string):
+            created.append(conn_string)
+            if conn_string == 'ldap://otherhost:1389':
+                return fakeldap.FakeLDAPConnection(conn_string)
+            return ReferringFakeLDAPConnection(conn_string)
+        self._addRecord('cn=foo,dc=localhost')
+        conn = self._makeOne('host', 389, 'ldap', factory)
+        self.assertEqual(conn.search('dc=localhost', '(cn=foo)')['size'], 1)
+        self.assertEqual(conn.search('dc=localhost', '(cn=foo)')['size'], 1)
+        self.assertEqual(created, ['ldap://host:389', 'ldap://otherhost:1389'])
+
+        pools = conn._getReferralPools().items()
+        self.assertEqual(len(pools), 1)
+        key, pool = pools[0]
+        self.assertEqual(key, 'ldap://otherhost:1389')
+        self.assertEqual(pool.size, 1)
+        referral_connection = pool.idle[0]
+        self.assertEqual(referral_connection._last_bind[1], ('', ''))
+
+        conn.disconnect()
+        self.assertEqual(referral_connection._last_bind, None)
+
     def test_search_bad_referral(self):
         import ldap
         exc_arg = {'info':'please go to BAD_URL'}
@@ -139,11 +558,100 @@ class ConnectionSearchTests(LDAPConnectionTests):
         self.assertEqual( results[0]
                         , { 'dn': 'cn=foo,dc=localhost'
                           , 'cn': ['foo']
-                          , 'objectguid': u'a'
+                          , 'objectguid': [u'a']
                           }
                         )
 
 
+    def test_search_binary_attributes_setting(self):
+        conn = self._makeOne( 'host'
+                            , 636
+                            , 'ldap'
+                            , self._factory
+                            , binary_attributes=('userCertificate',)
+                            )
+        attrs = {'userCertificate': '\xff\xfe', 'sn': 'B\xf8'}
+        conn.insert('dc=localhost', 'cn=foo', attrs=attrs)
+
+        raw = conn.search('dc=localhost', fltr='(cn=foo)', raw=True)
+        self.assertEqual(raw['results'][0]['userCertificate'], ['\xff\xfe'])
+        self.assertEqual(raw['results'][0]['sn'], ['B\xc3\xb8'])
+
+        results = conn.search('dc=localhost', fltr='(cn=foo)')['results']
+        self.assertEqual(results[0]['userCertificate'], ['\xff\xfe'])
+        self.assertEqual(results[0]['sn'], ['B\xf8'])
+
+        results = conn.search('dc=localhost', fltr='(cn=foo)', lazy=True)
+        self.assertEqual( results['results'][0]['userCertificate']
+                        , ['\xff\xfe']
+                        )
+
+    def test_search_binary_attributes_with_options(self):
+        # Servers return binary values under keys like "a;binary"
+        conn = self._makeOne( 'host'
+                            , 636
+                            , 'ldap'
+                            , self._factory
+                            , binary_attributes=('userCertificate',)
+                            )
+        attrs = {'cn': 'foo', 'userCertificate;binary': '\xff\xfe'}
+        self._addRecord('cn=foo,dc=localhost', **attrs)
+
+        results = conn.search('dc=localhost', fltr='(cn=foo)')['results']
+        self.assertEqual(results[0]['userCertificate;binary'], ['\xff\xfe'])
+
+        results = conn.search('dc=localhost', fltr='(cn=foo)', lazy=True)
+        self.assertEqual( results['results'][0]['userCertificate;binary']
+                        , ['\xff\xfe']
+                        )
+
+    def test_search_binary_attributes_default(self):
+        from dataflake.ldapconnection.utils import BINARY_ATTRIBUTES
+        conn = self._makeSimple()
+        binary = conn._getBinaryAttributes()
+        self.failUnless(isinstance(binary, frozenset))
+        self.assertEqual(binary, frozenset(BINARY_ATTRIBUTES))
+
+        conn.binary_attributes = ('thumbnailPhoto',)
+        self.failUnless('thumbnailphoto' in conn._getBinaryAttributes())
+
+    def test_search_binary_attributes_from_schema(self):
+        from dataflake.ldapconnection.tests import fakeldap
+        fakeldap.TREE['subschemaSubentry'] = ['cn=Subschema']
+        subschema = fakeldap.addTreeItems('cn=Subschema')
+        subschema['attributeTypes'] = [
+            "( 2.5.4.36 NAME 'userCertificate' "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.8 )",
+            "( 2.5.4.4 NAME ( 'sn' 'surname' ) "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{64} )",
+            ]
+        conn = self._makeOne( 'host'
+                            , 636
+                            , 'ldap'
+                            , self._factory
+                            , binary_from_schema=True
+                            )
+        binary = conn._getBinaryAttributes()
+        self.failUnless('usercertificate' in binary)
+        self.failUnless('objectguid' in binary)
+        self.failIf('sn' in binary)
+
+        conn.insert('dc=localhost', 'cn=foo', attrs={'userCertificate': '\xff'})
+        results = conn.search('dc=localhost', fltr='(cn=foo)')['results']
+        self.assertEqual(results[0]['userCertificate'], ['\xff'])
+
+    def test_search_binary_attributes_without_schema(self):
+        conn = self._makeOne( 'host'
+                            , 636
+                            , 'ldap'
+                            , self._factory
+                            , binary_from_schema=True
+                            )
+        conn.insert('dc=localhost', 'cn=foo')
+        results = conn.search('dc=localhost', fltr='(cn=foo)')['results']
+        self.assertEqual(results[0]['cn'], ['foo'])
+        self.failIf('usercertificate' in conn._getBinaryAttributes())
+
 def test_suite():
     import sys
     return unittest.findTestCases(sys.modules[__name__])
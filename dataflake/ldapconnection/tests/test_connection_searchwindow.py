@@ -0,0 +1,128 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_connection_searchwindow: Tests for the search_window method
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.tests.base import LDAPConnectionTests
+
+class ConnectionSearchWindowTests(LDAPConnectionTests):
+
+    def setUp(self):
+        super(ConnectionSearchWindowTests, self).setUp()
+        for cn, sn in ( ('a', 'Miller'), ('b', 'Adams'), ('c', 'Young')
+                      , ('d', 'Brown'), ('e', 'Smith') ):
+            self._addRecord('cn=%s,dc=localhost' % cn, sn=sn)
+
+    def _makeWindowed(self):
+        from dataflake.ldapconnection.search import SSSRequestControl
+        from dataflake.ldapconnection.search import VLVRequestControl
+        if SSSRequestControl is None or VLVRequestControl is None:
+            # python-ldap older than 3.0 cannot send sort and VLV controls
+            return None
+        return self._makeSimple()
+
+    def _getSurnames(self, response):
+        return [x['sn'][0] for x in response['results']]
+
+    def test_search_window(self):
+        conn = self._makeWindowed()
+        if conn is None:
+            return
+        response = conn.search_window( 'dc=localhost'
+                                     , '(objectClass=*)'
+                                     , ['sn']
+                                     , 1
+                                     , 2
+                                     )
+        self.assertEqual(response['size'], 2)
+        self.assertEqual(self._getSurnames(response), ['Brown', 'Miller'])
+        self.assertEqual(response['total'], 5)
+
+        # The connection was handed back to the pool
+        key, pool = conn._getPools().items()[0]
+        self.assertEqual(len(pool.idle), 1)
+
+    def test_search_window_reverse(self):
+        conn = self._makeWindowed()
+        if conn is None:
+            return
+        response = conn.search_window( 'dc=localhost'
+                                     , '(objectClass=*)'
+                                     , '-sn'
+                                     , 0
+                                     , 3
+                                     )
+        self.assertEqual( self._getSurnames(response)
+                        , ['Young', 'Smith', 'Miller']
+                        )
+
+    def test_search_window_past_end(self):
+        conn = self._makeWindowed()
+        if conn is None:
+            return
+        response = conn.search_window( 'dc=localhost'
+                                     , '(objectClass=*)'
+                                     , ['sn']
+                                     , 4
+                                     , 10
+                                     )
+        self.assertEqual(self._getSurnames(response), ['Young'])
+        self.assertEqual(response['total'], 5)
+
+    def test_search_window_empty(self):
+        conn = self._makeSimple()
+        response = conn.search_window( 'dc=localhost'
+                                     , '(objectClass=*)'
+                                     , ['sn']
+                                     , 0
+                                     , 0
+                                     )
+        self.assertEqual(response['size'], 0)
+        self.assertEqual(response['results'], [])
+
+    def test_search_window_vlv_error(self):
+        import ldap
+        from dataflake.ldapconnection.search import window_total
+        from dataflake.ldapconnection.tests.fakeldap import \
+            FakeVLVResponseControl
+        # 76 is the VLV error result code
+        ctrl = FakeVLVResponseControl(1, 5, result=76)
+        self.assertRaises(ldap.VLV_ERROR, window_total, [ctrl])
+        self.assertEqual(window_total([]), None)
+
+    def test_search_window_without_controls(self):
+        from dataflake.ldapconnection import search
+        conn = self._makeSimple()
+        old_control = search.SSSRequestControl
+        search.SSSRequestControl = None
+        try:
+            self.assertRaises( RuntimeError
+                             , conn.search_window
+                             , 'dc=localhost'
+                             , '(objectClass=*)'
+                             , ['sn']
+                             , 0
+                             , 2
+                             )
+        finally:
+            search.SSSRequestControl = old_control
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
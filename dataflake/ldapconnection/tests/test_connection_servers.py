@@ -21,6 +21,23 @@ import unittest
 from dataflake.ldapconnection.tests.base import LDAPConnectionTests
 
 
+class OrderedServers(dict):
+    """ Server definitions mapping with a predictable order
+    """
+
+    def __init__(self, servers, first):
+        dict.__init__(self, servers)
+        self.first = first
+
+    def keys(self):
+        keys = dict.keys(self)
+        keys.remove(self.first)
+        return [self.first] + keys
+
+    def values(self):
+        return [self[x] for x in self.keys()]
+
+
 class ConnectionServerTests(LDAPConnectionTests):
 
     def test_add_via_constructor(self):
@@ -42,11 +59,13 @@ class ConnectionServerTests(LDAPConnectionTests):
                                , 'op_timeout': -1
                                , 'conn_timeout': -1
                                , 'start_tls': False
+                               , 'weight': 1
                                }
                              , { 'url': 'ldaps://localhost:636'
                                , 'op_timeout': 10
                                , 'conn_timeout': 5
                                , 'start_tls': False
+                               , 'weight': 1
                                }
                              ]
                          )
@@ -62,15 +81,22 @@ class ConnectionServerTests(LDAPConnectionTests):
                              , 'op_timeout': 10
                              , 'conn_timeout': 5
                              , 'start_tls': True
+                             , 'weight': 1
                              }
                            , { 'url': 'ldap://host:636'
                              , 'op_timeout': -1
                              , 'conn_timeout': -1
                              , 'start_tls': False
+                             , 'weight': 1
                              }
                            ]
                          )
 
+    def test_add_server_weight(self):
+        conn = self._makeSimple()
+        conn.addServer('localhost', 389, 'ldap', weight=5)
+        self.assertEquals(conn.servers['ldap://localhost:389']['weight'], 5)
+
     def test_add_server_existing(self):
         # If a LDAP server definition with the same LDAP URL exists, it
         # will be replaced with the new values.
@@ -110,6 +136,203 @@ class ConnectionServerTests(LDAPConnectionTests):
         self.assertEqual(server['conn_timeout'], -1)
         self.assertEqual(server['op_timeout'], -1)
 
+    def test_dead_server_is_skipped(self):
+        import ldap
+        from dataflake.ldapconnection.health import OPEN
+        from dataflake.ldapconnection.tests import fakeldap
+        attempts = []
+        def factory(conn_string):
+            attempts.append(conn_string)
+            if conn_string == 'ldap://down:389':
+                conn = fakeldap.RaisingFakeLDAPConnection(conn_string)
+                conn.setExceptionAndMethod('simple_bind_s', ldap.SERVER_DOWN)
+                return conn
+            return fakeldap.FakeLDAPConnection(conn_string)
+        conn = self._makeOne('down', 389, 'ldap', factory)
+        conn.addServer('up', 389, 'ldap')
+        # Make sure the dead server is tried first
+        conn.servers = OrderedServers(conn.servers, 'ldap://down:389')
+
+        conn.connect()
+        self.assertEquals(attempts, ['ldap://down:389', 'ldap://up:389'])
+        health = conn.getServerHealth()
+        self.assertEquals(health['ldap://down:389']['state'], OPEN)
+        self.assertEquals(health['ldap://down:389']['failures'], 1)
+        self.assertEquals(health['ldap://up:389']['failures'], 0)
+
+        # Opening another connection skips the dead server
+        conn.disconnect()
+        del attempts[:]
+        conn.connect()
+        self.assertEquals(attempts, ['ldap://up:389'])
+
+    def test_dead_servers_tried_as_last_resort(self):
+        import ldap
+        conn, ldap_connection = self._makeRaising('simple_bind_s'
+                                                 , ldap.SERVER_DOWN
+                                                 )
+        self.assertRaises(ldap.SERVER_DOWN, conn.connect)
+        self.assertEquals( conn.getServerHealth()['ldap://host:389']['failures']
+                         , 1
+                         )
+
+        # The only server is tried although its circuit breaker is open
+        connection = conn.connect()
+        self.failUnless(connection is ldap_connection)
+        self.assertEquals( conn.getServerHealth()['ldap://host:389']['failures']
+                         , 0
+                         )
+
+    def test_invalid_credentials_keep_server_healthy(self):
+        import ldap
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.assertRaises( ldap.INVALID_CREDENTIALS
+                         , conn.connect
+                         , 'cn=foo,dc=localhost'
+                         , 'wrong'
+                         )
+        self.assertEquals( conn.getServerHealth()['ldap://host:636']['failures']
+                         , 0
+                         )
+
+    def test_server_strategy_default(self):
+        conn = self._makeSimple()
+        self.assertEquals(conn.server_strategy, 'failover')
+
+    def test_server_strategy_unknown_raises(self):
+        self.assertRaises( ValueError
+                         , self._makeOne
+                         , 'host', 636, 'ldap', self._factory
+                         , server_strategy='UNKNOWN'
+                         )
+
+    def test_server_strategy_round_robin(self):
+        conn = self._makeOne( 'host1', 389, 'ldap', self._factory
+                            , server_strategy='round-robin'
+                            , pool_size=1
+                            )
+        conn.addServer('host2', 389, 'ldap')
+        pool1, connection1 = conn._checkout()
+        pool2, connection2 = conn._checkout()
+        self.assertNotEquals(connection1.args, connection2.args)
+        self.assertEquals( conn.getServerHealth()['ldap://host1:389']['outstanding']
+                         , 1
+                         )
+        self.assertEquals( conn.getServerHealth()['ldap://host2:389']['outstanding']
+                         , 1
+                         )
+        pool1.checkin(connection1)
+        pool2.checkin(connection2)
+        self.assertEquals( conn.getServerHealth()['ldap://host1:389']['outstanding']
+                         , 0
+                         )
+        self.failIf( conn.getServerHealth()['ldap://host1:389']['latency']
+                     is None
+                   )
+
+    def test_server_strategy_least_outstanding(self):
+        conn = self._makeOne( 'host1', 389, 'ldap', self._factory
+                            , server_strategy='least-outstanding'
+                            )
+        conn.addServer('host2', 389, 'ldap')
+        connections = [conn._checkout()[1] for i in range(4)]
+        servers = [x.args[0] for x in connections]
+        self.assertEquals(servers.count('ldap://host1:389'), 2)
+        self.assertEquals(servers.count('ldap://host2:389'), 2)
+
+    def _makeRacing(self, blocked_url, release):
+        from dataflake.ldapconnection.tests import fakeldap
+        created = []
+        class BlockingFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def simple_bind_s(self, binduid, bindpwd):
+                if self.args[0] == blocked_url:
+                    release.wait()
+                return fakeldap.FakeLDAPConnection.simple_bind_s( self
+                                                                , binduid
+                                                                , bindpwd
+                                                                )
+        def factory(conn_string):
+            conn = BlockingFakeLDAPConnection(conn_string)
+            created.append(conn)
+            return conn
+        conn = self._makeOne('slow', 389, 'ldap', factory, race_delay=0.05)
+        conn.addServer('fast', 389, 'ldap')
+        conn.servers = OrderedServers(conn.servers, 'ldap://slow:389')
+        return conn, created
+
+    def test_race_hanging_server(self):
+        import threading
+        release = threading.Event()
+        conn, created = self._makeRacing('ldap://slow:389', release)
+        try:
+            connection = conn.connect()
+            self.assertEquals(connection.args, ('ldap://fast:389',))
+            self.assertEquals( [x.args[0] for x in created]
+                             , ['ldap://slow:389', 'ldap://fast:389']
+                             )
+        finally:
+            release.set()
+
+        # The losing connection is closed once it completes
+        slow_connection = created[0]
+        for i in range(100):
+            if slow_connection._last_bind is None:
+                break
+            threading.Event().wait(0.01)
+        self.assertEquals(slow_connection._last_bind, None)
+
+        # Idle pooled connections are used without racing again
+        self.failUnless(conn.connect() is connection)
+        self.assertEquals(len(created), 2)
+
+    def test_race_preferred_server_wins(self):
+        import threading
+        release = threading.Event()
+        conn, created = self._makeRacing('ldap://none:389', release)
+        connection = conn.connect()
+        self.assertEquals(connection.args, ('ldap://slow:389',))
+
+    def test_race_all_servers_fail(self):
+        import ldap
+        from dataflake.ldapconnection.tests import fakeldap
+        class DownFakeLDAPConnection(fakeldap.FakeLDAPConnection):
+            def simple_bind_s(self, binduid, bindpwd):
+                raise ldap.SERVER_DOWN
+        conn = self._makeOne( 'host1', 389, 'ldap', DownFakeLDAPConnection
+                            , race_delay=0.05
+                            )
+        conn.addServer('host2', 389, 'ldap')
+        self.assertRaises(ldap.SERVER_DOWN, conn.connect)
+        health = conn.getServerHealth()
+        self.assertEquals(health['ldap://host1:389']['failures'], 1)
+        self.assertEquals(health['ldap://host2:389']['failures'], 1)
+
+    def test_race_fills_pool(self):
+        conn = self._makeOne( 'host1', 389, 'ldap', self._factory
+                            , race_delay=0, pool_min_size=2
+                            )
+        conn.addServer('host2', 389, 'ldap')
+        connection = conn.connect()
+
+        # Either server may win, its pool holds the raced connection
+        key, pool = conn._getPools().items()[-1]
+        self.assertEquals(key[0], connection.args[0])
+        self.assertEquals(pool.size, 2)
+        self.assertEquals(len(pool.idle), 2)
+        self.failUnless(connection in pool.idle)
+
+    def test_race_invalid_credentials(self):
+        import ldap
+        conn = self._makeOne('host1', 389, 'ldap', self._factory, race_delay=0)
+        conn.addServer('host2', 389, 'ldap')
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.assertRaises( ldap.INVALID_CREDENTIALS
+                         , conn.connect
+                         , 'cn=foo,dc=localhost'
+                         , 'wrong'
+                         )
+
 
 def test_suite():
     import sys
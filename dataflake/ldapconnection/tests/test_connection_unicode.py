@@ -41,6 +41,30 @@ class UnicodeSupportTests(LDAPConnectionTests):
                           }
                         )
 
+    def test_search_unicode_results_constructor(self):
+        conn = self._getTargetClass()( 'host'
+                                     , 636
+                                     , 'ldap'
+                                     , self._makeSimple().c_factory
+                                     , api_encoding=None
+                                     )
+
+        attrs = {'displayName': u'Bjørn', 'sn': u'Bj'}
+        conn.insert(u'dc=localhost', u'cn=føø', attrs=attrs)
+
+        response = conn.search(u'dc=localhost', fltr=u'(cn=føø)')
+        self.assertEqual(response['size'], 1)
+
+        results = response['results']
+        self.assertEqual( results[0]
+                        , { 'dn': u'cn=føø,dc=localhost'
+                          , 'cn': [u'føø']
+                          , 'displayName': [u'Bjørn']
+                          , 'sn': [u'Bj']
+                          }
+                        )
+        self.failUnless(isinstance(results[0]['sn'][0], unicode))
+
     def test_search_raw_results(self):
         conn = self._makeSimple()
         conn.api_encoding = None
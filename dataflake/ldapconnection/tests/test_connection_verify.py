@@ -0,0 +1,112 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_connection_verify: Tests for the LDAPConnection verify_credentials
+method
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.tests.base import LDAPConnectionTests
+from dataflake.ldapconnection.tests.dummy import ISO_8859_1_ENCODED
+from dataflake.ldapconnection.tests.dummy import ISO_8859_1_UTF8
+from dataflake.ldapconnection.tests.fakeldap import FakeLDAPConnection
+
+
+class FastBindFakeLDAPConnection(FakeLDAPConnection):
+    """ A fake connection advertising AD fast concurrent binds
+    """
+    extop_requests = ()
+
+    def search_s(self, base, scope=2, query='(objectClass=*)', attrs=()):
+        if base == '':
+            from dataflake.ldapconnection.connection import FAST_BIND_OID
+            return [('', {'supportedExtension': [FAST_BIND_OID]})]
+        return FakeLDAPConnection.search_s(self, base, scope, query, attrs)
+
+    def extop_s(self, extreq):
+        self.extop_requests = self.extop_requests + (extreq.requestName,)
+
+
+class ConnectionVerifyTests(LDAPConnectionTests):
+
+    def test_verify_valid_credentials(self):
+        conn = self._makeSimple()
+        bind_dn_apiencoded = 'cn=%s,dc=localhost' % ISO_8859_1_ENCODED
+        bind_dn_serverencoded = 'cn=%s,dc=localhost' % ISO_8859_1_UTF8
+        self._addRecord(bind_dn_serverencoded, userPassword='pass')
+        self.failUnless(conn.verify_credentials(bind_dn_apiencoded, 'pass'))
+
+    def test_verify_invalid_credentials(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.failIf(conn.verify_credentials('cn=foo,dc=localhost', 'wrong'))
+
+        # Failed binds do not use up pooled connections
+        key, pool = conn._getVerifyPools().items()[0]
+        self.assertEquals(pool.size, 1)
+        self.assertEquals(len(pool.idle), 1)
+
+    def test_verify_empty_credentials(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.failIf(conn.verify_credentials('cn=foo,dc=localhost', ''))
+        self.failIf(conn.verify_credentials('', 'pass'))
+
+    def test_verify_does_not_touch_operation_pools(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        connection = conn.connect()
+        self.failUnless(conn.verify_credentials('cn=foo,dc=localhost', 'pass'))
+        self.assertEquals(connection._last_bind[1], ('', ''))
+        self.assertEquals(len(conn._getPools().items()), 1)
+        self.failUnless(conn.connect() is connection)
+
+    def test_verify_noserver_raises(self):
+        conn = self._makeSimple()
+        conn.removeServer('host', '636', 'ldap')
+        self.assertRaises( RuntimeError
+                         , conn.verify_credentials
+                         , 'cn=foo,dc=localhost'
+                         , 'pass'
+                         )
+
+    def test_verify_fast_bind(self):
+        from dataflake.ldapconnection.connection import ExtendedRequest
+        from dataflake.ldapconnection.connection import FAST_BIND_OID
+        conn = self._makeOne('host', 636, 'ldap', FastBindFakeLDAPConnection)
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        self.failUnless(conn.verify_credentials('cn=foo,dc=localhost', 'pass'))
+        key, pool = conn._getVerifyPools().items()[0]
+        connection = pool.idle[0]
+        if ExtendedRequest is not None:
+            self.assertEquals(connection.extop_requests, (FAST_BIND_OID,))
+
+        # Connections for other operations do not use fast binds
+        self.assertEquals(conn.connect().extop_requests, ())
+
+    def test_disconnect_closes_verify_pools(self):
+        conn = self._makeSimple()
+        self._addRecord('cn=foo,dc=localhost', userPassword='pass')
+        conn.verify_credentials('cn=foo,dc=localhost', 'pass')
+        key, pool = conn._getVerifyPools().items()[0]
+        connection = pool.idle[0]
+        conn.disconnect()
+        self.assertEquals(connection._last_bind, None)
+        self.failUnless(pool.closed)
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
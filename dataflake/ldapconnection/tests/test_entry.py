@@ -0,0 +1,114 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_entry: Tests for the LazyEntry class
+
+$Id$
+"""
+
+import unittest
+
+class LazyEntryTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.entry import LazyEntry
+        return LazyEntry
+
+    def _makeOne(self, values=None, binary=('objectguid',)):
+        self.decoded = []
+        def decode(value):
+            self.decoded.append(value)
+            return value.upper()
+        if values is None:
+            values = { 'cn': ['foo']
+                     , 'member': ['a', 'b']
+                     , 'objectGUID': ['guid']
+                     }
+        return self._getTargetClass()('cn=foo', values, decode, binary)
+
+    def test_decode_on_access(self):
+        entry = self._makeOne()
+        self.assertEquals(self.decoded, ['cn=foo'])
+        self.assertEquals(entry['cn'], ['FOO'])
+        self.assertEquals(self.decoded, ['cn=foo', 'foo'])
+
+        # Decoded values are kept
+        self.assertEquals(entry['cn'], ['FOO'])
+        self.assertEquals(self.decoded, ['cn=foo', 'foo'])
+
+    def test_binary_not_decoded(self):
+        entry = self._makeOne()
+        self.assertEquals(entry['objectGUID'], ['guid'])
+        self.assertEquals(self.decoded, ['cn=foo'])
+
+    def test_binary_with_options_not_decoded(self):
+        entry = self._makeOne({'objectGUID;binary': ['guid']})
+        self.assertEquals(entry['objectGUID;binary'], ['guid'])
+        self.assertEquals(self.decoded, ['cn=foo'])
+
+    def test_no_decoding(self):
+        entry = self._getTargetClass()( 'cn=foo'
+                                      , {'cn': ['foo'], 'sn': 'bar'}
+                                      , None
+                                      )
+        self.assertEquals(entry['dn'], 'cn=foo')
+        self.assertEquals(entry['cn'], ['foo'])
+        self.assertEquals(entry['sn'], 'bar')
+
+    def test_string_value(self):
+        entry = self._makeOne({'cn': 'foo'})
+        self.assertEquals(entry['cn'], 'FOO')
+
+    def test_mapping(self):
+        entry = self._makeOne()
+        self.assertEquals(entry['dn'], 'CN=FOO')
+        self.failUnless(entry.has_key('member'))
+        self.failUnless('member' in entry)
+        self.failIf('missing' in entry)
+        self.assertEquals(len(self.decoded), 1)
+        self.assertEquals( set(entry.keys())
+                         , set(['dn', 'cn', 'member', 'objectGUID'])
+                         )
+        self.assertEquals(len(entry), 4)
+        self.assertEquals(entry.get('missing'), None)
+        self.assertRaises(KeyError, entry.__getitem__, 'missing')
+        self.assertEquals( entry
+                         , { 'dn': 'CN=FOO'
+                           , 'cn': ['FOO']
+                           , 'member': ['A', 'B']
+                           , 'objectGUID': ['guid']
+                           }
+                         )
+
+    def test_set_and_delete(self):
+        entry = self._makeOne()
+        entry['cn'] = ['bar']
+        self.assertEquals(entry['cn'], ['bar'])
+        entry['new'] = ['x']
+        self.assertEquals(len(entry), 5)
+        del entry['member']
+        self.failIf(entry.has_key('member'))
+        self.assertRaises(KeyError, entry.__delitem__, 'member')
+
+    def test_deepcopy(self):
+        from copy import deepcopy
+        entry = self._makeOne()
+        clone = deepcopy(entry)
+        clone['member'].append('C')
+        self.assertEquals(entry['member'], ['A', 'B'])
+        self.assertEquals(clone['member'], ['A', 'B', 'C'])
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
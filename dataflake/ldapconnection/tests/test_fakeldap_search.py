@@ -233,6 +233,52 @@ class FakeLDAPSearchTests(FakeLDAPTests):
         self.assertFalse('userPassword' in attr_dict)
         self.assertFalse('objectClass' in attr_dict)
 
+    def test_search_ext_result3(self):
+        import ldap
+        conn = self._makeOne()
+        self._addUser('foo')
+        self._addUser('bar')
+
+        msgid = conn.search_ext('ou=users,dc=localhost', ldap.SCOPE_SUBTREE)
+        dn_values = []
+        while True:
+            rtype, rdata, rmsgid, ctrls = conn.result3(msgid, 0)
+            self.assertEquals(rmsgid, msgid)
+            if rtype == ldap.RES_SEARCH_RESULT:
+                break
+            self.assertEquals(rtype, ldap.RES_SEARCH_ENTRY)
+            dn_values.extend([dn for (dn, attr_dict) in rdata])
+        self.assertEquals(set(dn_values), set(['cn=foo', 'cn=bar']))
+
+    def test_search_ext_error(self):
+        import ldap
+        conn = self._makeOne()
+        msgid = conn.search_ext('ou=nowhere,dc=localhost', ldap.SCOPE_SUBTREE)
+        self.assertRaises(ldap.NO_SUCH_OBJECT, conn.result3, msgid)
+
+    def test_search_ext_sizelimit(self):
+        import ldap
+        conn = self._makeOne()
+        self._addUser('foo')
+        self._addUser('bar')
+        msgid = conn.search_ext( 'ou=users,dc=localhost'
+                               , ldap.SCOPE_SUBTREE
+                               , sizelimit=1
+                               )
+        rtype, rdata, rmsgid, ctrls = conn.result3(msgid, 0)
+        self.assertEquals(rtype, ldap.RES_SEARCH_ENTRY)
+        self.assertEquals(len(rdata), 1)
+        self.assertRaises(ldap.SIZELIMIT_EXCEEDED, conn.result3, msgid, 0)
+
+    def test_abandon(self):
+        import ldap
+        conn = self._makeOne()
+        self._addUser('foo')
+        msgid = conn.search_ext('ou=users,dc=localhost', ldap.SCOPE_SUBTREE)
+        conn.abandon(msgid)
+        self.assertEquals(conn.abandoned, (msgid,))
+        self.assertRaises(KeyError, conn.result3, msgid)
+
 
 def test_suite():
     import sys
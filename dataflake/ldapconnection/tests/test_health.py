@@ -0,0 +1,111 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_health: Tests for the ServerHealth class
+
+$Id$
+"""
+
+import unittest
+
+class ServerHealthTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.health import ServerHealth
+        return ServerHealth
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def test_defaults(self):
+        from dataflake.ldapconnection.health import CLOSED
+        health = self._makeOne()
+        self.assertEquals(health.state, CLOSED)
+        self.assertEquals( health.info()
+                         , { 'state': CLOSED
+                           , 'failures': 0
+                           , 'last_failure': None
+                           , 'outstanding': 0
+                           , 'latency': None
+                           }
+                         )
+        self.failUnless(health.available())
+
+    def test_failure_below_threshold(self):
+        from dataflake.ldapconnection.health import CLOSED
+        health = self._makeOne(threshold=2)
+        health.failure()
+        self.assertEquals(health.state, CLOSED)
+        self.assertEquals(health.failures, 1)
+        self.failIf(health.last_failure is None)
+        self.failUnless(health.available())
+
+    def test_failure_opens_breaker(self):
+        from dataflake.ldapconnection.health import OPEN
+        health = self._makeOne(threshold=2)
+        health.failure()
+        health.failure()
+        self.assertEquals(health.state, OPEN)
+        self.failIf(health.available())
+
+    def test_success_closes_breaker(self):
+        from dataflake.ldapconnection.health import CLOSED
+        health = self._makeOne()
+        health.failure()
+        health.success()
+        self.assertEquals(health.state, CLOSED)
+        self.assertEquals(health.failures, 0)
+        self.failUnless(health.available())
+
+    def test_half_open_after_backoff(self):
+        from dataflake.ldapconnection.health import HALF_OPEN
+        from dataflake.ldapconnection.health import OPEN
+        health = self._makeOne(backoff=30)
+        health.failure()
+        health.last_failure -= 31
+        self.failUnless(health.available())
+        self.assertEquals(health.state, HALF_OPEN)
+
+        # Only one trial attempt is allowed
+        self.failIf(health.available())
+
+        # A failed trial re-opens the breaker with a longer backoff
+        health.failure()
+        self.assertEquals(health.state, OPEN)
+        self.assertEquals(health.currentBackoff(), 60)
+        health.last_failure -= 31
+        self.failIf(health.available())
+
+    def test_backoff_is_capped(self):
+        from dataflake.ldapconnection.health import MAX_BACKOFF_FACTOR
+        health = self._makeOne(backoff=30)
+        for i in range(20):
+            health.failure()
+        self.assertEquals(health.currentBackoff(), 30 * MAX_BACKOFF_FACTOR)
+
+    def test_load_statistics(self):
+        from dataflake.ldapconnection.health import LATENCY_WEIGHT
+        health = self._makeOne()
+        health.started()
+        health.started()
+        self.assertEquals(health.outstanding, 2)
+        health.finished(1.0)
+        self.assertEquals(health.outstanding, 1)
+        self.assertEquals(health.latency, 1.0)
+        health.finished(2.0)
+        self.assertEquals(health.outstanding, 0)
+        self.assertEquals(health.latency, 1.0 + LATENCY_WEIGHT)
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
@@ -0,0 +1,454 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_pool: Tests for the connection pool classes
+
+$Id$
+"""
+
+import threading
+import unittest
+
+from dataflake.ldapconnection.tests.fakeldap import FakeLDAPConnection
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.pool import ConnectionPool
+        return ConnectionPool
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def _factory(self):
+        return FakeLDAPConnection()
+
+    def test_checkout_creates_connection(self):
+        pool = self._makeOne()
+        conn = pool.checkout(self._factory)
+        self.failUnless(isinstance(conn, FakeLDAPConnection))
+        self.assertEquals(pool.size, 1)
+        self.assertEquals(pool.idle, [])
+        self.failUnless(pool.last_used is conn)
+
+    def test_checkin_reuses_connection(self):
+        pool = self._makeOne()
+        conn = pool.checkout(self._factory)
+        pool.checkin(conn)
+        self.assertEquals(pool.idle, [conn])
+        self.failUnless(pool.checkout(self._factory) is conn)
+        self.assertEquals(pool.size, 1)
+
+    def test_concurrent_checkouts_get_separate_connections(self):
+        pool = self._makeOne(max_size=2)
+        conn1 = pool.checkout(self._factory)
+        conn2 = pool.checkout(self._factory)
+        self.failIf(conn1 is conn2)
+        self.assertEquals(pool.size, 2)
+
+    def test_exhausted_pool_times_out(self):
+        pool = self._makeOne(max_size=1, timeout=0)
+        pool.checkout(self._factory)
+        self.assertRaises(RuntimeError, pool.checkout, self._factory)
+
+    def test_exhausted_pool_waits_for_checkin(self):
+        pool = self._makeOne(max_size=1, timeout=5)
+        conn = pool.checkout(self._factory)
+        timer = threading.Timer(0.1, pool.checkin, (conn,))
+        timer.start()
+        self.failUnless(pool.checkout(self._factory) is conn)
+        timer.join()
+
+    def test_factory_failure_releases_slot(self):
+        import ldap
+        pool = self._makeOne(max_size=1)
+        def factory():
+            raise ldap.SERVER_DOWN
+        self.assertRaises(ldap.SERVER_DOWN, pool.checkout, factory)
+        self.assertEquals(pool.size, 0)
+
+    def test_discard(self):
+        pool = self._makeOne()
+        conn = pool.checkout(self._factory)
+        conn.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        pool.discard(conn)
+        self.assertEquals(pool.size, 0)
+        self.assertEquals(pool.idle, [])
+        self.assertEquals(conn._last_bind, None)
+
+    def test_adopt(self):
+        pool = self._makeOne(max_size=1)
+        conn = self._factory()
+        self.failUnless(pool.adopt(conn))
+        self.assertEquals(pool.size, 1)
+        self.assertEquals(pool.idle, [])
+        self.failUnless(pool.last_used is conn)
+
+        # The adopted connection is handed back like any other
+        self.failIf(pool.adopt(self._factory()))
+        pool.checkin(conn)
+        self.failUnless(pool.checkout(self._factory) is conn)
+
+    def test_fill(self):
+        pool = self._makeOne(min_size=3, max_size=5)
+        pool.fill(self._factory)
+        self.assertEquals(pool.size, 3)
+        self.assertEquals(len(pool.idle), 3)
+
+    def test_fill_size(self):
+        pool = self._makeOne(min_size=1, max_size=3)
+        pool.fill(self._factory, size=2)
+        self.assertEquals(pool.size, 2)
+        pool.fill(self._factory, size=5)
+        self.assertEquals(pool.size, 3)
+
+    def test_close(self):
+        pool = self._makeOne()
+        conn1 = pool.checkout(self._factory)
+        conn2 = pool.checkout(self._factory)
+        conn1.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        conn2.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        pool.checkin(conn1)
+        pool.close()
+        self.assertEquals(conn1._last_bind, None)
+        self.assertEquals(pool.idle, [])
+
+        # Connections checked in after closing the pool are closed as well
+        pool.checkin(conn2)
+        self.assertEquals(conn2._last_bind, None)
+        self.assertEquals(pool.idle, [])
+        self.assertEquals(pool.size, 0)
+
+    def test_max_idle(self):
+        pool = self._makeOne(max_idle=60)
+        conn1 = pool.checkout(self._factory)
+        conn2 = pool.checkout(self._factory)
+        conn1.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        pool.checkin(conn1)
+        pool.checkin(conn2)
+        pool.idle_since[id(conn1)] -= 61
+        conn = pool.checkout(self._factory)
+        self.failUnless(conn is conn2)
+        self.assertEquals(conn1._last_bind, None)
+        self.assertEquals(pool.idle, [])
+        self.assertEquals(pool.size, 1)
+
+    def test_max_lifetime(self):
+        pool = self._makeOne(max_lifetime=60)
+        conn = pool.checkout(self._factory)
+        conn.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        pool.created[id(conn)] -= 61
+        pool.checkin(conn)
+        self.assertEquals(conn._last_bind, None)
+        self.assertEquals(pool.idle, [])
+        self.assertEquals(pool.size, 0)
+        self.assertEquals(pool.created, {})
+
+        # Idle connections are checked at checkout time
+        conn = pool.checkout(self._factory)
+        pool.checkin(conn)
+        pool.created[id(conn)] -= 61
+        self.failIf(pool.checkout(self._factory) is conn)
+        self.assertEquals(pool.size, 1)
+
+    def test_probe_replaces_expired_connections(self):
+        pool = self._makeOne(max_idle=60, factory=self._factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        pool.idle_since[id(conn)] -= 61
+        checked = []
+        pool.probe(checked.append)
+        self.assertEquals(len(pool.idle), 1)
+        self.failIf(pool.idle[0] is conn)
+        self.assertEquals(checked, [])
+        self.assertEquals(pool.size, 1)
+
+    def test_checkout_uses_pool_factory(self):
+        pool = self._makeOne(factory=self._factory)
+        conn = pool.checkout()
+        self.failUnless(isinstance(conn, FakeLDAPConnection))
+
+    def test_probe_keeps_working_connections(self):
+        pool = self._makeOne(factory=self._factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        checked = []
+        pool.probe(checked.append)
+        self.assertEquals(checked, [conn])
+        self.assertEquals(pool.idle, [conn])
+        self.assertEquals(pool.size, 1)
+
+    def test_probe_keeps_idle_time(self):
+        pool = self._makeOne(max_idle=60, factory=self._factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        pool.idle_since[id(conn)] -= 50
+        idle_since = pool.idle_since[id(conn)]
+        last_checkout = pool.last_checkout
+        pool.probe(lambda conn: None)
+        self.assertEquals(pool.idle, [conn])
+        self.assertEquals(pool.idle_since[id(conn)], idle_since)
+        self.assertEquals(pool.last_checkout, last_checkout)
+
+        # Keeping the connection alive does not keep it from expiring
+        pool.idle_since[id(conn)] -= 11
+        pool.probe(lambda conn: None)
+        self.assertEquals(len(pool.idle), 1)
+        self.failIf(pool.idle[0] is conn)
+
+    def test_probe_replaces_broken_connections(self):
+        import ldap
+        pool = self._makeOne(factory=self._factory)
+        conn1 = pool.checkout()
+        conn2 = pool.checkout()
+        conn2.simple_bind_s('cn=Manager,dc=localhost', 'secret')
+        pool.checkin(conn1)
+        pool.checkin(conn2)
+        def check(conn):
+            if conn is conn2:
+                raise ldap.SERVER_DOWN
+        pool.probe(check)
+        self.assertEquals(pool.size, 2)
+        self.assertEquals(len(pool.idle), 2)
+        self.failUnless(conn1 in pool.idle)
+        self.failIf(conn2 in pool.idle)
+        self.assertEquals(conn2._last_bind, None)
+
+    def test_probe_server_errors_keep_connection(self):
+        import ldap
+        pool = self._makeOne(factory=self._factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        def check(conn):
+            raise ldap.INSUFFICIENT_ACCESS
+        pool.probe(check)
+        self.assertEquals(pool.idle, [conn])
+
+    def test_probe_server_down_shrinks_pool(self):
+        import ldap
+        def factory():
+            raise ldap.SERVER_DOWN
+        pool = self._makeOne(min_size=1)
+        pool.checkin(pool.checkout(self._factory))
+        pool.factory = factory
+        def check(conn):
+            raise ldap.SERVER_DOWN
+        pool.probe(check)
+        self.assertEquals(pool.size, 0)
+        self.assertEquals(pool.idle, [])
+
+    def test_probe_fills_pool(self):
+        pool = self._makeOne(min_size=2, factory=self._factory)
+        pool.probe()
+        self.assertEquals(pool.size, 2)
+        self.assertEquals(len(pool.idle), 2)
+
+    def test_probe_leaves_checked_out_connections_alone(self):
+        pool = self._makeOne(factory=self._factory)
+        conn = pool.checkout()
+        checked = []
+        pool.probe(checked.append)
+        self.assertEquals(checked, [])
+        self.assertEquals(pool.size, 1)
+
+
+class ConnectionFactoryTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.pool import ConnectionFactory
+        return ConnectionFactory
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def _makeServer(self):
+        return { 'url': 'ldap://localhost:389'
+               , 'conn_timeout': 5
+               , 'op_timeout': 10
+               , 'start_tls': False
+               }
+
+    def test_creates_bound_connection(self):
+        factory = self._makeOne( FakeLDAPConnection
+                               , self._makeServer()
+                               , bind_dn='cn=Manager,dc=localhost'
+                               , bind_pwd='secret'
+                               )
+        conn = factory()
+        self.failUnless(isinstance(conn, FakeLDAPConnection))
+        self.assertEquals(conn.timeout, 10)
+        self.assertEquals( conn._last_bind[1]
+                         , ('cn=Manager,dc=localhost', 'secret')
+                         )
+
+    def test_records_outcome(self):
+        import ldap
+        from dataflake.ldapconnection.health import ServerHealth
+        from dataflake.ldapconnection.tests.fakeldap import \
+            RaisingFakeLDAPConnection
+        health = ServerHealth()
+        conn = RaisingFakeLDAPConnection()
+        conn.setExceptionAndMethod('simple_bind_s', ldap.SERVER_DOWN)
+        factory = self._makeOne( lambda url: conn
+                               , self._makeServer()
+                               , bind_dn='cn=Manager,dc=localhost'
+                               , bind_pwd='secret'
+                               , stats=health
+                               )
+        self.assertRaises(ldap.SERVER_DOWN, factory)
+        self.assertEquals(health.failures, 1)
+        factory()
+        self.assertEquals(health.failures, 0)
+
+    def test_setup(self):
+        prepared = []
+        factory = self._makeOne( FakeLDAPConnection
+                               , self._makeServer()
+                               , setup=prepared.append
+                               )
+        conn = factory()
+        self.assertEquals(prepared, [conn])
+
+
+class PoolRegistryTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.pool import PoolRegistry
+        return PoolRegistry
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def test_get_creates_pool(self):
+        registry = self._makeOne(max_size=3, timeout=10)
+        pool = registry.get('key')
+        self.assertEquals(pool.max_size, 3)
+        self.assertEquals(pool.timeout, 10)
+        self.failUnless(registry.get('key') is pool)
+        self.assertEquals(registry.items(), [('key', pool)])
+
+    def test_get_overrides_settings(self):
+        registry = self._makeOne(min_size=2)
+        self.assertEquals(registry.get('key1').min_size, 2)
+        self.assertEquals(registry.get('key2', min_size=0).min_size, 0)
+
+    def test_lru_eviction(self):
+        registry = self._makeOne(max_pools=2)
+        pool1 = registry.get('key1')
+        pool2 = registry.get('key2')
+        registry.get('key1')
+        pool3 = registry.get('key3')
+        self.assertEquals(registry.items(), [('key1', pool1), ('key3', pool3)])
+        self.failUnless(pool2.closed)
+        self.failIf(pool1.closed)
+
+    def test_close(self):
+        registry = self._makeOne()
+        pool = registry.get('key')
+        registry.close()
+        self.failUnless(pool.closed)
+        self.assertEquals(registry.items(), [])
+
+
+class PoolMaintainerTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.pool import PoolMaintainer
+        return PoolMaintainer
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def test_maintain(self):
+        from dataflake.cache.simple import SimpleCache
+        from dataflake.ldapconnection.pool import PoolRegistry
+        cache = SimpleCache()
+        registry = PoolRegistry()
+        pool = registry.get('key')
+        conn = pool.checkout(FakeLDAPConnection)
+        pool.checkin(conn)
+        cache.set('pools', registry)
+        checked = []
+        maintainer = self._makeOne( cache
+                                  , 'maintainer'
+                                  , ('pools', 'missing')
+                                  , 60
+                                  , check=checked.append
+                                  )
+        maintainer.maintain()
+        self.assertEquals(checked, [conn])
+
+    def test_maintain_survives_errors(self):
+        import ldap
+        from dataflake.cache.simple import SimpleCache
+        from dataflake.ldapconnection.pool import PoolRegistry
+        cache = SimpleCache()
+        registry = PoolRegistry()
+        def factory():
+            raise ldap.INVALID_CREDENTIALS
+        registry.get('broken', min_size=1, factory=factory)
+        pool = registry.get('working')
+        conn = pool.checkout(FakeLDAPConnection)
+        pool.checkin(conn)
+        cache.set('pools', registry)
+        checked = []
+        maintainer = self._makeOne( cache
+                                  , 'maintainer'
+                                  , ('pools',)
+                                  , 60
+                                  , check=checked.append
+                                  )
+        maintainer.maintain()
+        self.assertEquals(checked, [conn])
+
+        # The next round probes the pools again
+        maintainer.maintain()
+        self.assertEquals(checked, [conn, conn])
+
+    def test_run_probes_until_stopped(self):
+        from dataflake.cache.simple import SimpleCache
+        from dataflake.ldapconnection.pool import PoolRegistry
+        cache = SimpleCache()
+        registry = PoolRegistry()
+        pool = registry.get('key')
+        pool.checkin(pool.checkout(FakeLDAPConnection))
+        cache.set('pools', registry)
+        probed = threading.Event()
+        def check(conn):
+            probed.set()
+        maintainer = self._makeOne( cache
+                                  , 'maintainer'
+                                  , ('pools',)
+                                  , 0.01
+                                  , check=check
+                                  )
+        cache.set('maintainer', maintainer)
+        maintainer.start()
+        probed.wait(5)
+        self.failUnless(probed.isSet())
+        maintainer.stop()
+        maintainer.join(5)
+        self.failIf(maintainer.isAlive())
+
+    def test_run_stops_when_replaced(self):
+        from dataflake.cache.simple import SimpleCache
+        cache = SimpleCache()
+        maintainer = self._makeOne(cache, 'maintainer', (), 0.01)
+        maintainer.start()
+        maintainer.join(5)
+        self.failIf(maintainer.isAlive())
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
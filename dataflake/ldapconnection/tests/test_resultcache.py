@@ -0,0 +1,121 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_resultcache: Tests for the ResultCache class
+
+$Id$
+"""
+
+import unittest
+
+class ResultCacheTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from dataflake.ldapconnection.resultcache import ResultCache
+        return ResultCache
+
+    def _makeOne(self, *args, **kw):
+        return self._getTargetClass()(*args, **kw)
+
+    def test_get_set(self):
+        cache = self._makeOne()
+        self.assertEquals(cache.get('key'), None)
+        self.assertEquals(cache.get('key', 'default'), 'default')
+        cache.set('key', 'dc=localhost', 'value')
+        self.assertEquals(cache.get('key'), 'value')
+        self.assertEquals(len(cache), 1)
+
+    def test_timeout(self):
+        cache = self._makeOne(timeout=0)
+        cache.set('key', 'dc=localhost', 'value')
+        self.assertEquals(cache.get('key'), None)
+        self.assertEquals(len(cache), 0)
+
+    def test_least_recently_used_dropped(self):
+        cache = self._makeOne(max_size=2)
+        cache.set('one', 'dc=localhost', 1)
+        cache.set('two', 'dc=localhost', 2)
+        cache.get('one')
+        cache.set('three', 'dc=localhost', 3)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('two'), None)
+        self.assertEquals(cache.get('one'), 1)
+        self.assertEquals(cache.get('three'), 3)
+
+    def test_set_existing_key(self):
+        cache = self._makeOne(max_size=2)
+        cache.set('one', 'dc=localhost', 1)
+        cache.set('two', 'dc=localhost', 2)
+        cache.set('one', 'dc=localhost', 'new')
+        self.assertEquals(len(cache), 2)
+        cache.set('three', 'dc=localhost', 3)
+        self.assertEquals(cache.get('two'), None)
+        self.assertEquals(cache.get('one'), 'new')
+
+    def test_invalidate_all(self):
+        cache = self._makeOne()
+        cache.set('one', 'dc=localhost', 1)
+        cache.set('two', 'ou=users,dc=localhost', 2)
+        cache.invalidate()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.get('one'), None)
+        cache.set('three', 'dc=localhost', 3)
+        self.assertEquals(cache.get('three'), 3)
+
+    def test_invalidate_ancestors(self):
+        cache = self._makeOne()
+        cache.set('root', '', 0)
+        cache.set('top', 'dc=localhost', 1)
+        cache.set('users', 'ou=users,dc=localhost', 2)
+        cache.set('record', 'cn=foo,ou=users,dc=localhost', 3)
+        cache.set('groups', 'ou=groups,dc=localhost', 4)
+        cache.set('similar', 'cn=xou=users,dc=localhost', 5)
+        cache.invalidate('cn=foo,ou=users,dc=localhost')
+        self.assertEquals(cache.get('root'), None)
+        self.assertEquals(cache.get('top'), None)
+        self.assertEquals(cache.get('users'), None)
+        self.assertEquals(cache.get('record'), None)
+        self.assertEquals(cache.get('groups'), 4)
+        self.assertEquals(cache.get('similar'), 5)
+
+    def test_invalidate_subtree(self):
+        cache = self._makeOne()
+        cache.set('top', 'dc=localhost', 1)
+        cache.set('users', 'ou=users,dc=localhost', 2)
+        cache.set('record', 'cn=foo,ou=users,dc=localhost', 3)
+        cache.set('groups', 'ou=groups,dc=localhost', 4)
+        cache.invalidate('ou=users,dc=localhost')
+        self.assertEquals(cache.get('record'), 3)
+        cache.invalidate('ou=users,dc=localhost', subtree=True)
+        self.assertEquals(cache.get('record'), None)
+        self.assertEquals(cache.get('groups'), 4)
+
+    def test_invalidate_without_ancestors(self):
+        cache = self._makeOne()
+        cache.set('top', 'dc=localhost', 1)
+        cache.set('users', 'ou=users,dc=localhost', 2)
+        cache.set('record', 'cn=foo,ou=users,dc=localhost', 3)
+        cache.invalidate('ou=users,dc=localhost', ancestors=False)
+        self.assertEquals(cache.get('top'), 1)
+        self.assertEquals(cache.get('users'), None)
+        self.assertEquals(cache.get('record'), 3)
+        cache.invalidate( 'dc=localhost'
+                        , subtree=True
+                        , ancestors=False
+                        )
+        self.assertEquals(len(cache), 0)
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
+
@@ -0,0 +1,110 @@
+##############################################################################
+#
+# Copyright (c) 2008-2010 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" test_schema: Tests for the schema helpers
+
+$Id$
+"""
+
+import unittest
+
+from dataflake.ldapconnection.schema import Subschema
+
+NAME = ( "( 2.5.4.41 NAME 'name' DESC 'RFC4519: common supertype' "
+         "EQUALITY caseIgnoreMatch SUBSTR caseIgnoreSubstringsMatch "
+         "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{32768} )" )
+CN = ( "( 2.5.4.3 NAME ( 'cn' 'commonName' ) "
+       "DESC 'RFC4519: common name(s) for which the entity is known by' "
+       "SUP name )" )
+CERT = ( "( 2.5.4.36 NAME 'userCertificate' "
+         "DESC 'RFC2256: X.509 user certificate, use ;binary' "
+         "EQUALITY certificateExactMatch "
+         "SYNTAX 1.3.6.1.4.1.1466.115.121.1.8 )" )
+PHOTO = ( "( 1.2.840.113556.1.4.7000.102.50725 NAME 'thumbnailPhoto' "
+          "SYNTAX '1.3.6.1.4.1.1466.115.121.1.40' SINGLE-VALUE )" )
+MYCERT = "( 1.1.1 NAME 'myCertificate' SUP userCertificate )"
+
+
+class SubschemaTests(unittest.TestCase):
+
+    def _makeOne(self, definitions=(NAME, CN, CERT, PHOTO, MYCERT)):
+        return Subschema(definitions)
+
+    def test_getAttributeType(self):
+        schema = self._makeOne()
+        info = schema.getAttributeType('commonName')
+        self.assertEquals(info.oid, '2.5.4.3')
+        self.assertEquals(info.names, ('cn', 'commonName'))
+        self.failUnless(schema.getAttributeType('CN') is info)
+        self.failUnless(schema.getAttributeType('2.5.4.3') is info)
+        self.failUnless(schema.getAttributeType('cn;lang-de') is info)
+        self.assertEquals(schema.getAttributeType('unknown'), None)
+
+    def test_inherited(self):
+        schema = self._makeOne()
+        self.assertEquals( schema.getSyntax('cn')
+                         , '1.3.6.1.4.1.1466.115.121.1.15'
+                         )
+        self.assertEquals(schema.getEquality('cn'), 'caseignorematch')
+        self.assertEquals( schema.getSyntax('myCertificate')
+                         , '1.3.6.1.4.1.1466.115.121.1.8'
+                         )
+        self.assertEquals(schema.getSyntax('unknown'), None)
+        self.assertEquals(schema.getEquality('unknown'), None)
+
+    def test_unknown_parent(self):
+        schema = self._makeOne((CN, MYCERT))
+        self.assertEquals(schema.getSyntax('cn'), None)
+        self.assertEquals(schema.getEquality('cn'), None)
+        self.assertEquals(schema.binary, frozenset())
+
+    def test_isSingleValued(self):
+        schema = self._makeOne()
+        self.failUnless(schema.isSingleValued('thumbnailPhoto'))
+        self.failIf(schema.isSingleValued('cn'))
+        self.failIf(schema.isSingleValued('unknown'))
+
+    def test_isBinary(self):
+        schema = self._makeOne()
+        self.failUnless(schema.isBinary('userCertificate;binary'))
+        self.failUnless(schema.isBinary('thumbnailphoto'))
+        self.failIf(schema.isBinary('cn'))
+
+    def test_getNormalizer(self):
+        schema = self._makeOne()
+        normalize = schema.getNormalizer('commonName')
+        self.assertEquals(normalize('Foo'), 'foo')
+        self.assertEquals(normalize(u'F\xd8\xd8'), u'f\xf8\xf8')
+        self.assertEquals(schema.getNormalizer('userCertificate'), None)
+        self.assertEquals(schema.getNormalizer('unknown'), None)
+
+    def test_save_load(self):
+        import os
+        import tempfile
+        from dataflake.ldapconnection.schema import load_subschema
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._makeOne().save(path)
+            schema = load_subschema(path)
+        finally:
+            os.remove(path)
+
+        self.assertEquals( schema.definitions
+                         , [NAME, CN, CERT, PHOTO, MYCERT]
+                         )
+        self.failUnless(schema.isBinary('myCertificate'))
+
+
+def test_suite():
+    import sys
+    return unittest.findTestCases(sys.modules[__name__])
@@ -17,10 +17,22 @@ $Id$
 
 import unittest
 
+from dataflake.ldapconnection.utils import ascii_compatible
+from dataflake.ldapconnection.utils import clear_dn_caches
+from dataflake.ldapconnection.utils import dn_cache_stats
 from dataflake.ldapconnection.utils import escape_dn
+from dataflake.ldapconnection.utils import is_ascii
+from dataflake.ldapconnection.utils import normalize_dn
+from dataflake.ldapconnection.utils import parse_dn
 
 class UtilsTest(unittest.TestCase):
 
+    def setUp(self):
+        clear_dn_caches()
+
+    def tearDown(self):
+        clear_dn_caches()
+
     def test_escape_dn(self):
         # http://www.dataflake.org/tracker/issue_00623
         dn = 'cn="Joe Miller, Sr.", ou="odds+sods <1>", dc="host;new"'
@@ -29,6 +41,117 @@ class UtilsTest(unittest.TestCase):
 
         self.assertEquals(escape_dn(None), None)
 
+    def test_escape_dn_cached(self):
+        dn = 'cn="Joe Miller, Sr.",dc=localhost'
+        self.assertEquals(escape_dn(dn), 'cn=Joe Miller\\, Sr.,dc=localhost')
+        self.assertEquals(escape_dn(dn), 'cn=Joe Miller\\, Sr.,dc=localhost')
+        stats = dn_cache_stats()['escape']
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['size'], 1)
+
+        # Unicode DNs are cached separately
+        self.failUnless(isinstance(escape_dn(u'cn=foo'), unicode))
+        self.failUnless(isinstance(escape_dn('cn=foo'), str))
+
+        clear_dn_caches()
+        stats = dn_cache_stats()['escape']
+        self.assertEquals((stats['hits'], stats['size']), (0, 0))
+
+    def test_parse_dn(self):
+        parsed = parse_dn('cn=foo,dc=localhost')
+        self.assertEquals( parsed
+                         , [[('cn', 'foo', 1)], [('dc', 'localhost', 1)]]
+                         )
+
+        # Changing the result does not change the cached value
+        parsed[0] = [('cn', 'bar', 1)]
+        parsed[1].append(('o', 'x', 1))
+        self.assertEquals( parse_dn('cn=foo,dc=localhost')
+                         , [[('cn', 'foo', 1)], [('dc', 'localhost', 1)]]
+                         )
+        self.assertEquals(dn_cache_stats()['parse']['hits'], 1)
+
+    def test_normalize_dn(self):
+        self.assertEquals(normalize_dn('CN=Foo, DC=localhost'), 
+                          'cn=foo,dc=localhost')
+        self.assertEquals(normalize_dn('CN=Foo, DC=localhost'), 
+                          'cn=foo,dc=localhost')
+        self.assertEquals(normalize_dn(None), None)
+        self.assertEquals(dn_cache_stats()['normalize']['hits'], 1)
+
+    def test_is_ascii(self):
+        self.failUnless(is_ascii(''))
+        self.failUnless(is_ascii('cn=foo,dc=localhost'))
+        self.failIf(is_ascii('cn=f\xc3\xb8\xc3\xb8'))
+
+    def test_ascii_compatible(self):
+        self.failUnless(ascii_compatible('UTF-8'))
+        self.failUnless(ascii_compatible('iso-8859-15'))
+        self.failIf(ascii_compatible('UTF-16'))
+        self.failIf(ascii_compatible('unknown-encoding'))
+        self.failIf(ascii_compatible(None))
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def _makeOne(self, *args, **kw):
+        from dataflake.ldapconnection.utils import LRUCache
+        return LRUCache(*args, **kw)
+
+    def test_get_set(self):
+        cache = self._makeOne()
+        self.assertEquals(cache.get('a'), None)
+        self.assertEquals(cache.get('a', 'default'), 'default')
+        cache.set('a', 1)
+        self.assertEquals(cache.get('a'), 1)
+        cache.set('a', 2)
+        self.assertEquals(cache.get('a'), 2)
+        self.assertEquals(len(cache), 1)
+        self.assertEquals( cache.stats()
+                         , { 'hits': 2
+                           , 'misses': 2
+                           , 'size': 1
+                           , 'max_size': 5000
+                           }
+                         )
+
+    def test_least_recently_used_dropped(self):
+        cache = self._makeOne(max_size=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertEquals(len(cache), 3)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.get('a'), 'a')
+        self.assertEquals(cache.get('c'), 'c')
+        self.assertEquals(cache.get('d'), 'd')
+
+        cache.set('e', 'e')
+        self.assertEquals(cache.get('a'), None)
+        self.assertEquals(len(cache), 3)
+
+    def test_set_existing_key_is_used(self):
+        cache = self._makeOne(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 3)
+        cache.set('c', 4)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.get('a'), 3)
+        self.assertEquals(len(cache), 2)
+
+    def test_clear(self):
+        cache = self._makeOne(max_size=2)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.get('a'), None)
+        self.assertEquals(cache.stats()['hits'], 0)
+        cache.set('b', 2)
+        self.assertEquals(cache.get('b'), 2)
 
 def test_suite():
     import sys
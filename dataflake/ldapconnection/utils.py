@@ -15,15 +15,218 @@
 $Id: utils.py 1485 2008-06-04 16:08:38Z jens $
 """
 
+import re
+from threading import Lock
+
 import ldap
 
 BINARY_ATTRIBUTES = ('objectguid', 'jpegphoto')
 
+ASCII_CHARACTERS = ''.join([chr(x) for x in range(128)])
+NON_ASCII = re.compile('[\x80-\xff]')
+_ascii_encodings = {}
+
+def is_ascii(value):
+    """ Return True if the byte string `value` only contains ASCII
+    """
+    return NON_ASCII.search(value) is None
+
+def ascii_compatible(encoding):
+    """ Return True if `encoding` encodes ASCII characters as themselves
+
+    This is true for UTF-8 and the ISO-8859 encodings, but not for e.g. 
+    UTF-16. Pure ASCII strings are identical in all of these encodings.
+    """
+    if not encoding:
+        return False
+
+    compatible = _ascii_encodings.get(encoding)
+    if compatible is None:
+        try:
+            decoded = ASCII_CHARACTERS.decode(encoding)
+            compatible = decoded == unicode(ASCII_CHARACTERS)
+        except (LookupError, UnicodeError):
+            compatible = False
+        _ascii_encodings[encoding] = compatible
+
+    return compatible
+
+# Maximum number of DNs remembered by each of the DN caches
+DN_CACHE_SIZE = 5000
+
+
+class LRUCache(object):
+    """ Bounded cache dropping the least recently used values
+
+    Lookups and stores take constant time, the entries form a circular
+    doubly linked list ordered by last use. Hits and misses are counted.
+    """
+
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size=DN_CACHE_SIZE):
+        self.max_size = max(max_size, 1)
+        self.lock = Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """ Drop all values and reset the counters
+        """
+        self.lock.acquire()
+        try:
+            self.entries = {}
+            self.root = root = []
+            root[:] = [root, root, None, None]
+            self.hits = self.misses = 0
+        finally:
+            self.lock.release()
+
+    def get(self, key, default=None):
+        """ Get the value stored under `key`, or `default`
+        """
+        self.lock.acquire()
+        try:
+            link = self.entries.get(key)
+            if link is not None and self._expired(link[self.VALUE]):
+                self._remove(link)
+                link = None
+
+            if link is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            # Move the entry to the most recently used end
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """ Store `value` under `key`
+        """
+        self.lock.acquire()
+        try:
+            link = self.entries.get(key)
+            if link is None:
+                link = self.entries[key] = [None, None, key, value]
+            else:
+                self._unlink(link)
+                link[self.VALUE] = value
+            self._append(link)
+
+            while len(self.entries) > self.max_size:
+                self._remove(self.root[self.NEXT])
+        finally:
+            self.lock.release()
+
+    def _expired(self, value):
+        """ Return True if `value` must not be handed out any more
+
+        Values never expire here, subclasses may override this.
+        """
+        return False
+
+    def _append(self, link):
+        """ Link an entry in at the most recently used end
+
+        Must be called with the lock held.
+        """
+        root = self.root
+        last = root[self.PREV]
+        link[self.PREV] = last
+        link[self.NEXT] = root
+        last[self.NEXT] = root[self.PREV] = link
+
+    def _unlink(self, link):
+        """ Take an entry out of the list, must be called with the lock held
+        """
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _remove(self, link):
+        """ Drop an entry, must be called with the lock held
+        """
+        self._unlink(link)
+        del self.entries[link[self.KEY]]
+
+    def stats(self):
+        """ Get the counters as a mapping
+        """
+        return { 'hits': self.hits
+               , 'misses': self.misses
+               , 'size': len(self.entries)
+               , 'max_size': self.max_size
+               }
+
+
+_escape_cache = LRUCache()
+_parse_cache = LRUCache()
+_normalize_cache = LRUCache()
+
+def dn_cache_stats():
+    """ Get the counters of the DN caches
+
+    Returns a mapping of cache name ('escape', 'parse', 'normalize') 
+    to a mapping with the keys 'hits', 'misses', 'size', 'max_size'.
+    """
+    return { 'escape': _escape_cache.stats()
+           , 'parse': _parse_cache.stats()
+           , 'normalize': _normalize_cache.stats()
+           }
+
+def clear_dn_caches():
+    """ Drop all cached DNs and reset the counters
+    """
+    for cache in (_escape_cache, _parse_cache, _normalize_cache):
+        cache.clear()
+
 def escape_dn(dn):
     """ Escape all characters that need escaping for a DN, see RFC 2253 
+
+    Results are kept in a bounded cache, the same DNs come up again and
+    again.
+    """
+    if dn is None:
+        return None
+
+    # Unicode and byte strings with equal contents are different DNs
+    key = (dn.__class__, dn)
+    escaped = _escape_cache.get(key)
+    if escaped is None:
+        escaped = ldap.dn.dn2str(ldap.dn.str2dn(dn))
+        _escape_cache.set(key, escaped)
+
+    return escaped
+
+def parse_dn(dn):
+    """ Split a DN into its RDNs like ldap.dn.str2dn
+
+    The result is a new list which may be changed by the caller.
+    """
+    key = (dn.__class__, dn)
+    parsed = _parse_cache.get(key)
+    if parsed is None:
+        parsed = tuple([tuple(x) for x in ldap.dn.str2dn(dn)])
+        _parse_cache.set(key, parsed)
+
+    return [list(x) for x in parsed]
+
+def normalize_dn(dn):
+    """ Escape a DN and lowercase it for comparisons and cache keys
     """
     if dn is None:
         return None
 
-    return ldap.dn.dn2str(ldap.dn.str2dn(dn))
+    key = (dn.__class__, dn)
+    normalized = _normalize_cache.get(key)
+    if normalized is None:
+        normalized = escape_dn(dn).lower()
+        _normalize_cache.set(key, normalized)
+
+    return normalized
 